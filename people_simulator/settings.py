@@ -160,4 +160,141 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'persona_csv_files')
-MEDIA_URL = '/persona_csv_files/'
\ No newline at end of file
+MEDIA_URL = '/persona_csv_files/'
+
+# Background workers
+# Number of personas evaluated concurrently by the emotion aggregation worker.
+AGGREGATION_CONCURRENCY = int(os.getenv("AGGREGATION_CONCURRENCY", 8))
+# Personas packed into one LLM request by the aggregation worker (1 disables
+# batching, 0 picks the largest batch that fits the model's context window).
+AGGREGATION_BATCH_SIZE = int(os.getenv("AGGREGATION_BATCH_SIZE", 1))
+# 'interactive' calls the LLM per persona; 'batch' submits the whole aggregation to the
+# provider's batch API and ingests the results when they are ready; 'sample' evaluates a
+# stratified random sample in rounds of ROUND_SIZE personas until every overall 'CONFIDENCE'
+# interval is within +/- MARGIN or BUDGET personas were evaluated, and reports estimates;
+# 'archetype' evaluates SAMPLES personas per demographic combination (split further by
+# DESCRIPTION_BITS bits of a description SimHash) and gives their answers to the others;
+# 'surrogate' labels LABELED personas with the LLM, trains a classifier on them and predicts
+# the others, escalating predictions less probable than THRESHOLD to the LLM.
+AGGREGATION_MODE = os.getenv("AGGREGATION_MODE", "interactive")
+AGGREGATION_SAMPLING = {
+    'CONFIDENCE': float(os.getenv("AGGREGATION_SAMPLING_CONFIDENCE", 0.95)),
+    'MARGIN': float(os.getenv("AGGREGATION_SAMPLING_MARGIN", 0.02)),
+    'BUDGET': int(os.getenv("AGGREGATION_SAMPLING_BUDGET", 5000)),
+    'ROUND_SIZE': int(os.getenv("AGGREGATION_SAMPLING_ROUND_SIZE", 200)),
+}
+AGGREGATION_ARCHETYPES = {
+    'SAMPLES': int(os.getenv("AGGREGATION_ARCHETYPE_SAMPLES", 1)),
+    'DESCRIPTION_BITS': int(os.getenv("AGGREGATION_ARCHETYPE_DESCRIPTION_BITS", 0)),
+}
+AGGREGATION_SURROGATE = {
+    'LABELED': int(os.getenv("AGGREGATION_SURROGATE_LABELED", 500)),
+    'HOLDOUT': float(os.getenv("AGGREGATION_SURROGATE_HOLDOUT", 0.2)),
+    'THRESHOLD': float(os.getenv("AGGREGATION_SURROGATE_THRESHOLD", 0.6)),
+    'MAX_ESCALATIONS': int(os.getenv("AGGREGATION_SURROGATE_MAX_ESCALATIONS", 1000)),
+}
+# EmotionalResponse rows are written in bulk; the buffer and the progress counter are
+# flushed every AGGREGATION_FLUSH_ROWS rows or AGGREGATION_FLUSH_SECONDS seconds.
+AGGREGATION_FLUSH_ROWS = int(os.getenv("AGGREGATION_FLUSH_ROWS", 200))
+AGGREGATION_FLUSH_SECONDS = float(os.getenv("AGGREGATION_FLUSH_SECONDS", 2))
+# Minimum seconds between the partial summaries published while an aggregation runs
+AGGREGATION_PARTIAL_SUMMARY_SECONDS = float(os.getenv("AGGREGATION_PARTIAL_SUMMARY_SECONDS", 10))
+# Aggregation and persona generation jobs are claimed from the WorkerJob table under a
+# lease, renewed every JOB_HEARTBEAT_SECONDS. A job whose lease expired (its worker died)
+# is claimed again, at most JOB_MAX_ATTEMPTS times in total.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 120))
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", 30))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Idle workers are woken when a job is queued (NOTIFY on PostgreSQL, in-process events
+# otherwise) and rescan the queue at least every JOB_IDLE_WAIT_SECONDS. Other databases
+# cannot signal a worker running in a separate process, so there idle workers rescan
+# every JOB_POLL_SECONDS instead.
+JOB_IDLE_WAIT_SECONDS = int(os.getenv("JOB_IDLE_WAIT_SECONDS", 60))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1))
+# Demographics-based generation creates the personas first, in bulk batches of
+# PERSONA_BULK_BATCH_SIZE, then a separate stage fills in their descriptions with
+# PERSONA_DESCRIPTION_CONCURRENCY concurrent LLM calls (within the provider limits below).
+PERSONA_BULK_BATCH_SIZE = int(os.getenv("PERSONA_BULK_BATCH_SIZE", 500))
+PERSONA_DESCRIPTION_CONCURRENCY = int(os.getenv("PERSONA_DESCRIPTION_CONCURRENCY", 8))
+# Personas whose description failed stay pending; the stage runs again after
+# PERSONA_DESCRIPTION_RETRY_SECONDS, at most PERSONA_DESCRIPTION_MAX_RUNS times per task.
+PERSONA_DESCRIPTION_RETRY_SECONDS = int(os.getenv("PERSONA_DESCRIPTION_RETRY_SECONDS", 300))
+PERSONA_DESCRIPTION_MAX_RUNS = int(os.getenv("PERSONA_DESCRIPTION_MAX_RUNS", 3))
+# CSV uploads are read, described and inserted CSV_CHUNK_ROWS rows at a time.
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", 1000))
+# Backends per provider (simulator/utils/llm_batch.py) and the directory used by the
+# local file-based stand-in.
+LLM_BATCH_BACKENDS = {}
+LLM_BATCH_LOCAL_DIR = os.path.join(BASE_DIR, 'batch_jobs')
+# Times the requests that failed inside a provider batch are submitted again.
+AGGREGATION_BATCH_RESUBMITS = int(os.getenv("AGGREGATION_BATCH_RESUBMITS", 2))
+EMOTION_BATCH_MAX_SIZE = int(os.getenv("EMOTION_BATCH_MAX_SIZE", 25))
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", 8192))
+
+# Maximum number of in-flight requests per LLM provider, shared by every
+# background worker running in this process.
+LLM_PROVIDER_CONCURRENCY = {
+    'openai': int(os.getenv("OPENAI_CONCURRENCY", 8)),
+    'anthropic': int(os.getenv("ANTHROPIC_CONCURRENCY", 8)),
+    'google': int(os.getenv("GEMINI_CONCURRENCY", 8)),
+    'fake': int(os.getenv("FAKE_CONCURRENCY", 64)),
+}
+
+# Provider quotas enforced by the adaptive limiter (simulator/utils/provider_limits.py);
+# 0 disables a limit. Concurrency starts at half of LLM_PROVIDER_CONCURRENCY and adapts
+# to the provider's 429/overload responses.
+LLM_PROVIDER_RATE_LIMITS = {
+    'openai': {
+        'REQUESTS_PER_MINUTE': int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 0)),
+        'TOKENS_PER_MINUTE': int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 0)),
+    },
+    'anthropic': {
+        'REQUESTS_PER_MINUTE': int(os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE", 0)),
+        'TOKENS_PER_MINUTE': int(os.getenv("ANTHROPIC_TOKENS_PER_MINUTE", 0)),
+    },
+    'google': {
+        'REQUESTS_PER_MINUTE': int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 0)),
+        'TOKENS_PER_MINUTE': int(os.getenv("GEMINI_TOKENS_PER_MINUTE", 0)),
+    },
+}
+
+# Timeouts, retries and circuit breaking for LLM calls (see simulator/utils/llm_resilience.py)
+LLM_RESILIENCE = {
+    'REQUEST_TIMEOUT': int(os.getenv("LLM_REQUEST_TIMEOUT", 60)),
+    'DEADLINE': int(os.getenv("LLM_CALL_DEADLINE", 180)),
+    'MAX_ATTEMPTS': int(os.getenv("LLM_MAX_ATTEMPTS", 4)),
+    'BREAKER_FAILURE_THRESHOLD': int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 5)),
+    'BREAKER_RESET_SECONDS': int(os.getenv("LLM_BREAKER_RESET_SECONDS", 30)),
+}
+
+# Hedged requests (see simulator/utils/llm_hedging.py): duplicate calls slower than the
+# PERCENTILE of recent latencies, optionally to another LLMModelAndKey (by model name)
+# that supports the same tools.
+LLM_HEDGING = {
+    'ENABLED': os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true",
+    'PERCENTILE': int(os.getenv("LLM_HEDGING_PERCENTILE", 95)),
+    'MAX_HEDGE_RATE': float(os.getenv("LLM_HEDGING_MAX_RATE", 0.1)),
+    'SECONDARY_MODEL': os.getenv("LLM_HEDGING_SECONDARY_MODEL") or None,
+}
+
+# Offline 'fake' provider for load tests and benchmarks (see simulator/utils/ask_fake.py)
+LLM_FAKE_PROVIDER = {
+    'LATENCY_MEDIAN': float(os.getenv("FAKE_LLM_LATENCY_MEDIAN", 0.5)),
+    'LATENCY_SIGMA': float(os.getenv("FAKE_LLM_LATENCY_SIGMA", 0.5)),
+    'ERROR_RATE': float(os.getenv("FAKE_LLM_ERROR_RATE", 0.0)),
+    'RATE_LIMIT_RATE': float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", 0.0)),
+    'SEED': int(os.environ["FAKE_LLM_SEED"]) if os.getenv("FAKE_LLM_SEED") else None,
+}
+
+# Shared LLM client connection pools (see simulator/utils/llm_clients.py)
+LLM_HTTP_POOL_SIZE = int(os.getenv("LLM_HTTP_POOL_SIZE", 20))
+LLM_HTTP_KEEPALIVE_EXPIRY = int(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", 60))
+
+# Content-addressed LLM response cache (see simulator/utils/llm_cache.py). Off by
+# default: a repeated simulation is expected to resample the model, not replay answers.
+LLM_RESPONSE_CACHE = {
+    'ENABLED': os.getenv("LLM_RESPONSE_CACHE_ENABLED", "false").lower() == "true",
+    'TTL_SECONDS': int(os.getenv("LLM_RESPONSE_CACHE_TTL", 7 * 24 * 60 * 60)),
+    'MAX_ENTRIES': int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", 50000)),
+    'MEMORY_ENTRIES': 1024,
+}
@@ -16,7 +16,9 @@ from simulator.models import (
     LLMModelAndKey,
     PromptModel,
     RawPersonaModel,
-    OptimizedResponse
+    OptimizedResponse,
+    LLMResponseCache,
+    WorkerJob
 )
 admin.site.register(Persona)
 admin.site.register(Category)
@@ -31,6 +33,8 @@ admin.site.register(LLMModelAndKey)
 admin.site.register(PromptModel)
 admin.site.register(RawPersonaModel)
 admin.site.register(OptimizedResponse)
+admin.site.register(LLMResponseCache)
+admin.site.register(WorkerJob)
 
 
 
@@ -7,6 +7,7 @@ import os
 import IPython
 import threading
 from django.apps import AppConfig
+from django.conf import settings
 from django.core.management import call_command
 from django.db import connection
 
@@ -32,7 +33,10 @@ class SimulatorConfig(AppConfig):
                 aggregate emotions background task starting
                 """
                 try:
-                    call_command('aggregate_emotions')
+                    call_command(
+                        'aggregate_emotions',
+                        concurrency=getattr(settings, 'AGGREGATION_CONCURRENCY', 1)
+                    )
                 except Exception as e:
                     print(f"Failed to start emotion aggregation: {e}")
 
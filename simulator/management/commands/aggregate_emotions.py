@@ -7,23 +7,81 @@ import logging
 import time
 import os
 import sys
+import json
+import tempfile
+from contextvars import copy_context
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from django.db.models import F
+from django.db import connections
 from simulator.models import (
     AggregateEmotion,
     EmotionalResponse,
     NewsItem,
     Persona,
-    Category,
     PossibleUserResponses,
     PersonaGenerationTask
 )
-from simulator.utils.impact_assesment_helper import generate_emotional_response
+from simulator.utils.llm_errors import CircuitOpenError
+from simulator.utils.llm_hedging import get_hedging_settings, get_hedging_stats
+from simulator.utils.llm_usage import UsageMeter, metered
+from simulator.utils.llm_batch import FAILED, IN_PROGRESS, get_batch_backend, write_batch_files
+from simulator.utils.response_writer import EmotionalResponseWriter
+from simulator.utils.demographic_index import DemographicIndex
+from simulator.utils.archetypes import (
+    INFERRED_EXPLANATION,
+    fill_archetype,
+    get_archetype_settings,
+    group_archetypes
+)
+from simulator.utils.surrogate import (
+    PREDICTED_EXPLANATION,
+    SoftmaxRegression,
+    build_features,
+    fit_ridge,
+    get_surrogate_settings,
+    holdout_metrics,
+    predict_ridge
+)
+from simulator.utils.sampling import (
+    STOPPED_BUDGET,
+    STOPPED_MARGIN,
+    STOPPED_POPULATION,
+    StratifiedSample,
+    get_sampling_settings
+)
+from simulator.utils.summary_engine import PartialSummaryPublisher, compute_summaries
+from simulator.utils.job_queue import (
+    AGGREGATION_JOB,
+    COMPLETED as JOB_COMPLETED,
+    FAILED as JOB_FAILED,
+    PENDING as JOB_PENDING,
+    LeaseLost,
+    check_lease,
+    enqueue_missing,
+    process_next_job
+)
+from simulator.utils.job_signals import wait_for_jobs
+from simulator.utils.impact_assesment_helper import (
+    format_persona_details,
+    generate_emotional_response,
+    generate_emotional_responses_batch,
+    get_active_model,
+    get_possible_responses,
+    get_user_response_template,
+    render_user_response_prompt,
+    resolve_batch_size,
+    validate_emotional_response
+)
 
 # Logging setup
 logger = logging.getLogger(__name__)
 
+# Aggregation modes that only send part of the personas to the LLM
+SELECTION_STRATEGIES = ('sample', 'archetype', 'surrogate')
+
 class Command(BaseCommand):
     """Command defining class for emotion aggregation"""
     help = 'Run emotion aggregation as a background process'
@@ -38,14 +96,73 @@ class Command(BaseCommand):
         parser.add_argument(
             '--interval',
             type=int,
-            default=15,
-            help='Interval between processing cycles (in seconds)'
+            default=getattr(settings, 'JOB_IDLE_WAIT_SECONDS', 60),
+            help='Maximum interval between queue scans while idle (in seconds); '
+                 'queued aggregations wake the worker immediately'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=getattr(settings, 'AGGREGATION_CONCURRENCY', 1),
+            help='Number of personas evaluated concurrently'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['interactive', 'batch', 'sample', 'archetype', 'surrogate'],
+            default=getattr(settings, 'AGGREGATION_MODE', 'interactive'),
+            help="'interactive' calls the LLM per persona; 'batch' uses the provider's batch API; "
+                 "'sample' evaluates a stratified sample until the confidence intervals are narrow enough; "
+                 "'archetype' evaluates a few personas per demographic combination and weights them; "
+                 "'surrogate' predicts most personas with a classifier trained on LLM answers"
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'AGGREGATION_BATCH_SIZE', 1),
+            help='Personas packed into one LLM request (1 disables batching, 0 sizes batches automatically)'
         )
 
     def handle(self, *args, **options):
         # Retrieve command options
         specified_city = options.get('city')
         interval = options.get('interval')
+        concurrency = options.get('concurrency')
+        batch_size = options.get('batch_size')
+        mode = options.get('mode')
+
+        def run_aggregation_job(job, lost):
+            """Runs (or, in batch mode, advances) one claimed aggregation"""
+            aggregate_emotion = AggregateEmotion.objects.select_related('news_item').get(id=job.object_id)
+            if aggregate_emotion.summary.get('status') != 'Processing':
+                return JOB_COMPLETED
+
+            logger.info("Processing aggregation for city: %s, news item: %s, id: %d",
+                        aggregate_emotion.city, aggregate_emotion.news_item.title, aggregate_emotion.id)
+            if mode == 'batch':
+                # Submits, polls or ingests the job's provider batch
+                aggregate_emotion_batch_task(
+                    aggregate_emotion.city,
+                    aggregate_emotion.news_item.title,
+                    aggregate_emotion.id
+                )
+            else:
+                # Call the existing emotion aggregation logic
+                aggregate_emotion_task(
+                    aggregate_emotion.city,
+                    aggregate_emotion.news_item.title,
+                    aggregate_emotion.id,
+                    concurrency=concurrency,
+                    batch_size=batch_size,
+                    strategy=mode if mode in SELECTION_STRATEGIES else 'all',
+                    lease_lost=lost
+                )
+
+            status = AggregateEmotion.objects.get(id=job.object_id).summary.get('status')
+            if status == 'completed':
+                logger.info("Successfully processed aggregation for city: %s", aggregate_emotion.city)
+                return JOB_COMPLETED
+            # A submitted provider batch is polled again on a later cycle
+            return JOB_PENDING if status == 'Processing' else JOB_FAILED
 
         def process_pending_aggregations():
             while True:
@@ -61,28 +178,22 @@ class Command(BaseCommand):
                         logger.info("Filtering aggregation requests for city: %s", specified_city)
                         pending_query = pending_query.filter(city=specified_city)
 
-                    if not pending_query.exists():
+                    # Aggregations started without going through the views get a job too
+                    enqueue_missing(AGGREGATION_JOB, pending_query.values_list('id', flat=True))
+
+                    # Claim one job at a time so other workers can share the queue
+                    job = process_next_job(
+                        AGGREGATION_JOB,
+                        run_aggregation_job,
+                        object_ids=pending_query.values('id') if specified_city else None,
+                        on_give_up=mark_aggregation_abandoned,
+                        requeue_delay=interval,
+                        on_error=mark_aggregation_failed
+                    )
+                    if job is None:
                         logger.info("No pending aggregation requests found.")
-                        time.sleep(interval)
-                        continue
-
-                    # Process each pending aggregation
-                    for aggregate_emotion in pending_query:
-                        logger.info("Processing aggregation for city: %s, news item: %s, id: %d",
-                                    aggregate_emotion.city, aggregate_emotion.news_item.title, aggregate_emotion.id)
-                        try:
-                            # Call the existing emotion aggregation logic
-                            aggregate_emotion_task(
-                                aggregate_emotion.city,
-                                aggregate_emotion.news_item.title,
-                                aggregate_emotion.id
-                            )
-                            logger.info("Successfully processed aggregation for city: %s", aggregate_emotion.city)
-                        except Exception as e:
-                            logger.error("Error processing aggregation for %s: %s", aggregate_emotion.city, e)
-
-                    # Sleep between processing cycles
-                    time.sleep(interval)
+                        # Sleep until a view queues an aggregation (or the interval passes)
+                        wait_for_jobs(AGGREGATION_JOB, interval)
 
                 except Exception as e:
                     logger.error(f"Unexpected error in aggregation process: {e}")
@@ -117,10 +228,397 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.SUCCESS('Stopping emotion aggregation')
             )
-def aggregate_emotion_task(city_name, news_item_title, aggregate_emotion_id):
+
+# Prefix of the custom_id of each persona's request in batch-API mode
+BATCH_CUSTOM_ID_PREFIX = 'persona-'
+# Rows read, written or rendered per chunk in batch-API mode
+BATCH_INGEST_CHUNK_SIZE = 1000
+
+# Number of personas inspected to estimate the size of a persona block when batches are auto-sized
+BATCH_SIZE_SAMPLE = 20
+
+def mark_aggregation_abandoned(job):
+    """
+    Fails the aggregation of a job whose workers kept dying before finishing it.
+    """
+    aggregate_emotion = AggregateEmotion.objects.filter(id=job.object_id).first()
+    if aggregate_emotion is not None:
+        aggregate_emotion.summary['status'] = 'failed'
+        aggregate_emotion.summary['error'] = "Aggregation was abandoned by its worker too many times"
+        aggregate_emotion.save(update_fields=['summary', 'updated_at'])
+
+def mark_aggregation_failed(job, error):
+    """
+    Fails the aggregation of a job whose handler raised, so it doesn't stay 'Processing'
+    with a failed job that enqueue_missing never replaces.
+    """
+    aggregate_emotion = AggregateEmotion.objects.filter(id=job.object_id).first()
+    if aggregate_emotion is not None and aggregate_emotion.summary.get('status') == 'Processing':
+        aggregate_emotion.summary['status'] = 'failed'
+        aggregate_emotion.summary['error'] = str(error)
+        aggregate_emotion.save(update_fields=['summary', 'updated_at'])
+
+def evaluate_personas(personas, news_item, concurrency=1, batch_size=1, demographic_index=None):
+    """
+    Generates emotional responses for personas using a bounded worker pool.
+
+    LLM calls run on up to `concurrency` threads while results are yielded back to
+    the calling thread as they complete, so summary bookkeeping and database writes
+    stay single-threaded. With a batch size above 1 each worker call evaluates a
+    batch of personas in one request; 0 picks the batch size from the model's context.
+    Persona blocks are rendered from `demographic_index` when one is given.
+
+    Yields:
+        tuple: (persona, result) where result is the value returned by
+        generate_emotional_response or the exception it raised
+    """
+    persona_iter = iter(personas)
+
+    if batch_size == 1:
+        units = ([persona] for persona in persona_iter)
+
+        def evaluate(unit):
+            try:
+                return [(unit[0], generate_emotional_response(unit[0], news_item, demographic_index))]
+            except Exception as e:
+                return [(unit[0], e)]
+    else:
+        if batch_size <= 0:
+            sample = list(islice(persona_iter, BATCH_SIZE_SAMPLE))
+            batch_size = resolve_batch_size(news_item, sample, demographic_index)
+            logger.info("Using automatic batch size of %d personas", batch_size)
+            persona_iter = chain(sample, persona_iter)
+        units = iter(lambda: list(islice(persona_iter, batch_size)), [])
+
+        def evaluate(unit):
+            try:
+                return generate_emotional_responses_batch(unit, news_item, demographic_index)
+            except Exception as e:
+                return [(persona, e) for persona in unit]
+
+    if concurrency <= 1:
+        for unit in units:
+            yield from evaluate(unit)
+        return
+
+    def evaluate_in_worker(unit):
+        try:
+            return evaluate(unit)
+        finally:
+            # Worker threads get their own DB connections; don't leak them
+            connections.close_all()
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Keep at most two submissions per worker queued so memory stays bounded
+        # regardless of the city size
+        while True:
+            while len(in_flight) < concurrency * 2:
+                unit = next(units, None)
+                if unit is None:
+                    break
+                # Run in a copy of this context so the job's usage meter is visible to the worker
+                in_flight[executor.submit(copy_context().run, evaluate_in_worker, unit)] = unit
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = in_flight.pop(future)
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    for persona in unit:
+                        yield persona, e
+
+def select_personas(city_name, aggregate_emotion):
+    """
+    Returns (personas, all_personas): the personas to evaluate and every persona of the city.
+
+    When the city's latest completed generation task recorded a population, only that
+    many personas are evaluated and the aggregation's total_responses is set to it.
+    """
+    # Find the original task to get the intended population size
+    original_task = PersonaGenerationTask.objects.filter(
+        city_name=city_name, 
+        status='completed'
+    ).order_by('-created_at').first()
+    
+    # Get all personas for this city, in a stable order so a resumed run selects the same ones
+    all_personas = Persona.objects.filter(city=city_name).order_by('id')
+    
+    # If we found the original task with a population count, limit personas to that number
+    if original_task and original_task.population:
+        logger.info(f"Found original task with population {original_task.population}, limiting personas")
+        # Take only the first N personas matching the original requested population
+        personas = all_personas[:original_task.population]
+        # Update the total_responses in aggregate_emotion to match the correct count
+        aggregate_emotion.total_responses = original_task.population
+        aggregate_emotion.save()
+    else:
+        # Fallback if no task is found
+        logger.warning(f"No original task found for {city_name}, using all personas")
+        personas = all_personas
+    return personas, all_personas
+
+def exclude_answered(personas, news_item):
+    """
+    Returns the personas that have no EmotionalResponse to the news item yet, so a run
+    interrupted by a crash or restart continues where it stopped instead of asking
+    (and paying for) every persona again. Stored answers belong to the current run: the
+    aggregate_emotion view deletes the previous run's answers when it starts a new one.
+    """
+    answered = EmotionalResponse.objects.filter(news_item=news_item).values('persona_id')
+    return Persona.objects.filter(id__in=personas.values('id')).exclude(id__in=answered).order_by('id')
+
+def sample_personas(aggregate_emotion, personas, news_item, demographic_index, evaluate_round, writer):
+    """
+    Evaluates a stratified sample of the personas in rounds, until the overall confidence
+    intervals are within the sampling margin, the budget is spent or every persona answered.
+
+    Args:
+        evaluate_round: Function evaluating and recording a queryset of personas
+        writer: The run's EmotionalResponseWriter, flushed before each interval check
+
+    Returns:
+        tuple: (StratifiedSample, sampling settings, reason the sampling stopped)
+    """
+    sampling_settings = get_sampling_settings()
+    budget = sampling_settings['BUDGET']
+    # Seeded by the aggregation so a resumed run walks the same sample
+    sample = StratifiedSample(personas.values_list('id', flat=True), demographic_index, seed=aggregate_emotion.id)
+    answered = set(EmotionalResponse.objects.filter(news_item=news_item).values_list('persona_id', flat=True))
+    AggregateEmotion.objects.filter(id=aggregate_emotion.id).update(
+        total_responses=min(budget, sample.population)
+    )
+
+    while True:
+        writer.flush()
+        response_summary, demographic_summary, _ = compute_summaries(news_item, aggregate_emotion.city)
+        margin = sample.estimate(response_summary, demographic_summary, sampling_settings['CONFIDENCE'])
+        if margin <= sampling_settings['MARGIN']:
+            stopped = STOPPED_MARGIN
+            break
+        if sample.exhausted:
+            stopped = STOPPED_POPULATION
+            break
+        if sample.drawn >= budget:
+            stopped = STOPPED_BUDGET
+            break
+        round_ids = sample.next_round(min(sampling_settings['ROUND_SIZE'], budget - sample.drawn), answered)
+        if round_ids:
+            evaluate_round(Persona.objects.filter(id__in=round_ids).order_by('id'))
+
+    logger.info("Sampling of aggregation %d stopped (%s) after %d of %d personas, margin %.4f",
+                aggregate_emotion.id, stopped, sample.drawn, sample.population, margin)
+    return sample, sampling_settings, stopped
+
+def evaluate_archetypes(personas, news_item, demographic_index, evaluate_round, writer):
+    """
+    Evaluates the sampled members of each archetype, then writes their answers for the
+    other members. Members the LLM answered in an earlier, interrupted run count as
+    samples; members it filled in are left as they are.
+
+    Args:
+        evaluate_round: Function evaluating and recording a queryset of personas
+        writer: The run's EmotionalResponseWriter
+
+    Returns:
+        dict: Archetype statistics stored in the summary
+    """
+    archetype_settings = get_archetype_settings()
+    samples = max(1, archetype_settings['SAMPLES'])
+    groups = group_archetypes(
+        personas.values_list('id', 'personality_description'),
+        demographic_index,
+        archetype_settings['DESCRIPTION_BITS']
+    )
+
+    responses = EmotionalResponse.objects.filter(news_item=news_item, persona__in=personas.values('id'))
+
+    def load_answers():
+        # Rows filled from another member are no samples
+        return {
+            persona_id: (user_response_id, intensity)
+            for persona_id, user_response_id, intensity in responses.filter(
+                user_response__isnull=False
+            ).exclude(explanation__startswith=INFERRED_EXPLANATION).values_list(
+                'persona_id', 'user_response_id', 'intensity'
+            )
+        }
+
+    answers = load_answers()
+    to_evaluate = []
+    for members in groups:
+        missing = samples - sum(1 for persona_id in members if persona_id in answers)
+        if missing > 0:
+            to_evaluate.extend([persona_id for persona_id in members if persona_id not in answers][:missing])
+    evaluate_round(Persona.objects.filter(id__in=to_evaluate).order_by('id'))
+    writer.flush()
+
+    answers = load_answers()
+    answered_ids = set(responses.values_list('persona_id', flat=True))
+    filled = 0
+    for members in groups:
+        assignments = fill_archetype(members, answers, answered_ids)
+        if not assignments and any(persona_id not in answered_ids for persona_id in members):
+            logger.warning("No member of an archetype of %d personas answered; leaving it out", len(members))
+        for persona_id, (user_response_id, intensity, explanation) in assignments:
+            writer.add(EmotionalResponse(
+                persona_id=persona_id,
+                news_item=news_item,
+                user_response_id=user_response_id,
+                intensity=intensity,
+                explanation=explanation
+            ))
+        filled += len(assignments)
+
+    logger.info("Evaluated %d personas for %d archetypes, filled in %d", len(to_evaluate), len(groups), filled)
+    return {
+        "archetypes": len(groups),
+        "samples_per_archetype": samples,
+        "evaluated": len(to_evaluate),
+        "filled": filled,
+    }
+
+def predict_with_surrogate(aggregate_emotion, personas, news_item, demographic_index, evaluate_round, writer):
+    """
+    Labels a stratified subset of the personas with the LLM, trains the surrogate
+    classifier on it and predicts the other personas; predictions below the confidence
+    threshold are escalated to the LLM.
+
+    Args:
+        evaluate_round: Function evaluating and recording a queryset of personas
+        writer: The run's EmotionalResponseWriter
+
+    Returns:
+        dict: Surrogate statistics (holdout metrics included) stored in the summary
+    """
+    surrogate_settings = get_surrogate_settings()
+    rows = list(personas.values_list('id', 'personality_description'))
+    persona_ids = [persona_id for persona_id, _ in rows]
+    response_ids = list(
+        PossibleUserResponses.objects.filter(news_item=news_item).order_by('id').values_list('id', flat=True)
+    )
+    class_of = {response_id: code for code, response_id in enumerate(response_ids)}
+    responses = EmotionalResponse.objects.filter(news_item=news_item, persona__in=personas.values('id'))
+
+    def load_answered():
+        return set(responses.values_list('persona_id', flat=True))
+
+    def load_labels():
+        # Predictions of an interrupted run, and archetype copies, are no labels
+        return {
+            persona_id: (class_of[user_response_id], intensity)
+            for persona_id, user_response_id, intensity in responses.filter(
+                user_response__isnull=False
+            ).exclude(explanation__startswith=PREDICTED_EXPLANATION).exclude(
+                explanation__startswith=INFERRED_EXPLANATION
+            ).values_list(
+                'persona_id', 'user_response_id', 'intensity'
+            )
+            if user_response_id in class_of
+        }
+
+    # Label a stratified subset, so every demographic combination is represented
+    labels = load_labels()
+    sample = StratifiedSample(persona_ids, demographic_index, seed=aggregate_emotion.id)
+    evaluate_round(Persona.objects.filter(
+        id__in=sample.next_round(max(0, surrogate_settings['LABELED'] - len(labels)), load_answered())
+    ).order_by('id'))
+    writer.flush()
+    labels = load_labels()
+    if not labels:
+        raise ValueError("No persona was labeled by the LLM; the surrogate model has nothing to learn from")
+
+    features = build_features(
+        persona_ids, [description for _, description in rows], demographic_index, surrogate_settings['HASH_FEATURES']
+    )
+    position_of = {persona_id: position for position, persona_id in enumerate(persona_ids)}
+    labeled_ids = [persona_id for persona_id in sorted(labels) if persona_id in position_of]
+    labeled_features = features[[position_of[persona_id] for persona_id in labeled_ids]]
+    classes = np.array([labels[persona_id][0] for persona_id in labeled_ids], dtype=np.int64)
+    intensities = np.array([labels[persona_id][1] for persona_id in labeled_ids], dtype=np.float64)
+
+    metrics = holdout_metrics(
+        labeled_features, classes, len(response_ids),
+        surrogate_settings['HOLDOUT'], surrogate_settings['L2'], seed=aggregate_emotion.id
+    )
+    classifier = SoftmaxRegression(len(response_ids), l2=surrogate_settings['L2']).fit(labeled_features, classes)
+    intensity_weights = fit_ridge(labeled_features, intensities, surrogate_settings['L2'])
+
+    answered = load_answered()
+    unanswered = [persona_id for persona_id in persona_ids if persona_id not in answered]
+    unanswered_features = features[[position_of[persona_id] for persona_id in unanswered]]
+    probabilities = classifier.predict_proba(unanswered_features)
+    confidence = probabilities.max(axis=1)
+
+    # Least confident first, up to the escalation cap
+    unsure = np.flatnonzero(confidence < surrogate_settings['THRESHOLD'])
+    unsure = unsure[np.argsort(confidence[unsure], kind='stable')][:surrogate_settings['MAX_ESCALATIONS']]
+    escalated = [unanswered[position] for position in unsure.tolist()]
+    evaluate_round(Persona.objects.filter(id__in=escalated).order_by('id'))
+    writer.flush()
+
+    answered = load_answered()
+    predicted_classes = probabilities.argmax(axis=1)
+    predicted_intensities = np.clip(predict_ridge(intensity_weights, unanswered_features), 0, 1)
+    predicted = 0
+    for persona_id, code, intensity, persona_confidence in zip(
+        unanswered, predicted_classes.tolist(), predicted_intensities.tolist(), confidence.tolist()
+    ):
+        if persona_id in answered:
+            continue
+        writer.add(EmotionalResponse(
+            persona_id=persona_id,
+            news_item=news_item,
+            user_response_id=response_ids[code],
+            intensity=round(intensity, 2),
+            explanation=f"{PREDICTED_EXPLANATION} (confidence {persona_confidence:.2f})"
+        ))
+        predicted += 1
+
+    logger.info("Surrogate model trained on %d personas (holdout: %s), escalated %d, predicted %d",
+                len(labeled_ids), metrics, len(escalated), predicted)
+    return {
+        "labeled": len(labeled_ids),
+        "holdout": metrics,
+        "threshold": surrogate_settings['THRESHOLD'],
+        "escalated": len(escalated),
+        "predicted": predicted,
+    }
+
+def aggregate_emotion_task(city_name, news_item_title, aggregate_emotion_id, concurrency=None, batch_size=None,
+                           strategy='all', lease_lost=None):
     """
     Aggregates emotional responses with user response selection and demographic breakdown
+
+    The run is resumable: personas that already answered the news item are skipped and
+    the summaries are computed from the stored EmotionalResponse rows, so restarting an
+    interrupted job only evaluates the personas it had not reached.
+
+    Args:
+        concurrency (int): Number of personas evaluated in parallel. Defaults to
+            the AGGREGATION_CONCURRENCY setting.
+        batch_size (int): Personas per LLM request; 1 disables batching and 0 sizes
+            batches automatically. Defaults to the AGGREGATION_BATCH_SIZE setting.
+        strategy (str): Which personas the LLM evaluates:
+            - 'all': every persona;
+            - 'sample': a stratified sample, in rounds until the confidence intervals
+              reach the AGGREGATION_SAMPLING margin or budget (simulator/utils/sampling.py);
+            - 'archetype': a few personas per demographic combination, whose answers
+              are given to the other members (simulator/utils/archetypes.py);
+            - 'surrogate': a labeled subset, the others being predicted by a local
+              classifier unless it is unsure (simulator/utils/surrogate.py).
+        lease_lost (threading.Event): Set when another worker claimed the run's job; the
+            run then stops with LeaseLost and drops its pending rows.
     """
+    if concurrency is None:
+        concurrency = getattr(settings, 'AGGREGATION_CONCURRENCY', 1)
+    if batch_size is None:
+        batch_size = getattr(settings, 'AGGREGATION_BATCH_SIZE', 1)
+
     try:
         logger.info("Starting aggregation for city: %s, news item: %s, id: %d", city_name, news_item_title, aggregate_emotion_id)
         
@@ -128,133 +626,97 @@ def aggregate_emotion_task(city_name, news_item_title, aggregate_emotion_id):
         aggregate_emotion = AggregateEmotion.objects.get(id=aggregate_emotion_id)
         news_item = NewsItem.objects.get(title=news_item_title)
         
-        # Find the original task to get the intended population size
-        original_task = PersonaGenerationTask.objects.filter(
-            city_name=city_name, 
-            status='completed'
-        ).order_by('-created_at').first()
-        
-        # Get all personas for this city
-        all_personas = Persona.objects.filter(city=city_name)
-        
-        # If we found the original task with a population count, limit personas to that number
-        if original_task and original_task.population:
-            logger.info(f"Found original task with population {original_task.population}, limiting personas")
-            # Take only the first N personas matching the original requested population
-            personas = all_personas[:original_task.population]
-            # Update the total_responses in aggregate_emotion to match the correct count
-            aggregate_emotion.total_responses = original_task.population
-            aggregate_emotion.save()
-        else:
-            # Fallback if no task is found
-            logger.warning(f"No original task found for {city_name}, using all personas")
-            personas = all_personas
+        personas, all_personas = select_personas(city_name, aggregate_emotion)
         
         print(f"personas count: {personas.count()}")
         possible_responses = PossibleUserResponses.objects.filter(news_item=news_item)
-        categories = Category.objects.filter(city=city_name).prefetch_related('subcategories')
+        valid_response_ids = {response.id for response in possible_responses}
 
         logger.info("Using %d personas in city: %s (total available: %d)", 
                    personas.count(), city_name, all_personas.count())
-        logger.info("Found %d possible responses", possible_responses.count())
-
-        # Initialize demographic summary structure
-        demographic_summary = {}
-        for category in categories:
-            demographic_summary[category.name] = {}
-            for subcategory in category.subcategories.filter(city=city_name):
-                # Use lowercase for consistency
-                demographic_summary[category.name][subcategory.name.lower()] = {
-                    response.id: {
-                        "response_text": response.response_text,
-                        "count": 0,
-                        "percentage": 0.0
-                    } 
-                    for response in possible_responses
-                }
+        logger.info("Found %d possible responses", len(valid_response_ids))
 
-        # Initialize response summary
-        response_summary = {
-            response.id: {
-                "response_text": response.response_text, 
-                "count": 0, 
-                "percentage": 0.0
-            } 
-            for response in possible_responses
-        }
+        # Resume after an interrupted run: progress starts from the stored responses
+        pending_personas = exclude_answered(personas, news_item)
+        already_answered = personas.count() - pending_personas.count()
+        AggregateEmotion.objects.filter(id=aggregate_emotion_id).update(processed_responses=already_answered)
+        if already_answered:
+            logger.info("Resuming aggregation %d: %d personas already answered",
+                        aggregate_emotion_id, already_answered)
 
-        # Track total processed responses
-        total_responses = 0
+        # Every persona's demographics, loaded once for prompt rendering
+        demographic_index = DemographicIndex.load(city_name)
 
-        # Process each persona
-        for persona in personas:
+        # Process each persona as its response arrives from the worker pool,
+        # metering the token usage of every LLM call made for this job. Rows and the
+        # progress counter are written in bulk; the writer flushes on the way out
+        # of the block, errors included. Partial summaries are published after flushes
+        # so fetch_summary_api can show results while the run is going
+        usage_meter = UsageMeter()
+        publisher = PartialSummaryPublisher(aggregate_emotion)
+        # Personas the provider's open circuit breaker turned away; they stay unanswered
+        # and are evaluated when the job runs again
+        circuit_rejected = []
+        def record(persona, outcome):
+            check_lease(lease_lost)
+            if isinstance(outcome, CircuitOpenError):
+                circuit_rejected.append(persona.id)
+                return
             try:
-                # Generate response for this persona
-                selected_response, intensity, explanation = generate_emotional_response(persona, news_item)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                selected_response, intensity, explanation = outcome
                 print(f"selected_response: {selected_response} (type: {type(selected_response)}) :: intensity: {intensity} (type: {type(intensity)}) :: explanation: {explanation} (type: {type(explanation)})")
-                
-                # Get the PossibleUserResponses instance using the ID returned by generate_emotional_response
-                selected_response_obj = PossibleUserResponses.objects.get(id=selected_response)
-                
-                # Create EmotionalResponse
-                emotional_response = EmotionalResponse.objects.create(
+
+                if selected_response not in valid_response_ids:
+                    raise ValueError(f"Unknown response id: {selected_response}")
+
+                writer.add(EmotionalResponse(
                     persona=persona,
                     news_item=news_item,
-                    user_response=selected_response_obj,
+                    user_response_id=selected_response,
                     intensity=intensity,
                     explanation=explanation
-                )
+                ))
+            except Exception as persona_error:
+            
+                logger.error(f"Error processing persona {persona.id}: {persona_error}")
 
-                # Update overall response summary - use the ID directly since that's what our keys are
-                response_summary[selected_response]['count'] += 1
-                total_responses += 1
+        def evaluate_round(round_personas):
+            for persona, outcome in evaluate_personas(
+                round_personas, news_item, concurrency, batch_size, demographic_index
+            ):
+                record(persona, outcome)
 
-                # Update demographic summary
-                # Get the persona's subcategories
-                subcategory_mappings = persona.subcategory_mappings.select_related('subcategory__category').filter(
-                    subcategory__city=city_name  
+        sampling_state = archetype_stats = surrogate_stats = None
+        with metered(usage_meter), EmotionalResponseWriter(
+            aggregate_emotion_id, on_flush=publisher, lease_lost=lease_lost
+        ) as writer:
+            if strategy == 'sample':
+                sampling_state = sample_personas(
+                    aggregate_emotion, personas, news_item, demographic_index, evaluate_round, writer
                 )
-
-                for mapping in subcategory_mappings:
-                    subcategory = mapping.subcategory
-                    category_name = subcategory.category.name
-                    # Convert to lowercase for consistent matching
-                    subcategory_name = subcategory.name.lower()
-
-                    # Verify the structure exists before updating
-                    if (category_name in demographic_summary and
-                        subcategory_name in demographic_summary[category_name]):
-                        demographic_mapping = demographic_summary[category_name][subcategory_name]
-                        
-                        # Increment count for this response in this demographic group - use the ID directly
-                        demographic_mapping[selected_response]['count'] += 1
-                
-                # Update processed_responses atomically using F() expression to avoid race conditions
-                AggregateEmotion.objects.filter(id=aggregate_emotion_id).update(
-                    processed_responses=F('processed_responses') + 1
+            elif strategy == 'archetype':
+                archetype_stats = evaluate_archetypes(personas, news_item, demographic_index, evaluate_round, writer)
+            elif strategy == 'surrogate':
+                surrogate_stats = predict_with_surrogate(
+                    aggregate_emotion, personas, news_item, demographic_index, evaluate_round, writer
                 )
-                # Refresh the aggregate_emotion object to get the updated processed_responses value
-                aggregate_emotion.refresh_from_db()
-            except Exception as persona_error:
-                
-                logger.error(f"Error processing persona {persona.id}: {persona_error}")
+            else:
+                evaluate_round(pending_personas)
+
+        check_lease(lease_lost)
+        if circuit_rejected:
+            # Keep the 'Processing' status: the worker requeues the job, which resumes
+            # with the personas left unanswered once the breaker's cooldown has passed
+            aggregate_emotion.llm_usage = usage_meter.snapshot()
+            aggregate_emotion.save(update_fields=['llm_usage', 'updated_at'])
+            logger.warning("Provider circuit open: %d personas of aggregation %d left for the next run",
+                           len(circuit_rejected), aggregate_emotion_id)
+            return "Aggregation paused: provider unavailable"
 
-        # Calculate percentages for overall response summary
-        for response_id, data in response_summary.items():
-            if total_responses > 0:
-                data['percentage'] = round((data['count'] / total_responses) * 100, 2)
-
-        # Calculate percentages for demographic summary
-        for category_name, categories in demographic_summary.items():
-            for subcategory_name, responses in categories.items():
-                subcategory_total = sum(response['count'] for response in responses.values())
-                
-                for response_id, response_data in responses.items():
-                    if subcategory_total > 0:
-                        response_data['percentage'] = round(
-                            (response_data['count'] / subcategory_total) * 100, 
-                            2
-                        )
+        # Summaries cover this run and any earlier, interrupted one
+        response_summary, demographic_summary, total_responses = compute_summaries(news_item, city_name)
 
         # Update aggregate emotion
         aggregate_emotion.summary = {
@@ -262,13 +724,35 @@ def aggregate_emotion_task(city_name, news_item_title, aggregate_emotion_id):
             "total_responses": total_responses,
             "response_summary": response_summary
         }
+        if sampling_state is not None:
+            sample, sampling_settings, stopped = sampling_state
+            margin = sample.estimate(response_summary, demographic_summary, sampling_settings['CONFIDENCE'])
+            aggregate_emotion.summary["sampling"] = {
+                "population": sample.population,
+                "sample_size": total_responses,
+                "confidence": sampling_settings['CONFIDENCE'],
+                "margin": round(margin * 100, 2),
+                "stopped": stopped,
+            }
+        if archetype_stats is not None:
+            aggregate_emotion.summary["archetypes"] = archetype_stats
+        if surrogate_stats is not None:
+            aggregate_emotion.summary["surrogate"] = surrogate_stats
         aggregate_emotion.demographic_summary = demographic_summary
-        aggregate_emotion.save()
+        aggregate_emotion.llm_usage = usage_meter.snapshot()
+        # processed_responses is maintained by the writer; don't overwrite it
+        aggregate_emotion.save(update_fields=['summary', 'demographic_summary', 'llm_usage', 'updated_at'])
+        logger.info("LLM usage for aggregation %d: %s", aggregate_emotion_id, aggregate_emotion.llm_usage)
+        if get_hedging_settings()['ENABLED']:
+            logger.info("LLM hedging stats: %s", get_hedging_stats())
 
 
         logger.info("Aggregation completed successfully for city: %s", city_name)
         return "Aggregation completed successfully"
 
+    except LeaseLost:
+        # The aggregation belongs to the worker that claimed it now
+        raise
     except Exception as e:
         logger.error("Emotion aggregation failed: %s", str(e))
         # Error handling
@@ -281,4 +765,214 @@ def aggregate_emotion_task(city_name, news_item_title, aggregate_emotion_id):
             logger.error("Could not update aggregation status: %s", save_error)
 
         return f"Aggregation failed: {str(e)}"
- 
\ No newline at end of file
+ 
+
+def submit_aggregation_batch(news_item, personas, model_name, backend, demographic_index):
+    """
+    Writes one request per persona to JSONL files and submits them to the batch backend.
+    Persona blocks are rendered from the city's DemographicIndex. The requests are split
+    into as many batches as the backend's per-batch limits require.
+
+    Returns:
+        tuple: (batch ids, number of requests)
+    """
+    prompt_template = get_user_response_template()
+    _, responses_list = get_possible_responses(news_item)
+
+    requests = (
+        backend.build_request(
+            f"{BATCH_CUSTOM_ID_PREFIX}{persona.id}",
+            model_name,
+            render_user_response_prompt(
+                prompt_template, format_persona_details(persona, demographic_index), news_item, responses_list
+            ),
+            prompt_template.tools_content
+        )
+        for persona in personas.iterator(chunk_size=BATCH_INGEST_CHUNK_SIZE)
+    )
+    batch_files = write_batch_files(requests, backend)
+    try:
+        batch_ids = [backend.submit(path, model_name) for path, _ in batch_files]
+    finally:
+        for path, _ in batch_files:
+            os.remove(path)
+    return batch_ids, sum(request_count for _, request_count in batch_files)
+
+def batch_ids(batch_state):
+    """Ids of the provider batches of a submission; older states recorded a single 'id'."""
+    return batch_state.get('ids') or [batch_state['id']]
+
+def ingest_aggregation_batch(aggregate_emotion, news_item, backend, batch_state):
+    """
+    Reads the results of a completed batch, bulk-creates the EmotionalResponse rows of
+    personas that have none yet and computes both summaries from the stored rows.
+
+    Returns:
+        tuple: (response_summary, demographic_summary, total_responses, failed_requests)
+    """
+    city_name = aggregate_emotion.city
+    possible_responses = PossibleUserResponses.objects.filter(news_item=news_item)
+    valid_response_ids = {response.id for response in possible_responses}
+
+    results = {}
+    failed_requests = 0
+    results_iter = chain.from_iterable(
+        backend.iter_results(batch_id, batch_state['model']) for batch_id in batch_ids(batch_state)
+    )
+    for custom_id, payload, error in results_iter:
+        result = None if error else validate_emotional_response(payload, valid_response_ids)
+        if result is None or not custom_id.startswith(BATCH_CUSTOM_ID_PREFIX):
+            failed_requests += 1
+            logger.warning("Batch request %s failed: %s", custom_id, error or payload)
+            continue
+        results[int(custom_id[len(BATCH_CUSTOM_ID_PREFIX):])] = result
+
+    # An ingest interrupted midway is simply run again; don't store answers twice
+    answered = set(
+        EmotionalResponse.objects.filter(news_item=news_item, persona_id__in=list(results))
+        .values_list('persona_id', flat=True)
+    )
+    rows = (
+        EmotionalResponse(
+            persona_id=persona_id,
+            news_item=news_item,
+            user_response_id=selected_response,
+            intensity=intensity,
+            explanation=explanation
+        )
+        for persona_id, (selected_response, intensity, explanation) in results.items()
+        if persona_id not in answered
+    )
+    while True:
+        chunk = list(islice(rows, BATCH_INGEST_CHUNK_SIZE))
+        if not chunk:
+            break
+        EmotionalResponse.objects.bulk_create(chunk)
+
+    response_summary, demographic_summary, total_responses = compute_summaries(news_item, city_name)
+    return response_summary, demographic_summary, total_responses, failed_requests
+
+def submit_pending_personas(aggregate_emotion, news_item, pending_personas, provider_name, model_name,
+                            backend, resubmissions=0):
+    """
+    Submits the pending personas of a batch aggregation and records the batches under
+    summary['batch'].
+
+    Returns:
+        str: Status message
+    """
+    ids, request_count = submit_aggregation_batch(
+        news_item, pending_personas, model_name, backend, DemographicIndex.load(aggregate_emotion.city)
+    )
+    aggregate_emotion.summary = {
+        **aggregate_emotion.summary,
+        'batch': {
+            'ids': ids,
+            'provider': provider_name,
+            'model': model_name,
+            'requests': request_count,
+            'resubmissions': resubmissions,
+        }
+    }
+    aggregate_emotion.save()
+    logger.info("Submitted %d batch(es) %s with %d requests for aggregation %d",
+                len(ids), ids, request_count, aggregate_emotion.id)
+    return "Batch resubmitted" if resubmissions else "Batch submitted"
+
+def aggregate_emotion_batch_task(city_name, news_item_title, aggregate_emotion_id, backend=None):
+    """
+    Runs an aggregation through the provider's batch API instead of interactive calls.
+
+    The task does not block while the provider works: the first call submits the batch
+    and records it under summary['batch']; later calls (one per worker cycle) poll it
+    and, once it has completed, ingest the results. The aggregation keeps its
+    'Processing' status until then, so a restarted worker resumes polling.
+
+    Personas whose request failed inside the batch are submitted again, at most
+    AGGREGATION_BATCH_RESUBMITS times; those still unanswered after that are counted
+    as summary['failed_requests'] of the completed aggregation.
+
+    Args:
+        backend (BatchBackend): Batch service to use; defaults to the one configured
+            for the active model's provider
+
+    Returns:
+        str: Status message
+    """
+    try:
+        aggregate_emotion = AggregateEmotion.objects.get(id=aggregate_emotion_id)
+        news_item = NewsItem.objects.get(title=news_item_title)
+        batch_state = aggregate_emotion.summary.get('batch')
+
+        if batch_state is None:
+            personas, _ = select_personas(city_name, aggregate_emotion)
+            pending_personas = exclude_answered(personas, news_item)
+            if not pending_personas.exists():
+                # Everyone answered already (e.g. a resumed run): providers reject empty batches
+                response_summary, demographic_summary, total_responses = compute_summaries(news_item, city_name)
+                aggregate_emotion.summary = {
+                    "status": "completed",
+                    "total_responses": total_responses,
+                    "response_summary": response_summary,
+                }
+                aggregate_emotion.demographic_summary = demographic_summary
+                aggregate_emotion.processed_responses = total_responses
+                aggregate_emotion.save()
+                logger.info("Aggregation %d had no persona left to submit", aggregate_emotion_id)
+                return "Aggregation completed successfully"
+
+            active_model = get_active_model()
+            return submit_pending_personas(
+                aggregate_emotion, news_item, pending_personas, active_model.provider_name,
+                active_model.model_name, backend or get_batch_backend(active_model.provider_name)
+            )
+
+        backend = backend or get_batch_backend(batch_state['provider'])
+        statuses = [backend.poll(batch_id, batch_state['model']) for batch_id in batch_ids(batch_state)]
+        if FAILED in statuses:
+            raise ValueError(f"Batch {batch_ids(batch_state)} failed at the provider")
+        if IN_PROGRESS in statuses:
+            return "Batch in progress"
+
+        response_summary, demographic_summary, total_responses, failed_requests = ingest_aggregation_batch(
+            aggregate_emotion, news_item, backend, batch_state
+        )
+        aggregate_emotion.processed_responses = total_responses
+
+        resubmissions = batch_state.get('resubmissions', 0)
+        if failed_requests and resubmissions < getattr(settings, 'AGGREGATION_BATCH_RESUBMITS', 2):
+            personas, _ = select_personas(city_name, aggregate_emotion)
+            pending_personas = exclude_answered(personas, news_item)
+            if pending_personas.exists():
+                logger.info("Resubmitting the %d failed requests of aggregation %d",
+                            failed_requests, aggregate_emotion_id)
+                return submit_pending_personas(
+                    aggregate_emotion, news_item, pending_personas, batch_state['provider'],
+                    batch_state['model'], backend, resubmissions + 1
+                )
+
+        aggregate_emotion.summary = {
+            "status": "completed",
+            "total_responses": total_responses,
+            "response_summary": response_summary,
+            "failed_requests": failed_requests,
+            "batch": {**batch_state, 'failed_requests': failed_requests},
+        }
+        aggregate_emotion.demographic_summary = demographic_summary
+        aggregate_emotion.save()
+
+        logger.info("Batch aggregation completed for city: %s (%d responses, %d failed requests)",
+                    city_name, total_responses, failed_requests)
+        return "Aggregation completed successfully"
+
+    except Exception as e:
+        logger.error("Batch emotion aggregation failed: %s", str(e))
+        try:
+            aggregate_emotion = AggregateEmotion.objects.get(id=aggregate_emotion_id)
+            aggregate_emotion.summary['status'] = 'failed'
+            aggregate_emotion.summary['error'] = str(e)
+            aggregate_emotion.save()
+        except Exception as save_error:
+            logger.error("Could not update aggregation status: %s", save_error)
+
+        return f"Aggregation failed: {str(e)}"
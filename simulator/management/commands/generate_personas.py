@@ -1,19 +1,68 @@
+import re
 import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import F
 from faker import Faker
-from itertools import product
+from itertools import islice, repeat
 import pandas as pd
 
 from simulator.models import (
     Category, LLMModelAndKey, PersonaGenerationTask, PromptModel,
-    RawPersonaModel, SubCategory, Persona, PersonaSubCategoryMapping
+    RawPersonaModel, Persona, PersonaSubCategoryMapping
 )
-from simulator.utils.ask_gemini import ask_gemini
-from simulator.utils.ask_gpt import ask_gpt
-from simulator.utils.ask_claude import ask_claude
+from simulator.utils.apportionment import iter_apportioned_combinations
+from simulator.utils.ask_llm import ask_llm
+from simulator.utils.llm_errors import LLMResponseError
+from simulator.utils.job_queue import (
+    COMPLETED as JOB_COMPLETED,
+    FAILED as JOB_FAILED,
+    PENDING as JOB_PENDING,
+    PERSONA_DESCRIPTION_JOB,
+    PERSONA_GENERATION_JOB,
+    LeaseLost,
+    check_lease,
+    enqueue,
+    enqueue_missing,
+    process_next_job
+)
+from simulator.utils.job_signals import wait_for_jobs
+from simulator.utils.subcategory_resolver import (
+    SubCategoryResolver,
+    recompute_subcategory_percentages
+)
+
+# Personas created (stage one) or described (stage two) per bulk batch
+DEFAULT_PERSONA_BULK_BATCH_SIZE = 500
+# Concurrent LLM calls of the description stage
+DEFAULT_DESCRIPTION_CONCURRENCY = 8
+# Retries of the description stage while some descriptions keep failing
+DEFAULT_DESCRIPTION_RETRY_SECONDS = 300
+DEFAULT_DESCRIPTION_MAX_RUNS = 3
+# CSV rows read, described and inserted at a time
+DEFAULT_CSV_CHUNK_ROWS = 1000
+# Cells of the numeric forms pandas infers, stored as numbers in RawPersonaModel.row_data
+INTEGER_CELL = re.compile(r'[+-]?\d+')
+FLOAT_CELL = re.compile(r'[+-]?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?')
+
+
+def typed_csv_value(value):
+    """
+    Returns a CSV cell read as text as the int or float it spells, other cells unchanged.
+
+    Cells are converted one by one, so a value gets the same type in every chunk.
+    """
+    if not isinstance(value, str):
+        return value
+    if INTEGER_CELL.fullmatch(value):
+        return int(value)
+    if FLOAT_CELL.fullmatch(value):
+        return float(value)
+    return value
+
 
 class Command(BaseCommand):
     help = 'Processes both CSV and demographics-based persona generation'
@@ -22,6 +71,7 @@ class Command(BaseCommand):
         super().__init__(*args, **kwargs)
         self.stop_event = threading.Event()
         self.generation_thread = None
+        self.description_thread = None
 
     def handle(self, *args, **options):
         """Main method to start the background persona generation thread"""
@@ -33,6 +83,13 @@ class Command(BaseCommand):
         )
         self.generation_thread.start()
 
+        # Descriptions are filled in separately, so slow LLM calls don't hold up new tasks
+        self.description_thread = threading.Thread(
+            target=self.persona_description_worker,
+            daemon=True
+        )
+        self.description_thread.start()
+
         try:
             while not self.stop_event.is_set():
                 time.sleep(1)
@@ -44,326 +101,466 @@ class Command(BaseCommand):
         """Worker method to process persona generation tasks from the queue"""
         while not self.stop_event.is_set():
             try:
-                pending_task = PersonaGenerationTask.objects.filter(status='pending').first()
-                if pending_task:
-                    if pending_task.csv_file:
-                        self.process_csv_for_task(pending_task)
-                    else:
-                        self.generate_personas_for_demographics(pending_task)
-                time.sleep(1)
+                # Tasks created without going through the views get a job too
+                enqueue_missing(
+                    PERSONA_GENERATION_JOB,
+                    PersonaGenerationTask.objects.filter(status='pending').values_list('id', flat=True)
+                )
+                job = process_next_job(
+                    PERSONA_GENERATION_JOB,
+                    self.run_generation_job,
+                    on_give_up=self.mark_task_abandoned,
+                    on_error=self.mark_task_failed
+                )
+                if job is None:
+                    # Sleep until a view queues a task (or the idle timeout passes)
+                    wait_for_jobs(
+                        PERSONA_GENERATION_JOB, getattr(settings, 'JOB_IDLE_WAIT_SECONDS', 60)
+                    )
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'Error in persona generation: {e}'))
                 time.sleep(5)
 
-    def process_csv_for_task(self, task):
-        """Process CSV file for persona generation"""
+    def persona_description_worker(self):
+        """Worker method filling in the descriptions of generated personas"""
+        while not self.stop_event.is_set():
+            try:
+                enqueue_missing(
+                    PERSONA_DESCRIPTION_JOB,
+                    PersonaGenerationTask.objects.filter(description_status='pending').values_list('id', flat=True)
+                )
+                job = process_next_job(
+                    PERSONA_DESCRIPTION_JOB,
+                    self.run_description_job,
+                    on_give_up=self.mark_descriptions_abandoned,
+                    requeue_delay=getattr(
+                        settings, 'PERSONA_DESCRIPTION_RETRY_SECONDS', DEFAULT_DESCRIPTION_RETRY_SECONDS
+                    ),
+                    on_error=self.mark_descriptions_failed
+                )
+                if job is None:
+                    wait_for_jobs(
+                        PERSONA_DESCRIPTION_JOB, getattr(settings, 'JOB_IDLE_WAIT_SECONDS', 60)
+                    )
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Error in persona description: {e}'))
+                time.sleep(5)
+
+    def run_generation_job(self, job, lost):
+        """Runs the persona generation task of a claimed job"""
+        task = PersonaGenerationTask.objects.get(id=job.object_id)
+        if task.csv_file:
+            self.process_csv_for_task(task, lost)
+        else:
+            self.generate_personas_for_demographics(task, lost)
+        task.refresh_from_db()
+        return JOB_COMPLETED if task.status == 'completed' else JOB_FAILED
+
+    def run_description_job(self, job, lost):
+        """Runs the description stage of a claimed task"""
+        task = PersonaGenerationTask.objects.get(id=job.object_id)
+        self.fill_pending_descriptions(task, lost)
+        task.refresh_from_db()
+        if task.description_status == 'pending':
+            # Some descriptions failed: run the stage again after the retry delay
+            return JOB_PENDING
+        return JOB_COMPLETED if task.description_status == 'completed' else JOB_FAILED
+
+    def mark_task_abandoned(self, job):
+        """Fails a task whose workers kept dying before finishing it"""
+        PersonaGenerationTask.objects.filter(id=job.object_id).update(
+            status='failed',
+            error_message='Generation was abandoned by its worker too many times'
+        )
+
+    def mark_descriptions_abandoned(self, job):
+        """Fails the description stage of a task whose workers kept dying during it"""
+        PersonaGenerationTask.objects.filter(id=job.object_id).update(
+            description_status='failed',
+            error_message='The description stage was abandoned by its worker too many times'
+        )
+
+    def mark_descriptions_failed(self, job, error):
+        """Fails the description stage of a task whose job raised"""
+        PersonaGenerationTask.objects.filter(id=job.object_id).update(
+            description_status='failed', error_message=str(error)
+        )
+
+    def mark_task_failed(self, job, error):
+        """Fails a task whose job raised before the task could record the error"""
+        PersonaGenerationTask.objects.filter(
+            id=job.object_id, status__in=['pending', 'in_progress']
+        ).update(status='failed', error_message=str(error))
+
+    def process_csv_for_task(self, task, lost=None):
+        """
+        Process CSV file for persona generation.
+
+        The file is streamed in chunks of CSV_CHUNK_ROWS rows: memory and in-flight LLM
+        calls are bounded by the chunk, whatever the size of the upload. Each chunk is
+        inserted in bulk together with the task's rows_processed, so a task resumed
+        after its worker died skips the rows it already imported.
+
+        Categories and subcategories are resolved in memory (SubCategoryResolver) and
+        their percentages recomputed once, after the last chunk. Rows whose description
+        failed are imported as pending and the description stage is queued to retry
+        them. Once `lost` (the job's lease) is set, the import stops before the next
+        chunk with LeaseLost.
+        """
         try:
+            resumed_rows = task.rows_processed if task.status == 'in_progress' else 0
             with transaction.atomic():
                 task.status = 'in_progress'
+                if not resumed_rows:
+                    task.rows_processed = 0
+                    task.rows_failed = 0
                 task.save()
 
-            df = pd.read_csv(task.csv_file.path)
-            
-            if 'Name' not in df.columns:
-                raise ValueError("CSV file must contain a 'Name' column")
+            chunk_rows = getattr(settings, 'CSV_CHUNK_ROWS', DEFAULT_CSV_CHUNK_ROWS)
+            reader = pd.read_csv(
+                task.csv_file.path,
+                chunksize=chunk_rows,
+                # Read every cell as text: inferred dtypes differ between chunks (a numeric
+                # column is float only in chunks with a blank cell), which would split one
+                # value into "35" and "35.0" subcategories. Only blank cells are missing.
+                dtype=str,
+                keep_default_na=False,
+                na_values=[''],
+                # Keep the header, skip the data rows of the interrupted run
+                skiprows=range(1, resumed_rows + 1)
+            )
 
+            persona_count = 0
+            resolver = SubCategoryResolver(task.city_name)
+            category_names = set()
             with ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [
-                    executor.submit(
-                        self.process_single_persona,
-                        row.to_dict(),
-                        task.city_name
-                    ) for _, row in df.iterrows()
-                ]
-
-                personas = []
-                for future in futures:
-                    try:
-                        persona = future.result()
-                        if persona:
-                            personas.append(persona)
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f'Error processing persona: {e}'))
-
+                for chunk in reader:
+                    check_lease(lost)
+                    if 'Name' not in chunk.columns:
+                        raise ValueError("CSV file must contain a 'Name' column")
+                    category_names.update(column for column in chunk.columns if column != 'Name')
+                    # Empty cells become None, as NaN is not valid JSON for row_data
+                    rows = chunk.astype(object).where(chunk.notna(), None).to_dict('records')
+                    persona_count += self.process_csv_chunk(task, rows, executor, resolver)
+
+            recompute_subcategory_percentages(task.city_name, category_names)
+
+            task.refresh_from_db(fields=['rows_failed'])
             with transaction.atomic():
                 task.status = 'completed'
-                task.save()
+                update_fields = ['status', 'updated_at']
+                if task.rows_failed:
+                    task.description_status = 'pending'
+                    task.description_runs = 0
+                    update_fields += ['description_status', 'description_runs']
+                task.save(update_fields=update_fields)
+            if task.rows_failed:
+                enqueue(PERSONA_DESCRIPTION_JOB, task.id)
 
             self.stdout.write(
-                self.style.SUCCESS(f'Generated {len(personas)} personas for {task.city_name}')
+                self.style.SUCCESS(f'Generated {persona_count} personas for {task.city_name}')
             )
 
+        except LeaseLost:
+            raise
         except Exception as e:
             task.status = 'failed'
             task.error_message = str(e)
-            task.save()
+            task.save(update_fields=['status', 'error_message', 'updated_at'])
             self.stdout.write(self.style.ERROR(f'CSV processing failed: {e}'))
 
-    def generate_personas_for_demographics(self, task):
-        """Generate personas based on demographic inputs"""
+    def generate_personas_for_demographics(self, task, lost=None):
+        """
+        Generate personas based on demographic inputs.
+
+        A task re-claimed after its worker died or lost its lease creates only the
+        personas its personas_created count says are missing, so the city ends up with
+        exactly the requested population.
+        """
         try:
+            resumed = task.status == 'in_progress'
             with transaction.atomic():
                 task.status = 'in_progress'
+                if not resumed:
+                    task.personas_created = 0
                 task.save()
 
-            categories = Category.objects.filter(city=task.city_name)
-            personas = self.parallel_generate_personas_with_weights(
+            categories = Category.objects.filter(city=task.city_name).order_by('id')
+            persona_count = self.parallel_generate_personas_with_weights(
                 task.population,
                 task.city_name,
-                categories
+                categories,
+                lost,
+                task
             )
-            
-            # Final adjustment to ensure exact population count
-            actual_count = len(personas)
-            if actual_count != task.population:
-                self.stdout.write(self.style.WARNING(
-                    f'Adjusting persona count: have {actual_count}, need {task.population}'
-                ))
-                
-                if actual_count > task.population:
-                    # Too many personas, remove excess
-                    excess = actual_count - task.population
-                    self.stdout.write(self.style.WARNING(f'Removing {excess} excess personas'))
-                    excess_personas = personas[-excess:]
-                    for persona in excess_personas:
-                        persona.delete()
-                    personas = personas[:-excess]
-                    
-                elif actual_count < task.population:
-                    # Too few personas, add more
-                    deficit = task.population - actual_count
-                    self.stdout.write(self.style.WARNING(f'Adding {deficit} additional personas'))
-                    faker = Faker()
-                    
-                    # Use the first persona's subcategories as a template for new ones
-                    if personas:
-                        template_persona = personas[0]
-                        template_subcategories = [
-                            mapping.subcategory for mapping in 
-                            PersonaSubCategoryMapping.objects.filter(persona=template_persona)
-                        ]
-                        
-                        for _ in range(deficit):
-                            persona = Persona(
-                                name=faker.name(),
-                                city=task.city_name
-                            )
-                            persona.save()
-                            
-                            for subcategory in template_subcategories:
-                                PersonaSubCategoryMapping.objects.create(
-                                    persona=persona,
-                                    subcategory=subcategory
-                                )
-                                
-                            description = self.generate_personality_description(
-                                persona.name,
-                                task.city_name,
-                                self.get_demographic_context(template_subcategories)
-                            )
-                            persona.personality_description = description
-                            persona.save()
-                            personas.append(persona)
-            
+
             self.stdout.write(self.style.SUCCESS(
-                f'Final persona count: {len(personas)} (requested: {task.population})'
+                f'Final persona count: {persona_count} (requested: {task.population})'
             ))
 
+            # The city is usable now; descriptions are filled in by the description stage
             with transaction.atomic():
                 task.status = 'completed'
-                task.save()
+                task.description_status = 'pending'
+                task.description_runs = 0
+                task.save(update_fields=['status', 'description_status', 'description_runs', 'updated_at'])
+            enqueue(PERSONA_DESCRIPTION_JOB, task.id)
             self.stdout.write(
-                self.style.SUCCESS(f'Generated {len(personas)} personas for {task.city_name}')
+                self.style.SUCCESS(f'Generated {persona_count} personas for {task.city_name}')
             )
 
+        except LeaseLost:
+            raise
         except Exception as e:
             task.status = 'failed'
             task.error_message = str(e)
-            task.save()
+            task.save(update_fields=['status', 'error_message', 'updated_at'])
             self.stdout.write(self.style.ERROR(f'Demographics-based generation failed: {e}'))
 
-    def parallel_generate_personas_with_weights(self, population, city_name, saved_categories):
-        """Generate weighted personas using parallel processing"""
-        faker = Faker()
+    def parallel_generate_personas_with_weights(self, population, city_name, saved_categories, lost=None,
+                                                task=None):
+        """
+        Generate exactly `population` weighted personas through the bulk creation pipeline.
 
-        def generate_all_subcategory_combinations(categories):
-            category_subcategories = {}
-            for category in categories:
-                subcategories = list(category.subcategories.all())
-                if subcategories:
-                    category_subcategories[category.name] = subcategories
-
-            if not category_subcategories:
-                raise ValueError("No valid subcategories found for categories")
-
-            keys = list(category_subcategories.keys())
-            return list(product(*[category_subcategories[key] for key in keys]))
-
-        subcategory_combinations = generate_all_subcategory_combinations(saved_categories)
-
-        combination_weights = []
-        total_weight = 0
-        for combination in subcategory_combinations:
-            weight = population
-            for subcategory in combination:
-                weight *= (subcategory.percentage / 100)
-            combination_weights.append({'combination': combination, 'weight': weight})
-            total_weight += weight
-            
-        # Normalize weights to ensure they sum to exactly the population
-        self.stdout.write(self.style.SUCCESS(f'Total weight before normalization: {total_weight}, Target: {population}'))
-        if total_weight > 0:  # Prevent division by zero
-            normalization_factor = population / total_weight
-            for combo in combination_weights:
-                combo['weight'] = combo['weight'] * normalization_factor
-                
-        # Verify the total after normalization
-        total_after = sum(combo['weight'] for combo in combination_weights)
-        self.stdout.write(self.style.SUCCESS(f'Total weight after normalization: {total_after}'))
-
-        combination_weights.sort(key=lambda x: x['weight'] % 1, reverse=True)
-
-        chunk_size = max(1, population // 4)
-        chunks = [
-            combination_weights[i:i + chunk_size]
-            for i in range(0, len(combination_weights), chunk_size)
-        ]
+        Each category's subcategories are apportioned by largest remainder and combined
+        independently (see simulator/utils/apportionment.py), without enumerating the
+        combinations of all categories. With a task, the combinations are shuffled with
+        the task id as seed and the first task.personas_created of them (created by an
+        interrupted run) are skipped.
 
-        personas = []
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [
-                executor.submit(
-                    self.process_demographic_persona_chunk,
-                    chunk, city_name, faker, population
-                ) for chunk in chunks
-            ]
+        Returns:
+            int: The number of personas of the population created, by this run or earlier ones
+        """
+        faker = Faker()
+        already_created = task.personas_created if task is not None else 0
+
+        category_subcategories = []
+        for category in saved_categories:
+            subcategories = list(category.subcategories.order_by('id'))
+            if subcategories:
+                category_subcategories.append(subcategories)
+
+        if not category_subcategories:
+            raise ValueError("No valid subcategories found for categories")
+
+        combinations = (
+            tuple(subcategories[code] for subcategories, code in zip(category_subcategories, codes))
+            for codes in iter_apportioned_combinations(
+                [[float(subcategory.percentage) for subcategory in subcategories]
+                 for subcategories in category_subcategories],
+                population,
+                seed=task.id if task is not None else None
+            )
+        )
+        persona_count = already_created + self.create_personas_in_bulk(
+            islice(combinations, already_created, None), city_name, faker, lost, task
+        )
 
-            for future in futures:
-                personas.extend(future.result())
-                
         # Final verification
-        self.stdout.write(self.style.SUCCESS(f'Requested population: {population}, Generated personas: {len(personas)}'))
-
-        return personas
-
-    def process_demographic_persona_chunk(self, chunk, city_name, faker, population):
-        """Process a chunk of demographic-based persona generation"""
-        personas = []
-        total_assigned = 0
-        
-        # Keep track of how many personas were generated from this chunk
-        chunk_total = sum(round(combo_data['weight']) for combo_data in chunk)
-        self.stdout.write(self.style.SUCCESS(f'Chunk expected personas: {chunk_total}'))
-
-        for combo_data in chunk:
-            combination = combo_data['combination']
-            exact_count = round(combo_data['weight'])
-            
-            # Safeguard to ensure we don't exceed the population limit
-            if total_assigned + exact_count > population:
-                exact_count = population - total_assigned
-                self.stdout.write(self.style.WARNING(f'Limiting persona count to stay within population limit'))
-
-            for _ in range(exact_count):
-                persona = Persona(
-                    name=faker.name(),
-                    city=city_name
-                )
-                persona.save()
+        self.stdout.write(self.style.SUCCESS(f'Requested population: {population}, Generated personas: {persona_count}'))
+
+        return persona_count
+
+    def create_personas_in_bulk(self, combinations, city_name, faker, lost=None, task=None):
+        """
+        Stage one of demographics-based generation: creates one persona per subcategory
+        combination of an iterable, with its mappings, in bulk_create batches of
+        PERSONA_BULK_BATCH_SIZE. Personas are marked description_pending; only the
+        current batch is held in memory, whatever the population. Each batch advances
+        the task's personas_created in its transaction. Raises LeaseLost before the next
+        batch once `lost` is set.
+
+        Returns:
+            int: The number of personas created
+        """
+        batch_size = getattr(settings, 'PERSONA_BULK_BATCH_SIZE', DEFAULT_PERSONA_BULK_BATCH_SIZE)
+        combinations = iter(combinations)
+        created = 0
+
+        while True:
+            batch = list(islice(combinations, batch_size))
+            if not batch:
+                break
+            check_lease(lost)
 
-                for subcategory in combination:
-                    PersonaSubCategoryMapping.objects.create(
-                        persona=persona,
-                        subcategory=subcategory
+            with transaction.atomic():
+                personas = Persona.objects.bulk_create([
+                    Persona(name=faker.name(), city=city_name, description_pending=True) for _ in batch
+                ])
+                PersonaSubCategoryMapping.objects.bulk_create([
+                    PersonaSubCategoryMapping(persona=persona, subcategory=subcategory)
+                    for persona, combination in zip(personas, batch)
+                    for subcategory in combination
+                ], batch_size=batch_size)
+                if task is not None:
+                    PersonaGenerationTask.objects.filter(id=task.id).update(
+                        personas_created=F('personas_created') + len(personas)
                     )
 
-                description = self.generate_personality_description(
-                    persona.name,
-                    city_name,
-                    self.get_demographic_context(combination)
-                )
-                persona.personality_description = description
-                persona.save()
+            created += len(personas)
+            self.stdout.write(self.style.SUCCESS(f'Created {created} personas for {city_name}'))
+
+        return created
+
+    def fill_pending_descriptions(self, task, lost=None):
+        """
+        Stage two of demographics-based generation: generates the descriptions of the
+        city's pending personas on PERSONA_DESCRIPTION_CONCURRENCY threads (each call
+        still waits for its provider's rate limiter) and writes them back with
+        bulk_update per batch. Progress is counted on the task.
+
+        Personas whose description failed stay pending: the task goes back to the
+        'pending' description status, for run_description_job to requeue the stage,
+        until it has run PERSONA_DESCRIPTION_MAX_RUNS times; it is failed after that.
+        """
+        batch_size = getattr(settings, 'PERSONA_BULK_BATCH_SIZE', DEFAULT_PERSONA_BULK_BATCH_SIZE)
+        concurrency = getattr(settings, 'PERSONA_DESCRIPTION_CONCURRENCY', DEFAULT_DESCRIPTION_CONCURRENCY)
+        pending = Persona.objects.filter(city=task.city_name, description_pending=True).order_by('id')
+        tasks = PersonaGenerationTask.objects.filter(id=task.id)
+        tasks.update(
+            description_status='in_progress',
+            descriptions_total=F('descriptions_completed') + pending.count(),
+            descriptions_failed=0,
+            description_runs=F('description_runs') + 1
+        )
 
-                personas.append(persona)
-                self.stdout.write(
-                    self.style.SUCCESS(f'Created persona: {persona.name}')
+        def describe(persona):
+            try:
+                return self.generate_personality_description(
+                    persona.name,
+                    task.city_name,
+                    self.get_demographic_context(
+                        [mapping.subcategory for mapping in persona.subcategory_mappings.all()]
+                    )
                 )
-
-                total_assigned += 1
-                if total_assigned >= population:
-                    self.stdout.write(self.style.WARNING(f'Reached population limit of {population}, stopping generation'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Error describing persona {persona.id}: {e}'))
+                return None
+            finally:
+                # Worker threads get their own DB connections; don't leak them
+                connections.close_all()
+
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                check_lease(lost)
+                batch = list(pending.filter(id__gt=last_id).prefetch_related(
+                    'subcategory_mappings__subcategory__category'
+                )[:batch_size])
+                if not batch:
                     break
+                last_id = batch[-1].id
+
+                described = []
+                for persona, description in zip(batch, executor.map(describe, batch)):
+                    if description is not None:
+                        persona.personality_description = description
+                        persona.description_pending = False
+                        described.append(persona)
+                Persona.objects.bulk_update(
+                    described, ['personality_description', 'description_pending'], batch_size=batch_size
+                )
+                tasks.update(
+                    descriptions_completed=F('descriptions_completed') + len(described),
+                    descriptions_failed=F('descriptions_failed') + len(batch) - len(described)
+                )
 
-            if total_assigned >= population:
-                break
-
-        self.stdout.write(self.style.SUCCESS(f'Chunk generated personas: {total_assigned}'))
-        return personas
-
-    def process_single_persona(self, row_data, city_name):
-        """Process a single CSV row to create a persona"""
-        try:
-            context_items = []
-            for key, value in row_data.items():
-                if key != 'Name' and pd.notna(value):
-                    context_items.append(f"{key}: {value}")
-            context_summary = "; ".join(context_items)
+        task.refresh_from_db()
+        max_runs = getattr(settings, 'PERSONA_DESCRIPTION_MAX_RUNS', DEFAULT_DESCRIPTION_MAX_RUNS)
+        if task.descriptions_failed:
+            task.description_status = 'pending' if task.description_runs < max_runs else 'failed'
+            task.error_message = (
+                f'{task.descriptions_failed} persona descriptions failed and are still pending '
+                f'(run {task.description_runs} of {max_runs})'
+            )
+        else:
+            task.description_status = 'completed'
+            task.error_message = None
+        task.save(update_fields=['description_status', 'error_message', 'updated_at'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Described {task.descriptions_completed} of {task.descriptions_total} personas for {task.city_name}'
+        ))
+
+    def process_csv_chunk(self, task, rows, executor, resolver):
+        """
+        Creates the personas of a chunk of CSV rows.
+
+        The descriptions are generated concurrently on the executor, then the personas,
+        their subcategory mappings and raw rows are bulk-created in one transaction that
+        also advances the task's progress. Rows whose description fails are created
+        description_pending, for the description stage, and counted in rows_failed.
+        Subcategories new to `resolver` are created beforehand.
+
+        Returns:
+            int: The number of personas created
+        """
+        city_name = task.city_name
+        described = list(zip(rows, executor.map(self.describe_csv_row, rows, repeat(city_name))))
+        failed = sum(1 for _, description in described if description is None)
+        cells = [
+            [
+                (column, str(value)) for column, value in row_data.items()
+                if column != 'Name' and pd.notna(value)
+            ]
+            for row_data, _ in described
+        ]
+        resolver.add_missing(key for row_cells in cells for key in row_cells)
 
-            with transaction.atomic():
-                persona = Persona(
+        with transaction.atomic():
+            personas = Persona.objects.bulk_create([
+                Persona(
                     name=row_data['Name'],
-                    city=city_name
+                    city=city_name,
+                    personality_description=description,
+                    description_pending=description is None
                 )
-                
-                description = self.generate_personality_description(
-                    persona.name,
-                    city_name,
-                    context_summary
-                )
-                
-                persona.personality_description = description
-                persona.save()
-
-                for column, value in row_data.items():
-                    if column != 'Name' and pd.notna(value):
-                        category, _ = Category.objects.get_or_create(
-                            name=column,
-                            city=city_name,
-                            defaults={'description': f'Demographic category for {column}'}
-                        )
-
-                        subcategory, created = SubCategory.objects.get_or_create(
-                            category=category,
-                            name=str(value),
-                            city=city_name,
-                            defaults={
-                                'percentage': 0.0,
-                                'description': f'Subcategory {value} under {column}'
-                            }
-                        )
-
-                        PersonaSubCategoryMapping.objects.create(
-                            persona=persona,
-                            subcategory=subcategory
-                        )
-
-                        if created:
-                            self.update_subcategory_percentages(category, city_name)
-
-                RawPersonaModel.objects.create(
-                    row_data=row_data,
+                for row_data, description in described
+            ])
+
+            PersonaSubCategoryMapping.objects.bulk_create([
+                PersonaSubCategoryMapping(persona=persona, subcategory=resolver[key])
+                for persona, row_cells in zip(personas, cells)
+                for key in row_cells
+            ])
+
+            # Names and subcategories use the cells' text; the raw row keeps their numbers
+            RawPersonaModel.objects.bulk_create([
+                RawPersonaModel(
+                    row_data={column: typed_csv_value(value) for column, value in row_data.items()},
                     persona=persona,
                     city=city_name
                 )
+                for persona, (row_data, _) in zip(personas, described)
+            ])
+
+            PersonaGenerationTask.objects.filter(id=task.id).update(
+                rows_processed=F('rows_processed') + len(rows),
+                rows_failed=F('rows_failed') + failed
+            )
+        return len(personas)
 
-                return persona
+    def describe_csv_row(self, row_data, city_name):
+        """
+        Generates the personality description of a CSV row.
 
+        Returns:
+            str: The description, None if it could not be generated
+        """
+        try:
+            context_summary = "; ".join(
+                f"{key}: {value}" for key, value in row_data.items()
+                if key != 'Name' and pd.notna(value)
+            )
+            return self.generate_personality_description(
+                row_data['Name'], city_name, context_summary
+            )
         except Exception as e:
             self.stdout.write(
                 self.style.ERROR(f'Error processing persona {row_data.get("Name")}: {e}')
             )
             return None
+        finally:
+            connections.close_all()
 
     def get_demographic_context(self, subcategories):
         """Generate context summary from subcategories"""
@@ -373,62 +570,32 @@ class Command(BaseCommand):
         return "; ".join(context_items)
 
     def generate_personality_description(self, name, city, context_summary):
-        """Generate personality description using LLM"""
-        try:
-            active_model = LLMModelAndKey.objects.filter(active=True).first()
-            if not active_model:
-                raise ValueError("No active LLM model found.")
-
-            prompt_entry = PromptModel.objects.filter(task_name='personality_description').first()
-            if not prompt_entry:
-                raise ValueError("No prompt template found for personality description.")
-
-            prompt = prompt_entry.prompt_template.format(
-                name=name,
-                city=city,
-                context=context_summary,
-                version=prompt_entry.version
-            )
-
-            if active_model.provider_name == 'anthropic':
-                description = ask_claude(prompt, active_model.model_name)
-            elif active_model.provider_name == 'openai':
-                description = ask_gpt(prompt, active_model.model_name)
-            elif active_model.provider_name == 'google':
-                description = ask_gemini(prompt, active_model.model_name)
-            else:
-                raise ValueError(f"Unsupported provider: {active_model.provider_name}")
-
-            return description.strip() if description else "A unique individual with diverse characteristics."
-
-        except Exception as e:
-            print(f"Error generating persona description: {e}")
-            return "A unique individual with diverse characteristics."
+        """
+        Generate personality description using LLM.
+
+        Raises:
+            ValueError: If no active model or prompt template is configured
+            LLMError: If the LLM call fails after retries or returns an empty description
+        """
+        active_model = LLMModelAndKey.objects.filter(active=True).first()
+        if not active_model:
+            raise ValueError("No active LLM model found.")
+
+        prompt_entry = PromptModel.objects.filter(task_name='personality_description').first()
+        if not prompt_entry:
+            raise ValueError("No prompt template found for personality description.")
+
+        prompt = prompt_entry.prompt_template.format(
+            name=name,
+            city=city,
+            context=context_summary,
+            version=prompt_entry.version
+        )
 
-    def update_subcategory_percentages(self, category, city_name):
-        """Update percentages for subcategories within a category"""
-        try:
-            subcategories = SubCategory.objects.filter(
-                category=category,
-                city=city_name
+        description = ask_llm(active_model, prompt)
+        if not description or not description.strip():
+            raise LLMResponseError(
+                f"Empty personality description for {name}",
+                active_model.provider_name, active_model.model_name
             )
-            
-            total_personas = PersonaSubCategoryMapping.objects.filter(
-                subcategory__category=category,
-                subcategory__city=city_name
-            ).count()
-            
-            if total_personas > 0:
-                for subcategory in subcategories:
-                    persona_count = PersonaSubCategoryMapping.objects.filter(
-                        subcategory=subcategory
-                    ).count()
-                    
-                    percentage = (persona_count / total_personas) * 100
-                    subcategory.percentage = round(percentage, 2)
-                    subcategory.save()
-
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f'Error updating subcategory percentages: {e}')
-            )
\ No newline at end of file
+        return description.strip()
@@ -0,0 +1,44 @@
+"""
+This script provides a management command that rebuilds the response and demographic
+summaries of aggregations from their stored EmotionalResponse rows, e.g. after a
+worker crashed midway through a run.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from simulator.models import AggregateEmotion
+from simulator.utils.summary_engine import recompute_aggregate_emotion
+
+
+class Command(BaseCommand):
+    """Command defining class for summary recomputation"""
+    help = 'Recompute aggregation summaries from the stored emotional responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aggregate_ids',
+            nargs='*',
+            type=int,
+            help='AggregateEmotion ids to recompute (default: all)'
+        )
+        parser.add_argument(
+            '--city',
+            type=str,
+            help='Only recompute aggregations of this city'
+        )
+
+    def handle(self, *args, **options):
+        aggregations = AggregateEmotion.objects.select_related('news_item').order_by('id')
+        if options['aggregate_ids']:
+            aggregations = aggregations.filter(id__in=options['aggregate_ids'])
+            missing = set(options['aggregate_ids']) - set(aggregations.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown aggregation ids: {', '.join(map(str, sorted(missing)))}")
+        if options['city']:
+            aggregations = aggregations.filter(city=options['city'])
+
+        for aggregate_emotion in aggregations:
+            total_responses = recompute_aggregate_emotion(aggregate_emotion)
+            self.stdout.write(
+                f"Aggregation {aggregate_emotion.id} ({aggregate_emotion.city}, "
+                f"{aggregate_emotion.news_item.title}): {total_responses} responses"
+            )
+        self.stdout.write(self.style.SUCCESS('Summaries recomputed'))
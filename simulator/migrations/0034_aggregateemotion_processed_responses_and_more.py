@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0033_personagenerationtask_population'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregateemotion',
+            name='processed_responses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aggregateemotion',
+            name='total_responses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='promptmodel',
+            name='tools_content',
+            field=models.JSONField(blank=True, default=list, help_text='JSON array of tool configurations like function definitions that can be used with this prompt.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='promptmodel',
+            name='task_name',
+            field=models.CharField(choices=[('personality_description', 'Personality Description'), ('generate_user_response', 'Generate User Response'), ('generate_optimal_response', 'Generate Optimal Response'), ('generate_combined_optimal_response', 'Generate Combined Optimal Response')], default='personality_description', max_length=50, unique=True),
+        ),
+        migrations.CreateModel(
+            name='OptimizedResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100)),
+                ('demographic_focus', models.JSONField(default=list)),
+                ('original_content', models.TextField()),
+                ('optimized_content', models.TextField(help_text='Strategic recommendations for maximizing satisfaction')),
+                ('optimization_metrics', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('news_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='simulator.newsitem')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0035_llmresponsecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregateemotion',
+            name='llm_usage',
+            field=models.JSONField(blank=True, default=dict, help_text='Token usage of the aggregation run, including provider prompt-cache reads.'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0036_aggregateemotion_llm_usage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='llmmodelandkey',
+            name='provider_name',
+            field=models.CharField(choices=[('openai', 'OpenAI'), ('anthropic', 'Anthropic'), ('google', 'Google Generative AI'), ('fake', 'Fake (offline load testing)')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0037_llmmodelandkey_fake_provider'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('aggregation', 'Emotion aggregation'), ('persona_generation', 'Persona generation')], max_length=50)),
+                ('object_id', models.IntegerField(help_text='Id of the AggregateEmotion or PersonaGenerationTask the job runs.')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='The job is not claimed before this time.')),
+                ('lease_owner', models.CharField(blank=True, default='', max_length=255)),
+                ('lease_token', models.CharField(blank=True, default='', max_length=32)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'status', 'available_at'], name='simulator_w_kind_d3364a_idx')],
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
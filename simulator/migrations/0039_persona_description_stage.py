@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0038_workerjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persona',
+            name='description_pending',
+            field=models.BooleanField(db_index=True, default=False, help_text='Created without a description; filled in by the persona description stage.'),
+        ),
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='description_status',
+            field=models.CharField(blank=True, choices=[('', 'Not started'), ('pending', 'Pending'), ('in_progress', 'In Progress'), ('completed', 'Completed'), ('failed', 'Failed')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='descriptions_completed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='descriptions_failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='descriptions_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='workerjob',
+            name='kind',
+            field=models.CharField(choices=[('aggregation', 'Emotion aggregation'), ('persona_generation', 'Persona generation'), ('persona_descriptions', 'Persona descriptions')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0039_persona_description_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='rows_failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='rows_processed',
+            field=models.IntegerField(default=0),
+        ),
+    ]
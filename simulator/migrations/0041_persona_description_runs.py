@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0040_persona_task_rows_processed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='description_runs',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simulator', '0041_persona_description_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personagenerationtask',
+            name='personas_created',
+            field=models.IntegerField(default=0),
+        ),
+    ]
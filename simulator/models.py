@@ -12,6 +12,7 @@ Models included:
 
 3. **Persona**: 
    - Represents an individual persona with attributes such as name, city, and a description of their personality traits.
+   - Personas generated from demographics, and CSV rows whose description failed, are described later (`description_pending`).
 
 4. **PersonaSubCategoryMapping**: 
    - Maps personas to their associated subcategories for demographic alignment.
@@ -26,6 +27,7 @@ Models included:
 7. **PersonaGenerationTask**: 
    - Tracks the status of persona generation tasks for a city based on its population.
    - Supports statuses like pending, in-progress, completed, and failed.
+   - Tracks the progress of the description stage separately (`description_status`, counters).
 
 8. **PossibleUserResponses**: 
    - Represents predefined possible user responses to a specific news item.
@@ -34,10 +36,20 @@ Models included:
    - Represents an emotional response or user reaction by a Persona to a specific NewsItem.
    - Links to PossibleUserResponses for predefined reactions and includes intensity and explanations.
 
+10. **LLMResponseCache**: 
+   - Content-addressed cache of LLM responses keyed by provider, model, prompt, tools and max tokens.
+   - Tracks access times and hit counts for TTL and least-recently-used eviction.
+
+11. **WorkerJob**: 
+   - Queue entry for a background aggregation, persona generation or persona description job.
+   - Claimed by one worker at a time under a lease that the worker renews with heartbeats; expired leases are re-claimed.
+
 Each model has descriptive methods for string representation to ensure clarity when interacting with instances in the admin interface or during debugging.
 """
 from django.db import models
 from django.db.models import JSONField
+from django.utils import timezone
+from simulator.utils.prompt_segments import render_segments
 
 class Category(models.Model):
     """
@@ -83,6 +95,11 @@ class Persona(models.Model):
     city = models.CharField(max_length=255,blank=True, null=True)
     # personality_traits = models.JSONField(default=dict)
     personality_description = models.TextField(blank=True, null=True)
+    description_pending = models.BooleanField(
+        default=False,
+        db_index=True,
+        help_text="Created without a description; filled in by the persona description stage."
+    )
 
     def __str__(self):
         return f"{self.name} ({self.city})"
@@ -119,6 +136,7 @@ class AggregateEmotion(models.Model):
     demographic_summary = models.JSONField(default=dict,blank=True, null=True)
     total_responses = models.IntegerField(default=0)
     processed_responses = models.IntegerField(default=0)
+    llm_usage = models.JSONField(default=dict, blank=True, help_text="Token usage of the aggregation run, including provider prompt-cache reads.")
     created_at = models.DateTimeField(auto_now_add=True,blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True,blank=True, null=True)
     
@@ -144,6 +162,29 @@ class PersonaGenerationTask(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     csv_file = models.FileField(upload_to='persona_csv_files/',blank=True, null=True)
+    description_status = models.CharField(
+        max_length=20,
+        choices=[
+            ('', 'Not started'),
+            ('pending', 'Pending'),
+            ('in_progress', 'In Progress'),
+            ('completed', 'Completed'),
+            ('failed', 'Failed')
+        ],
+        blank=True,
+        default=''
+    )
+    descriptions_total = models.IntegerField(default=0)
+    descriptions_completed = models.IntegerField(default=0)
+    descriptions_failed = models.IntegerField(default=0)
+    # Runs of the description stage; failed descriptions are retried up to PERSONA_DESCRIPTION_MAX_RUNS
+    description_runs = models.IntegerField(default=0)
+    # CSV rows imported so far (streamed in chunks), and those whose description failed and
+    # was left to the description stage
+    rows_processed = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    # Personas created so far by demographics-based generation, so a re-claimed task creates the rest
+    personas_created = models.IntegerField(default=0)
 
 class PossibleUserResponses(models.Model):
     """
@@ -178,6 +219,7 @@ class LLMModelAndKey(models.Model):
         ('openai', 'OpenAI'),
         ('anthropic', 'Anthropic'),
         ('google', 'Google Generative AI'),
+        ('fake', 'Fake (offline load testing)'),
     ]
 
     model_name = models.CharField(max_length=100)
@@ -228,6 +270,14 @@ class PromptModel(models.Model):
     def __str__(self):
         return f"{self.task_name} (Version: {self.version})"
 
+    def render_segments(self, dynamic_fields, **values):
+        """
+        Renders the template as PromptSegments: a prefix shared by every request of a
+        job (cacheable by the provider) and a suffix starting at the first placeholder
+        named in dynamic_fields.
+        """
+        return render_segments(self.prompt_template, dynamic_fields, version=self.version, **values)
+
 class RawPersonaModel(models.Model):
     """Persona details processed from the csv file"""
     row_data = JSONField()
@@ -252,4 +302,56 @@ class OptimizedResponse(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"Optimization strategy for {self.news_item.title} - {self.city}"
\ No newline at end of file
+        return f"Optimization strategy for {self.news_item.title} - {self.city}"
+
+class LLMResponseCache(models.Model):
+    """
+    Cached LLM response, addressed by a hash of the request that produced it.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    provider_name = models.CharField(max_length=50)
+    model_name = models.CharField(max_length=100)
+    response = models.JSONField()
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.provider_name} ({self.model_name}) - {self.key[:12]}"
+
+
+class WorkerJob(models.Model):
+    """
+    Queue entry for a background job (see simulator/utils/job_queue.py).
+    """
+    KIND_CHOICES = [
+        ('aggregation', 'Emotion aggregation'),
+        ('persona_generation', 'Persona generation'),
+        ('persona_descriptions', 'Persona descriptions'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    object_id = models.IntegerField(help_text="Id of the AggregateEmotion or PersonaGenerationTask the job runs.")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    available_at = models.DateTimeField(default=timezone.now, help_text="The job is not claimed before this time.")
+    lease_owner = models.CharField(max_length=255, blank=True, default='')
+    lease_token = models.CharField(max_length=32, blank=True, default='')
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['kind', 'object_id']
+        indexes = [models.Index(fields=['kind', 'status', 'available_at'])]
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} - {self.status}"
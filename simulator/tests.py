@@ -17,9 +17,21 @@ Dependencies:
     - Simulator models and utilities for handling personas and emotional responses.
 """
 
-from unittest.mock import patch
-from django.test import Client, TestCase
+import os
+import re
+import tempfile
+import threading
+import time
+import numpy as np
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.core.management import call_command
 from django.contrib.messages.storage.fallback import FallbackStorage
 from django.contrib import messages
 from django.contrib.sessions.middleware import SessionMiddleware
@@ -30,10 +42,57 @@ from simulator.models import (
     Persona,
     Category,
     SubCategory,
-    PersonaSubCategoryMapping
+    PersonaGenerationTask,
+    PersonaSubCategoryMapping,
+    PossibleUserResponses,
+    EmotionalResponse,
+    LLMResponseCache,
+    LLMModelAndKey,
+    PromptModel,
+    RawPersonaModel,
+    WorkerJob
 )
+from simulator.utils.llm_clients import get_client, reset_clients
+from simulator.utils.llm_errors import (
+    CircuitOpenError,
+    LLMProviderError,
+    LLMRateLimitError,
+    LLMRequestError,
+    LLMTimeoutError
+)
+from simulator.utils.llm_resilience import get_breaker, reset_breakers, resilient_llm_call
+from simulator.utils.ask_fake import ask_fake, fake_text, reset_fake_provider
+from simulator.utils.llm_batch import LocalFileBatchBackend, write_batch_files
+from simulator.utils.llm_hedging import get_hedging_stats, get_tracker, hedged_call, reset_hedging
+from simulator.utils.provider_limits import (
+    AdaptiveConcurrencyLimiter,
+    ProviderWaitTimeout,
+    TokenBucket,
+    get_limiter,
+    provider_slot,
+    reset_limiters
+)
+from simulator.utils.llm_cache import cached_llm_response, get_cache_stats, response_cache
+from simulator.utils.llm_usage import metered, record_usage
+from simulator.utils.response_writer import EmotionalResponseWriter
+from simulator.utils.demographic_index import DemographicIndex
+from simulator.utils.apportionment import iter_apportioned_combinations, largest_remainder
+from simulator.utils.summary_engine import PartialSummaryPublisher, compute_summaries
+from simulator.utils import job_queue
+from simulator.utils.job_signals import wait_for_jobs
+from simulator.utils.prompt_segments import render_segments
+from simulator.utils.ask_claude_tools import ask_claude_tools
+from simulator.utils.impact_assesment_helper import (
+    format_persona_details,
+    generate_emotional_responses_batch,
+    get_possible_responses,
+    render_user_response_prompt,
+    resolve_batch_size
+)
+from simulator.management.commands.generate_personas import Command as PersonaGenerationCommand
 from simulator.management.commands.aggregate_emotions import (
     Command as EmotionAggregationCommand,
+    aggregate_emotion_batch_task,
     aggregate_emotion_task
 )
 
@@ -328,3 +387,1416 @@ class AggregateEmotionTestCase(TestCase):
 
         self.assertEqual(args.city, 'TestCity')
         self.assertEqual(args.interval, 60)
+
+
+class AggregationEngineTestCase(TestCase):
+    """
+    Unit tests for the aggregation engine: concurrent persona evaluation and the
+    summaries built from its results.
+    """
+    def setUp(self):
+        """
+        Set up a small city with one demographic category and a news item
+        with two possible responses
+        """
+        self.city_name = 'EngineCity'
+        self.age_category = Category.objects.create(name='Age Group', city=self.city_name)
+        self.young = SubCategory.objects.create(
+            name='Young Adult', category=self.age_category, city=self.city_name, percentage=50
+        )
+        self.old = SubCategory.objects.create(
+            name='Senior', category=self.age_category, city=self.city_name, percentage=50
+        )
+
+        self.personas = []
+        for i in range(10):
+            persona = Persona.objects.create(name=f'Persona {i}', city=self.city_name)
+            PersonaSubCategoryMapping.objects.create(
+                persona=persona,
+                subcategory=self.young if i < 5 else self.old
+            )
+            self.personas.append(persona)
+
+        self.news_item = NewsItem.objects.create(title='Engine News', content='Engine news content')
+        self.support = PossibleUserResponses.objects.create(
+            news_item=self.news_item, response_text='Support'
+        )
+        self.oppose = PossibleUserResponses.objects.create(
+            news_item=self.news_item, response_text='Oppose'
+        )
+        self.aggregate_emotion = AggregateEmotion.objects.create(
+            news_item=self.news_item,
+            city=self.city_name,
+            summary={'status': 'Processing'},
+            demographic_summary={}
+        )
+        LLMModelAndKey.objects.create(model_name='claude-test', provider_name='anthropic', active=True)
+        PromptModel.objects.create(
+            task_name='generate_user_response',
+            prompt_template='News: {news_title}\nResponses:\n{responses_list}\nLength: {version}\n{persona_details}',
+            version='Concise',
+            tools_content=[{'name': 'generate_user_response'}]
+        )
+
+    def _run_task(self, mock_response, concurrency, **options):
+        """
+        Runs the aggregation task with young adults supporting and seniors opposing
+        """
+        mock_response.side_effect = lambda persona, news_item, demographic_index=None: (
+            (self.support.id, 0.5, 'Because') if persona.name < 'Persona 5'
+            else (self.oppose.id, 0.5, 'Because')
+        )
+        result = aggregate_emotion_task(
+            self.city_name,
+            self.news_item.title,
+            self.aggregate_emotion.id,
+            concurrency=concurrency,
+            **options
+        )
+        self.aggregate_emotion.refresh_from_db()
+        return result
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_concurrent_aggregation_matches_serial(self, mock_response):
+        """
+        Running the persona loop on a worker pool produces the same summary as a serial run
+        """
+        result = self._run_task(mock_response, concurrency=4)
+
+        self.assertEqual(result, "Aggregation completed successfully")
+        self.assertEqual(mock_response.call_count, 10)
+        self.assertEqual(EmotionalResponse.objects.filter(news_item=self.news_item).count(), 10)
+
+        response_summary = self.aggregate_emotion.summary['response_summary']
+        self.assertEqual(response_summary[str(self.support.id)]['count'], 5)
+        self.assertEqual(response_summary[str(self.oppose.id)]['count'], 5)
+
+        seniors = self.aggregate_emotion.demographic_summary['Age Group']['senior']
+        self.assertEqual(seniors[str(self.oppose.id)]['count'], 5)
+        self.assertEqual(seniors[str(self.support.id)]['count'], 0)
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_failed_personas_do_not_stop_the_pool(self, mock_response):
+        """
+        A persona whose LLM call raises is skipped while the rest are aggregated
+        """
+        def respond(persona, news_item, demographic_index=None):
+            if persona.name == 'Persona 3':
+                raise ValueError('LLM API error')
+            return self.support.id, 0.7, 'Because'
+
+        mock_response.side_effect = respond
+        aggregate_emotion_task(
+            self.city_name, self.news_item.title, self.aggregate_emotion.id, concurrency=3
+        )
+        self.aggregate_emotion.refresh_from_db()
+
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 9)
+        self.assertEqual(self.aggregate_emotion.processed_responses, 9)
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_open_circuit_leaves_personas_for_the_next_run(self, mock_response):
+        """
+        Personas rejected by an open circuit breaker stay pending, and the run keeps its
+        'Processing' status so the job resumes them later
+        """
+        def respond(persona, news_item, demographic_index=None):
+            if persona.name >= 'Persona 7':
+                raise CircuitOpenError('claude-test: circuit open')
+            return self.support.id, 0.7, 'Because'
+
+        mock_response.side_effect = respond
+        result = aggregate_emotion_task(
+            self.city_name, self.news_item.title, self.aggregate_emotion.id, concurrency=3
+        )
+        self.aggregate_emotion.refresh_from_db()
+
+        self.assertEqual(result, "Aggregation paused: provider unavailable")
+        self.assertEqual(self.aggregate_emotion.summary['status'], 'Processing')
+        self.assertEqual(self.aggregate_emotion.processed_responses, 7)
+
+        mock_response.reset_mock()
+        self._run_task(mock_response, concurrency=3)
+        self.assertEqual(mock_response.call_count, 3)
+        self.assertEqual(self.aggregate_emotion.summary['status'], 'completed')
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 10)
+
+    def test_concurrency_argument_parsing(self):
+        """
+        The aggregate_emotions command accepts a --concurrency option
+        """
+        parser = EmotionAggregationCommand().create_parser('manage.py', 'aggregate_emotions')
+
+        args = parser.parse_args(['--concurrency', '12'])
+
+        self.assertEqual(args.concurrency, 12)
+
+
+    @patch('simulator.utils.impact_assesment_helper.ask_llm')
+    def test_batched_responses_are_mapped_back_to_personas(self, mock_ask_llm):
+        """
+        One request covers the batch; missing or invalid entries fall back to single calls
+        """
+        batch = self.personas[:4]
+        mock_ask_llm.side_effect = [
+            {'responses': [
+                {'persona_id': batch[0].id, 'selected_response_number': self.support.id,
+                 'intensity': 0.9, 'explanation': 'Good for me'},
+                {'persona_id': batch[1].id, 'selected_response_number': self.oppose.id,
+                 'intensity': 0.4, 'explanation': 'Bad for me'},
+                # Unknown response id: invalid
+                {'persona_id': batch[2].id, 'selected_response_number': 999,
+                 'intensity': 0.4, 'explanation': 'Unknown'},
+                # Persona outside the batch: ignored
+                {'persona_id': self.personas[9].id, 'selected_response_number': self.oppose.id,
+                 'intensity': 0.4, 'explanation': 'Not asked'},
+            ]},
+            {'selected_response_number': self.support.id, 'intensity': 0.1, 'explanation': 'Single'},
+            {'selected_response_number': self.oppose.id, 'intensity': 0.2, 'explanation': 'Single'},
+        ]
+
+        outcomes = dict(
+            (persona.id, result)
+            for persona, result in generate_emotional_responses_batch(batch, self.news_item)
+        )
+
+        self.assertEqual(mock_ask_llm.call_count, 3)
+        batch_prompt = mock_ask_llm.call_args_list[0].args[1].text
+        self.assertEqual(batch_prompt.count('News: Engine News'), 1)
+        self.assertIn(f'Persona ID: {batch[3].id}', batch_prompt)
+        self.assertEqual(outcomes[batch[0].id], (self.support.id, 0.9, 'Good for me'))
+        self.assertEqual(outcomes[batch[1].id], (self.oppose.id, 0.4, 'Bad for me'))
+        self.assertEqual(outcomes[batch[2].id], (self.support.id, 0.1, 'Single'))
+        self.assertEqual(outcomes[batch[3].id], (self.oppose.id, 0.2, 'Single'))
+
+    def test_automatic_batch_size_respects_limits(self):
+        """
+        Batch size is capped by the configured maximum and by the output token budget
+        """
+        with self.settings(EMOTION_BATCH_MAX_SIZE=25, LLM_MAX_OUTPUT_TOKENS=8192):
+            self.assertEqual(resolve_batch_size(self.news_item, self.personas), 25)
+        with self.settings(EMOTION_BATCH_MAX_SIZE=25, LLM_MAX_OUTPUT_TOKENS=1500):
+            self.assertEqual(resolve_batch_size(self.news_item, self.personas), 10)
+        with self.settings(LLM_CONTEXT_TOKENS={'anthropic': 100}):
+            self.assertEqual(resolve_batch_size(self.news_item, self.personas), 1)
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_responses_batch')
+    def test_aggregation_with_batches(self, mock_batch):
+        """
+        The aggregation task sends personas to the batch generator in chunks of batch_size
+        """
+        mock_batch.side_effect = lambda personas, news_item, demographic_index=None: [
+            (persona, (self.support.id, 0.5, 'Because')) for persona in personas
+        ]
+
+        aggregate_emotion_task(
+            self.city_name, self.news_item.title, self.aggregate_emotion.id,
+            concurrency=2, batch_size=4
+        )
+        self.aggregate_emotion.refresh_from_db()
+
+        self.assertEqual(sorted(len(call.args[0]) for call in mock_batch.call_args_list), [2, 4, 4])
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 10)
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_aggregation_records_llm_usage(self, mock_response):
+        """
+        Token usage reported by LLM calls in the worker pool is stored on the aggregation
+        """
+        def respond(persona, news_item, demographic_index=None):
+            record_usage(requests=1, input_tokens=10, cache_read_input_tokens=90, output_tokens=5)
+            return self.support.id, 0.5, 'Because'
+
+        mock_response.side_effect = respond
+        aggregate_emotion_task(
+            self.city_name, self.news_item.title, self.aggregate_emotion.id, concurrency=3
+        )
+        self.aggregate_emotion.refresh_from_db()
+
+        usage = self.aggregate_emotion.llm_usage
+        self.assertEqual(usage['requests'], 10)
+        self.assertEqual(usage['cache_read_input_tokens'], 900)
+        self.assertEqual(usage['cache_read_ratio'], 0.9)
+
+    def test_user_response_prompt_shares_prefix_between_personas(self):
+        """
+        Only the persona block differs between the prompts of one run
+        """
+        prompt_template = PromptModel.objects.get(task_name='generate_user_response')
+        _, responses_list = get_possible_responses(self.news_item)
+
+        first, second = (
+            render_user_response_prompt(prompt_template, format_persona_details(persona), self.news_item, responses_list)
+            for persona in self.personas[:2]
+        )
+
+        self.assertEqual(first.prefix, second.prefix)
+        self.assertIn('Length: Concise', first.prefix)
+        self.assertNotEqual(first.suffix, second.suffix)
+
+    @override_settings(AGGREGATION_BATCH_RESUBMITS=1)
+    def test_batch_mode_submits_polls_and_ingests(self):
+        """
+        Batch mode submits one request per persona, waits for the service, then ingests in
+        bulk; failed requests are submitted again before the failures are counted
+        """
+        def responder(params):
+            persona_number = int(re.search(r'Name Persona (\d+)', params['messages'][0]['content']).group(1))
+            if persona_number == 9:
+                raise ValueError('request failed')
+            response = self.support if persona_number < 5 else self.oppose
+            return {'selected_response_number': response.id, 'intensity': 0.5, 'explanation': 'Because'}
+
+        with tempfile.TemporaryDirectory() as batch_dir:
+            backend = LocalFileBatchBackend(batch_dir)
+            run = lambda: aggregate_emotion_batch_task(
+                self.city_name, self.news_item.title, self.aggregate_emotion.id, backend=backend
+            )
+
+            self.assertEqual(run(), "Batch submitted")
+            self.assertEqual(run(), "Batch in progress")
+            self.aggregate_emotion.refresh_from_db()
+            batch_state = self.aggregate_emotion.summary['batch']
+            self.assertEqual(batch_state['requests'], 10)
+
+            backend.complete(batch_state['ids'][0], responder)
+            self.assertEqual(run(), "Batch resubmitted")
+            self.aggregate_emotion.refresh_from_db()
+            batch_state = self.aggregate_emotion.summary['batch']
+            self.assertEqual((batch_state['requests'], batch_state['resubmissions']), (1, 1))
+
+            backend.complete(batch_state['ids'][0], responder)
+            self.assertEqual(run(), "Aggregation completed successfully")
+
+        self.aggregate_emotion.refresh_from_db()
+        summary = self.aggregate_emotion.summary
+        self.assertEqual(summary['status'], 'completed')
+        self.assertEqual(summary['total_responses'], 9)
+        self.assertEqual(summary['failed_requests'], 1)
+        self.assertEqual(summary['response_summary'][str(self.oppose.id)]['count'], 4)
+        self.assertEqual(EmotionalResponse.objects.filter(news_item=self.news_item).count(), 9)
+        seniors = self.aggregate_emotion.demographic_summary['Age Group']['senior']
+        self.assertEqual(seniors[str(self.oppose.id)]['percentage'], 100.0)
+
+    def test_batch_mode_splits_requests_under_the_provider_limits(self):
+        """
+        Requests beyond a backend's per-batch count or size limit go to further batches
+        """
+        with tempfile.TemporaryDirectory() as batch_dir:
+            backend = LocalFileBatchBackend(batch_dir)
+            backend.max_requests = 4
+            self.assertEqual(aggregate_emotion_batch_task(
+                self.city_name, self.news_item.title, self.aggregate_emotion.id, backend=backend
+            ), "Batch submitted")
+            self.aggregate_emotion.refresh_from_db()
+            batch_ids = self.aggregate_emotion.summary['batch']['ids']
+            self.assertEqual(
+                [sum(1 for _ in open(os.path.join(batch_dir, batch_id, 'input.jsonl'))) for batch_id in batch_ids],
+                [4, 4, 2]
+            )
+
+            backend.max_requests = None
+            backend.max_bytes = 10
+            with self.assertRaises(ValueError):
+                write_batch_files([backend.build_request('persona-1', 'model', 'Prompt')], backend)
+
+    def test_batch_mode_completes_without_submitting_when_everyone_answered(self):
+        """
+        A resumed batch aggregation with no persona left completes instead of submitting an empty batch
+        """
+        EmotionalResponse.objects.bulk_create([
+            EmotionalResponse(persona=persona, news_item=self.news_item, user_response=self.support,
+                              intensity=0.5, explanation='Before the restart')
+            for persona in self.personas
+        ])
+        backend = MagicMock()
+
+        result = aggregate_emotion_batch_task(
+            self.city_name, self.news_item.title, self.aggregate_emotion.id, backend=backend
+        )
+
+        self.assertEqual(result, "Aggregation completed successfully")
+        backend.submit.assert_not_called()
+        self.aggregate_emotion.refresh_from_db()
+        self.assertEqual(self.aggregate_emotion.summary['status'], 'completed')
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 10)
+
+    @override_settings(LLM_FAKE_PROVIDER={'LATENCY_MEDIAN': 0})
+    def test_fake_provider_drives_batched_aggregation(self):
+        """
+        The offline fake provider answers batched tool calls with valid entries for every persona
+        """
+        LLMModelAndKey.objects.create(model_name='fake-model', provider_name='fake', active=True)
+
+        aggregate_emotion_task(
+            self.city_name, self.news_item.title, self.aggregate_emotion.id,
+            concurrency=1, batch_size=5
+        )
+        self.aggregate_emotion.refresh_from_db()
+
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 10)
+        self.assertEqual(self.aggregate_emotion.llm_usage['requests'], 2)
+
+    def test_response_writer_flushes_by_size_time_and_on_error(self):
+        """
+        Rows are bulk-created every flush_rows rows or flush_seconds, and the pending
+        rows are still written when the run fails
+        """
+        now = [0.0]
+        rows = [
+            EmotionalResponse(
+                persona=persona, news_item=self.news_item, user_response=self.support,
+                intensity=0.5, explanation='Because'
+            )
+            for persona in self.personas[:7]
+        ]
+        stored = EmotionalResponse.objects.filter(news_item=self.news_item)
+
+        with self.assertRaises(RuntimeError):
+            with EmotionalResponseWriter(
+                self.aggregate_emotion.id, flush_rows=3, flush_seconds=2, clock=lambda: now[0]
+            ) as writer:
+                with self.assertNumQueries(2):
+                    for row in rows[:3]:
+                        writer.add(row)
+                self.assertEqual(stored.count(), 3)
+
+                writer.add(rows[3])
+                now[0] = 5.0
+                writer.add(rows[4])
+                self.assertEqual(stored.count(), 5)
+
+                writer.add(rows[5])
+                writer.add(rows[6])
+                raise RuntimeError('worker stopped')
+
+        self.aggregate_emotion.refresh_from_db()
+        self.assertEqual(stored.count(), 7)
+        self.assertEqual(self.aggregate_emotion.processed_responses, 7)
+
+    def test_demographic_index_renders_without_queries(self):
+        """
+        The city's mappings are loaded with one query; lookups need none
+        """
+        PersonaSubCategoryMapping.objects.create(
+            persona=Persona.objects.create(name='Elsewhere', city='OtherCity'), subcategory=self.young
+        )
+        with self.assertNumQueries(1):
+            index = DemographicIndex.load(self.city_name)
+
+        with self.assertNumQueries(0):
+            details = format_persona_details(self.personas[0], index)
+
+        self.assertEqual(len(index), 10)
+        self.assertIn('Demographics: Young Adult (Age Group).', details)
+        self.assertEqual(details, format_persona_details(self.personas[0]))
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_summaries_are_recomputed_from_stored_responses(self, mock_response):
+        """
+        The GROUP BY summary engine reproduces the summaries built during the run
+        """
+        self._run_task(mock_response, concurrency=1)
+        summary = self.aggregate_emotion.summary
+        demographic_summary = self.aggregate_emotion.demographic_summary
+
+        AggregateEmotion.objects.filter(id=self.aggregate_emotion.id).update(
+            summary={'status': 'completed'}, demographic_summary={}
+        )
+        call_command('recompute_summaries', self.aggregate_emotion.id, stdout=StringIO())
+        self.aggregate_emotion.refresh_from_db()
+
+        self.assertEqual(self.aggregate_emotion.summary, summary)
+        self.assertEqual(self.aggregate_emotion.demographic_summary, demographic_summary)
+        young = self.aggregate_emotion.demographic_summary['Age Group']['young adult']
+        self.assertEqual(young[str(self.support.id)]['percentage'], 100.0)
+
+        # Three lookups plus two GROUP BY queries, whatever the number of responses
+        with self.assertNumQueries(5):
+            _, _, total_responses = compute_summaries(self.news_item, self.city_name)
+        self.assertEqual(total_responses, 10)
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_interrupted_aggregation_resumes_without_duplicates(self, mock_response):
+        """
+        Personas answered before a restart are skipped and still counted in the summaries
+        """
+        for persona in self.personas[:4]:
+            EmotionalResponse.objects.create(
+                persona=persona, news_item=self.news_item, user_response=self.support,
+                intensity=0.5, explanation='Before the restart'
+            )
+
+        result = self._run_task(mock_response, concurrency=1)
+
+        self.assertEqual(result, "Aggregation completed successfully")
+        self.assertEqual(
+            sorted(call.args[0].id for call in mock_response.call_args_list),
+            [persona.id for persona in self.personas[4:]]
+        )
+        self.assertEqual(EmotionalResponse.objects.filter(news_item=self.news_item).count(), 10)
+        self.assertEqual(self.aggregate_emotion.processed_responses, 10)
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 10)
+        young = self.aggregate_emotion.demographic_summary['Age Group']['young adult']
+        self.assertEqual(young[str(self.support.id)]['count'], 5)
+
+    @override_settings(AGGREGATION_SAMPLING={'MARGIN': 0.35, 'ROUND_SIZE': 2, 'BUDGET': 10})
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_sampling_stops_once_intervals_are_narrow_enough(self, mock_response):
+        """
+        Sampled rounds cover the strata proportionally and stop at the target margin,
+        with estimates scaled to the population
+        """
+        result = self._run_task(mock_response, concurrency=1, strategy='sample')
+
+        self.assertEqual(result, "Aggregation completed successfully")
+        self.assertEqual(mock_response.call_count, 4)
+        summary = self.aggregate_emotion.summary
+        self.assertEqual(summary['sampling']['stopped'], 'margin')
+        self.assertEqual(summary['sampling']['population'], 10)
+        self.assertEqual(summary['sampling']['sample_size'], 4)
+
+        support = summary['response_summary'][str(self.support.id)]
+        self.assertEqual(support['count'], 2)
+        self.assertEqual(support['estimated_count'], 5)
+        self.assertLess(support['ci_low'], 50.0)
+        self.assertGreater(support['ci_high'], 50.0)
+        young = self.aggregate_emotion.demographic_summary['Age Group']['young adult']
+        self.assertEqual(young[str(self.support.id)]['estimated_count'], 5)
+        self.assertEqual(young[str(self.support.id)]['ci_high'], 100.0)
+
+    @override_settings(AGGREGATION_ARCHETYPES={'SAMPLES': 2})
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_archetypes_are_evaluated_once_and_weighted_by_size(self, mock_response):
+        """
+        Only the sampled members of each demographic combination reach the LLM; the
+        other members get their answers, so the summaries are weighted by archetype size
+        """
+        EmotionalResponse.objects.create(
+            persona=self.personas[3], news_item=self.news_item, user_response=self.support,
+            intensity=0.5, explanation='Before the restart'
+        )
+        result = self._run_task(mock_response, concurrency=1, strategy='archetype')
+
+        self.assertEqual(result, "Aggregation completed successfully")
+        self.assertEqual(
+            [call.args[0].id for call in mock_response.call_args_list],
+            [self.personas[0].id, self.personas[5].id, self.personas[6].id]
+        )
+        self.assertEqual(EmotionalResponse.objects.filter(news_item=self.news_item).count(), 10)
+        self.assertEqual(self.aggregate_emotion.summary['archetypes']['archetypes'], 2)
+        self.assertEqual(self.aggregate_emotion.summary['archetypes']['filled'], 6)
+        response_summary = self.aggregate_emotion.summary['response_summary']
+        self.assertEqual(response_summary[str(self.support.id)]['count'], 5)
+        self.assertEqual(response_summary[str(self.oppose.id)]['count'], 5)
+        seniors = self.aggregate_emotion.demographic_summary['Age Group']['senior']
+        self.assertEqual(seniors[str(self.oppose.id)]['percentage'], 100.0)
+        # Copies name their source member instead of repeating its explanation
+        copies = EmotionalResponse.objects.filter(
+            news_item=self.news_item, explanation__startswith='Inferred from archetype member #'
+        )
+        self.assertEqual(copies.count(), 6)
+        self.assertFalse(
+            EmotionalResponse.objects.filter(explanation='Before the restart').exclude(persona=self.personas[3]).exists()
+        )
+
+    @override_settings(AGGREGATION_SURROGATE={
+        'LABELED': 4, 'HOLDOUT': 0.25, 'THRESHOLD': 1.01, 'MAX_ESCALATIONS': 2
+    })
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_surrogate_predicts_the_unlabeled_personas(self, mock_response):
+        """
+        A stratified labeled subset trains the classifier; the least confident
+        predictions are escalated to the LLM and the rest are predicted
+        """
+        result = self._run_task(mock_response, concurrency=1, strategy='surrogate')
+
+        self.assertEqual(result, "Aggregation completed successfully")
+        self.assertEqual(mock_response.call_count, 6)
+        stats = self.aggregate_emotion.summary['surrogate']
+        self.assertEqual((stats['labeled'], stats['escalated'], stats['predicted']), (4, 2, 4))
+        self.assertEqual(stats['holdout']['holdout_size'], 1)
+        self.assertIn('calibration_error', stats['holdout'])
+
+        response_summary = self.aggregate_emotion.summary['response_summary']
+        self.assertEqual(response_summary[str(self.support.id)]['count'], 5)
+        self.assertEqual(response_summary[str(self.oppose.id)]['count'], 5)
+        predicted = EmotionalResponse.objects.filter(
+            news_item=self.news_item, explanation__startswith='Predicted by the surrogate model'
+        )
+        self.assertEqual(predicted.count(), 4)
+
+    def test_partial_summaries_are_published_while_processing(self):
+        """
+        Flushes publish partial summaries at most every interval, and the API returns
+        them flagged as partial until the run completes
+        """
+        now = [0.0]
+        AggregateEmotion.objects.filter(id=self.aggregate_emotion.id).update(summary={'status': 'Processing'})
+        self.aggregate_emotion.refresh_from_db()
+        publisher = PartialSummaryPublisher(self.aggregate_emotion, interval=5, clock=lambda: now[0])
+
+        with EmotionalResponseWriter(
+            self.aggregate_emotion.id, flush_rows=2, flush_seconds=60, on_flush=publisher,
+            clock=lambda: now[0]
+        ) as writer:
+            for persona in self.personas[:2]:
+                writer.add(EmotionalResponse(
+                    persona=persona, news_item=self.news_item, user_response=self.support,
+                    intensity=0.5, explanation='Because'
+                ))
+            self.aggregate_emotion.refresh_from_db()
+            self.assertNotIn('partial', self.aggregate_emotion.summary)
+
+            now[0] = 6.0
+            for persona in self.personas[2:4]:
+                writer.add(EmotionalResponse(
+                    persona=persona, news_item=self.news_item, user_response=self.oppose,
+                    intensity=0.5, explanation='Because'
+                ))
+
+        session = self.client.session
+        session['is_logged_in'] = True
+        session.save()
+        response = self.client.get(
+            reverse('fetch_summary_api'), {'city': self.city_name, 'news_item': self.news_item.title}
+        ).json()
+
+        self.assertEqual(response['status'], 'processing')
+        self.assertTrue(response['partial'])
+        self.assertEqual(response['processed_responses'], 4)
+        self.assertEqual(response['summary']['total_responses'], 4)
+        self.assertEqual(response['summary']['response_summary'][str(self.oppose.id)]['percentage'], 50.0)
+        self.assertIn('young adult', response['demographic_summary']['Age Group'])
+
+    @patch('simulator.management.commands.aggregate_emotions.generate_emotional_response')
+    def test_rerun_from_the_view_starts_over(self, mock_response):
+        """
+        Starting an aggregation again discards the previous run's answers, so every
+        persona is evaluated again rather than resumed
+        """
+        self._run_task(mock_response, concurrency=1)
+        self.assertEqual(mock_response.call_count, 10)
+
+        session = self.client.session
+        session['is_logged_in'] = True
+        session.save()
+        self.client.post(reverse('aggregate_emotion'), {
+            'city': self.city_name, 'news_item': self.news_item.title, 'possible_response_1': 'Undecided'
+        })
+
+        self.aggregate_emotion.refresh_from_db()
+        self.assertEqual(self.aggregate_emotion.summary['status'], 'Processing')
+        self.assertFalse(EmotionalResponse.objects.filter(news_item=self.news_item).exists())
+        self.assertEqual(WorkerJob.objects.get(object_id=self.aggregate_emotion.id).status, job_queue.PENDING)
+
+        mock_response.reset_mock()
+        self._run_task(mock_response, concurrency=1)
+        self.assertEqual(mock_response.call_count, 10)
+        self.assertEqual(self.aggregate_emotion.summary['total_responses'], 10)
+
+@override_settings(CLAUDE_API_KEY='test-key', OPENAI_API_KEY='test-key', LLM_HTTP_POOL_SIZE=4)
+class LLMClientRegistryTestCase(SimpleTestCase):
+    """
+    Unit tests for the shared LLM client registry.
+    """
+    def tearDown(self):
+        reset_clients()
+
+    def test_clients_are_reused_per_provider_and_model(self):
+        """
+        Repeated lookups return the same client; different models get their own
+        """
+        first = get_client('anthropic', 'claude-a')
+
+        self.assertIs(get_client('anthropic', 'claude-a'), first)
+        self.assertIsNot(get_client('anthropic', 'claude-b'), first)
+        self.assertIsNot(get_client('openai', 'claude-a'), first)
+
+    def test_unknown_provider_is_rejected(self):
+        """
+        Unsupported providers raise a ValueError like the callers' dispatch code
+        """
+        with self.assertRaises(ValueError):
+            get_client('unknown', 'model')
+
+
+@override_settings(LLM_RESPONSE_CACHE={'ENABLED': True})
+class LLMResponseCacheTestCase(TestCase):
+    """
+    Unit tests for the content-addressed LLM response cache.
+    """
+    def setUp(self):
+        response_cache.clear_memory()
+        self.calls = []
+
+        @cached_llm_response('anthropic')
+        def ask_stub(prompt, model_name, tools=None, max_tokens=1000):
+            self.calls.append(prompt)
+            if prompt == 'fail':
+                raise LLMProviderError('overloaded')
+            return {'answer': prompt.upper()}
+
+        self.ask_stub = ask_stub
+
+    def tearDown(self):
+        response_cache.clear_memory()
+
+    def test_repeated_prompts_are_served_from_cache(self):
+        """
+        The second identical request does not reach the provider, even after a restart
+        """
+        self.assertEqual(self.ask_stub('hello', 'claude'), {'answer': 'HELLO'})
+        self.assertEqual(self.ask_stub('hello', 'claude'), {'answer': 'HELLO'})
+
+        # Simulate a new worker process: only the database tier remains
+        response_cache.clear_memory()
+        self.assertEqual(self.ask_stub('hello', 'claude'), {'answer': 'HELLO'})
+
+        self.assertEqual(self.calls, ['hello'])
+        self.assertEqual(get_cache_stats()['db_hits'], 1)
+        self.assertEqual(LLMResponseCache.objects.get().hit_count, 1)
+
+    def test_key_covers_model_and_max_tokens(self):
+        """
+        Changing the model or max_tokens is a different request
+        """
+        self.ask_stub('hello', 'claude')
+        self.ask_stub('hello', 'claude-2')
+        self.ask_stub('hello', 'claude', max_tokens=50)
+
+        self.assertEqual(len(self.calls), 3)
+
+    def test_cache_is_off_by_default(self):
+        """
+        Without an explicit opt-in every run samples the model again and nothing is stored
+        """
+        with self.settings(LLM_RESPONSE_CACHE={}):
+            self.ask_stub('hello', 'claude')
+            self.ask_stub('hello', 'claude')
+
+        self.assertEqual(self.calls, ['hello', 'hello'])
+        self.assertFalse(LLMResponseCache.objects.exists())
+
+    def test_errors_are_not_cached(self):
+        """
+        Failed calls raise and are never stored
+        """
+        for _ in range(2):
+            with self.assertRaises(LLMProviderError):
+                self.ask_stub('fail', 'claude')
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertFalse(LLMResponseCache.objects.exists())
+
+    def test_expired_entries_are_refetched(self):
+        """
+        Entries older than the TTL count as misses
+        """
+        with self.settings(LLM_RESPONSE_CACHE={'ENABLED': True, 'TTL_SECONDS': 0}):
+            self.ask_stub('hello', 'claude')
+            self.ask_stub('hello', 'claude')
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_eviction_keeps_most_recently_used_entries(self):
+        """
+        The table is trimmed to MAX_ENTRIES, dropping the least recently used rows
+        """
+        with self.settings(LLM_RESPONSE_CACHE={'ENABLED': True, 'MAX_ENTRIES': 2}):
+            self.ask_stub('a', 'claude')
+            self.ask_stub('b', 'claude')
+            self.ask_stub('c', 'claude')
+            response_cache.clear_memory()
+            self.ask_stub('a', 'claude')
+
+            response_cache.evict()
+
+        self.assertEqual(LLMResponseCache.objects.count(), 2)
+        response_cache.clear_memory()
+        self.ask_stub('b', 'claude')
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+
+
+@override_settings(LLM_RESPONSE_CACHE={'ENABLED': False})
+class PromptCachingTestCase(SimpleTestCase):
+    """
+    Unit tests for provider prompt-prefix caching and token usage metering.
+    """
+    def test_render_segments_splits_at_first_dynamic_field(self):
+        """
+        Everything before the first dynamic placeholder goes to the prefix
+        """
+        prompt = render_segments(
+            'News: {news_title}\n{persona_details}\nAnswer for {news_title}',
+            ('persona_details',),
+            news_title='Flood', persona_details='Age 30',
+        )
+
+        self.assertEqual(prompt.prefix, 'News: Flood\n')
+        self.assertEqual(prompt.suffix, 'Age 30\nAnswer for Flood')
+        self.assertEqual(str(prompt), 'News: Flood\nAge 30\nAnswer for Flood')
+
+    @patch('simulator.utils.ask_claude_tools.get_client')
+    def test_claude_tools_marks_prefix_and_records_usage(self, mock_get_client):
+        """
+        The shared prefix carries a cache_control marker and cache reads reach the meter
+        """
+        message = mock_get_client.return_value.messages.create.return_value
+        message.content = [type('Block', (), {'type': 'tool_use', 'input': {'ok': True}})()]
+        message.usage = type('Usage', (), {
+            'input_tokens': 20, 'output_tokens': 8,
+            'cache_read_input_tokens': 180, 'cache_creation_input_tokens': 0,
+        })()
+
+        with metered() as meter:
+            result = ask_claude_tools(render_segments('{a}{b}', ('b',), a='shared', b='own'), 'claude')
+
+        self.assertEqual(result, {'ok': True})
+        content = mock_get_client.return_value.messages.create.call_args.kwargs['messages'][0]['content']
+        self.assertEqual(content[0], {'type': 'text', 'text': 'shared', 'cache_control': {'type': 'ephemeral'}})
+        self.assertEqual(content[1], {'type': 'text', 'text': 'own'})
+        self.assertEqual(meter.snapshot()['cache_read_input_tokens'], 180)
+        self.assertEqual(meter.snapshot()['cache_read_ratio'], 0.9)
+
+
+class ProviderLimiterTestCase(SimpleTestCase):
+    """
+    Unit tests for the adaptive per-provider rate limiter.
+    """
+    def tearDown(self):
+        reset_limiters()
+
+    def test_concurrency_halves_on_overload_and_ramps_up_on_success(self):
+        """
+        The limit follows AIMD: halved on a 429, +1 after a window of successes
+        """
+        now = [0.0]
+        limiter = AdaptiveConcurrencyLimiter(8, initial_limit=8, clock=lambda: now[0])
+
+        limiter.acquire()
+        self.assertTrue(limiter.release(overloaded=True))
+        # A second 429 from the same burst does not halve the limit again
+        limiter.acquire()
+        self.assertFalse(limiter.release(overloaded=True))
+        self.assertEqual(limiter.limit, 4)
+
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(success=True)
+        self.assertEqual(int(limiter.limit), 5)
+
+    def test_token_bucket_reports_wait_once_exhausted(self):
+        """
+        Reservations beyond the per-minute budget wait for the bucket to refill
+        """
+        now = [0.0]
+        bucket = TokenBucket(60, clock=lambda: now[0])
+
+        self.assertEqual(bucket.reserve(60), 0.0)
+        self.assertAlmostEqual(bucket.reserve(30), 30.0)
+        now[0] = 30.0
+        self.assertEqual(bucket.reserve(0), 0.0)
+
+    @override_settings(LLM_PROVIDER_CONCURRENCY={'anthropic': 8})
+    def test_provider_slot_backs_off_on_rate_limit_errors(self):
+        """
+        A 429 raised inside the slot lowers the provider's limit and is re-raised
+        """
+        class RateLimitError(Exception):
+            status_code = 429
+
+        reset_limiters()
+        with provider_slot('anthropic'):
+            pass
+        with self.assertRaises(RateLimitError):
+            with provider_slot('anthropic'):
+                raise RateLimitError('slow down')
+
+        stats = get_limiter('anthropic').snapshot()
+        self.assertEqual(stats['overloads'], 1)
+        self.assertEqual(stats['concurrency_limit'], 2)
+        self.assertEqual(stats['in_flight'], 0)
+
+    @override_settings(LLM_PROVIDER_RATE_LIMITS={'anthropic': {'REQUESTS_PER_MINUTE': 1}})
+    def test_acquire_gives_up_at_the_deadline(self):
+        """
+        A call that could only start after its deadline fails without holding a slot or tokens
+        """
+        reset_limiters()
+        limiter = get_limiter('anthropic')
+        limiter.acquire()
+        limiter.release()
+
+        with self.assertRaises(ProviderWaitTimeout):
+            limiter.acquire(deadline=time.monotonic() + 1)
+        self.assertEqual(limiter.snapshot()['in_flight'], 0)
+        self.assertEqual(limiter.snapshot()['timeouts'], 1)
+        # The reserved request was given back
+        self.assertEqual(limiter.request_bucket.reserve(0), 0.0)
+
+
+class ProviderError(Exception):
+    """Stand-in for an SDK exception carrying an HTTP status."""
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+@override_settings(LLM_RESILIENCE={
+    'MAX_ATTEMPTS': 3, 'BREAKER_FAILURE_THRESHOLD': 2, 'BREAKER_RESET_SECONDS': 60
+})
+@patch('simulator.utils.llm_resilience.time.sleep')
+class LLMResilienceTestCase(TestCase):
+    """
+    Unit tests for retries, timeouts and circuit breaking around the ask_* helpers.
+    """
+    def setUp(self):
+        reset_breakers()
+        self.outcomes = []
+        self.timeouts = []
+
+        @resilient_llm_call('anthropic')
+        def ask_stub(prompt, model_name, timeout=None):
+            self.timeouts.append(timeout)
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.ask_stub = ask_stub
+
+    def tearDown(self):
+        reset_breakers()
+
+    def test_retryable_errors_are_retried_with_a_timeout(self, mock_sleep):
+        """
+        429s and 5xx are retried with backoff; every attempt gets a timeout
+        """
+        self.outcomes = [ProviderError(429), ProviderError(500), 'ok']
+
+        self.assertEqual(self.ask_stub('hello', 'claude'), 'ok')
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertTrue(all(timeout for timeout in self.timeouts))
+
+    def test_failures_are_raised_as_typed_errors(self, mock_sleep):
+        """
+        Non-retryable errors fail at once; exhausted retries raise the last typed error
+        """
+        self.outcomes = [ProviderError(400)]
+        with self.assertRaises(LLMRequestError):
+            self.ask_stub('hello', 'claude')
+        self.assertEqual(mock_sleep.call_count, 0)
+
+        self.outcomes = [ProviderError(429)] * 3
+        with self.assertRaises(LLMRateLimitError):
+            self.ask_stub('hello', 'claude')
+
+        # Timeouts count against the circuit, so use a model whose breaker is still closed
+        self.outcomes = [TimeoutError('read timed out')]
+        with self.assertRaises(LLMTimeoutError), self.settings(LLM_RESILIENCE={'MAX_ATTEMPTS': 1}):
+            self.ask_stub('hello', 'claude-2')
+
+    def test_circuit_opens_after_consecutive_provider_failures(self, mock_sleep):
+        """
+        Once open, the breaker fails fast without calling the provider
+        """
+        self.outcomes = [ProviderError(503), ProviderError(503)]
+        with self.assertRaises(CircuitOpenError):
+            self.ask_stub('hello', 'claude')
+
+        self.outcomes = ['ok']
+        with self.assertRaises(CircuitOpenError):
+            self.ask_stub('hello', 'claude')
+        self.assertEqual(self.outcomes, ['ok'])
+
+        # Other models are unaffected
+        self.assertEqual(self.ask_stub('hello', 'claude-2'), 'ok')
+
+    @override_settings(LLM_RESILIENCE={'DEADLINE': 0.1}, LLM_PROVIDER_CONCURRENCY={'anthropic': 1})
+    def test_limiter_wait_is_bounded_by_the_deadline(self, mock_sleep):
+        """
+        A call still waiting for a limiter slot at the deadline times out without
+        counting against the circuit
+        """
+        @resilient_llm_call('anthropic')
+        def ask_limited(prompt, model_name, timeout=None):
+            with provider_slot('anthropic'):
+                return 'ok'
+
+        reset_limiters()
+        limiter = get_limiter('anthropic')
+        limiter.acquire()
+        try:
+            with self.assertRaises(LLMTimeoutError):
+                ask_limited('hello', 'claude')
+        finally:
+            limiter.release()
+            reset_limiters()
+
+        self.assertEqual(get_breaker('anthropic', 'claude').failures, 0)
+
+    @patch('simulator.management.commands.generate_personas.ask_llm')
+    def test_personality_description_failures_are_not_hidden(self, mock_ask_llm, mock_sleep):
+        """
+        A failed description raises instead of returning a placeholder text
+        """
+        LLMModelAndKey.objects.create(model_name='claude-test', provider_name='anthropic', active=True)
+        PromptModel.objects.create(
+            task_name='personality_description',
+            prompt_template='{name} from {city}: {context} ({version})',
+            version='Concise'
+        )
+        command = PersonaGenerationCommand()
+
+        mock_ask_llm.side_effect = LLMProviderError('overloaded')
+        with self.assertRaises(LLMProviderError):
+            command.generate_personality_description('Ann', 'EngineCity', 'Age Group: Senior')
+
+        mock_ask_llm.side_effect = None
+        mock_ask_llm.return_value = ' Calm and curious. '
+        self.assertEqual(
+            command.generate_personality_description('Ann', 'EngineCity', 'Age Group: Senior'),
+            'Calm and curious.'
+        )
+
+
+@override_settings(LLM_HEDGING={'ENABLED': True, 'MIN_SAMPLES': 5, 'MIN_DELAY_SECONDS': 0.01, 'MAX_HEDGE_RATE': 0.5})
+class LLMHedgingTestCase(SimpleTestCase):
+    """
+    Unit tests for hedged LLM requests.
+    """
+    def setUp(self):
+        reset_hedging()
+        self.primary = SimpleNamespace(provider_name='anthropic', model_name='claude-primary')
+        self.secondary = SimpleNamespace(provider_name='anthropic', model_name='claude-secondary')
+        self.release = threading.Event()
+        tracker = get_tracker(('anthropic', 'claude-primary'))
+        for _ in range(5):
+            tracker.record(0.01)
+
+    def tearDown(self):
+        self.release.set()
+        reset_hedging()
+
+    def call(self, model):
+        """The primary hangs until released; the secondary answers at once"""
+        if model is self.primary:
+            self.release.wait(5)
+        return model.model_name
+
+    def test_slow_call_is_hedged_and_first_answer_wins(self):
+        """
+        A call slower than the latency percentile is duplicated to the secondary model
+        """
+        self.assertEqual(hedged_call(self.primary, self.secondary, self.call), 'claude-secondary')
+
+        stats = get_hedging_stats()['anthropic/claude-primary']
+        self.assertEqual((stats['calls'], stats['hedged'], stats['hedge_wins']), (1, 1, 1))
+
+    def test_fast_calls_are_not_hedged(self):
+        """
+        Calls finishing before the hedge delay return the primary's answer only
+        """
+        self.release.set()
+
+        self.assertEqual(hedged_call(self.primary, self.secondary, self.call), 'claude-primary')
+        self.assertEqual(get_hedging_stats()['anthropic/claude-primary']['hedged'], 0)
+
+    def test_hedge_rate_is_capped(self):
+        """
+        No hedges are sent once MAX_HEDGE_RATE of calls were hedged
+        """
+        hedged_call(self.primary, self.secondary, self.call)
+        self.release.set()
+
+        with self.settings(LLM_HEDGING={'ENABLED': True, 'MIN_SAMPLES': 5, 'MAX_HEDGE_RATE': 0.5}):
+            self.assertEqual(hedged_call(self.primary, self.secondary, self.call), 'claude-primary')
+        self.assertEqual(get_hedging_stats()['anthropic/claude-primary']['hedged'], 1)
+
+
+@override_settings(LLM_FAKE_PROVIDER={'LATENCY_MEDIAN': 0, 'SEED': 1})
+class FakeProviderTestCase(SimpleTestCase):
+    """
+    Unit tests for the offline fake LLM provider.
+    """
+    TOOL = {
+        'name': 'generate_user_response',
+        'input_schema': {
+            'type': 'object',
+            'properties': {
+                'selected_response_number': {'type': 'integer'},
+                'intensity': {'type': 'number'},
+                'explanation': {'type': 'string'},
+            },
+        },
+    }
+
+    def setUp(self):
+        reset_fake_provider()
+        reset_breakers()
+        reset_limiters()
+
+    def test_answers_are_deterministic_and_schema_valid(self):
+        """
+        The same prompt always gets the same answer, picked from the listed responses
+        """
+        prompt = 'Responses:\nid = 7: Support\nid = 9: Oppose\nPersona: Ann'
+
+        first = ask_fake(prompt, 'fake-model', [self.TOOL])
+
+        self.assertEqual(first, ask_fake(prompt, 'fake-model', [self.TOOL]))
+        self.assertIn(first['selected_response_number'], (7, 9))
+        self.assertTrue(0 <= first['intensity'] <= 1)
+        self.assertTrue(first['explanation'])
+        self.assertEqual(ask_fake('Describe Ann', 'fake-model'), fake_text('Describe Ann'))
+
+    @patch('simulator.utils.llm_resilience.time.sleep')
+    def test_injected_rate_limits_go_through_retries(self, mock_sleep):
+        """
+        Injected 429s are retried and finally raised as LLMRateLimitError
+        """
+        with self.settings(LLM_FAKE_PROVIDER={'LATENCY_MEDIAN': 0, 'RATE_LIMIT_RATE': 1.0},
+                           LLM_RESILIENCE={'MAX_ATTEMPTS': 2}):
+            with self.assertRaises(LLMRateLimitError):
+                ask_fake('hello', 'fake-model')
+
+        self.assertEqual(get_limiter('fake').snapshot()['overloads'], 2)
+
+
+class JobQueueTestCase(TestCase):
+    """
+    Unit tests for lease-based job claiming.
+    """
+    def _expire(self, job):
+        WorkerJob.objects.filter(id=job.id).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_claims_are_exclusive_until_the_lease_expires(self):
+        """
+        A running job is not claimed again until its lease expires; the old owner then loses it
+        """
+        job_queue.enqueue(job_queue.AGGREGATION_JOB, 1)
+
+        first = job_queue.claim(job_queue.AGGREGATION_JOB, owner='worker-a')
+        self.assertEqual(first.lease_owner, 'worker-a')
+        self.assertIsNone(job_queue.claim(job_queue.AGGREGATION_JOB, owner='worker-b'))
+        self.assertTrue(job_queue.heartbeat(first))
+
+        self._expire(first)
+        second = job_queue.claim(job_queue.AGGREGATION_JOB, owner='worker-b')
+
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(second.attempts, 2)
+        self.assertFalse(job_queue.heartbeat(first))
+        self.assertFalse(job_queue.complete(first))
+        self.assertTrue(job_queue.complete(second))
+        self.assertEqual(WorkerJob.objects.get(id=first.id).status, job_queue.COMPLETED)
+
+    def test_process_next_job_outcomes(self):
+        """
+        Handlers complete, requeue or fail their job; exceptions fail it with the error
+        """
+        for object_id in (1, 2, 3):
+            job_queue.enqueue(job_queue.PERSONA_GENERATION_JOB, object_id)
+
+        def handler(job, lost):
+            if job.object_id == 3:
+                raise ValueError('boom')
+            return job_queue.COMPLETED if job.object_id == 1 else job_queue.PENDING
+
+        for _ in range(3):
+            job_queue.process_next_job(job_queue.PERSONA_GENERATION_JOB, handler, requeue_delay=60)
+
+        jobs = {job.object_id: job for job in WorkerJob.objects.all()}
+        self.assertEqual(jobs[1].status, job_queue.COMPLETED)
+        self.assertEqual(jobs[2].status, job_queue.PENDING)
+        self.assertEqual(jobs[2].attempts, 0)
+        self.assertGreater(jobs[2].available_at, timezone.now())
+        self.assertEqual((jobs[3].status, jobs[3].last_error), (job_queue.FAILED, 'boom'))
+        # Job 2 waits for its delay
+        self.assertIsNone(job_queue.process_next_job(job_queue.PERSONA_GENERATION_JOB, handler))
+
+    def test_failed_and_lost_jobs(self):
+        """
+        A handler error is reported to on_error; a handler that lost its lease stops
+        without failing the job it no longer owns
+        """
+        for object_id in (1, 2):
+            job_queue.enqueue(job_queue.AGGREGATION_JOB, object_id)
+        errors = []
+
+        def handler(job, lost):
+            if job.object_id == 1:
+                raise ValueError('boom')
+            # Another worker claims the job while this one runs
+            lost.set()
+            job_queue.check_lease(lost)
+
+        for _ in range(2):
+            job_queue.process_next_job(
+                job_queue.AGGREGATION_JOB, handler,
+                on_error=lambda job, error: errors.append((job.object_id, str(error)))
+            )
+
+        self.assertEqual(errors, [(1, 'boom')])
+        jobs = {job.object_id: job for job in WorkerJob.objects.all()}
+        self.assertEqual(jobs[1].status, job_queue.FAILED)
+        self.assertEqual(jobs[2].status, job_queue.RUNNING)
+
+    def test_jobs_abandoned_too_often_are_given_up(self):
+        """
+        A job whose lease expired JOB_MAX_ATTEMPTS times is failed instead of run again
+        """
+        job = job_queue.enqueue(job_queue.AGGREGATION_JOB, 5)
+        WorkerJob.objects.filter(id=job.id).update(status=job_queue.RUNNING, attempts=3)
+        self._expire(job)
+        handler = MagicMock()
+        given_up = []
+
+        with self.settings(JOB_MAX_ATTEMPTS=3):
+            job_queue.process_next_job(job_queue.AGGREGATION_JOB, handler, on_give_up=given_up.append)
+
+        handler.assert_not_called()
+        self.assertEqual([job.object_id for job in given_up], [5])
+        self.assertEqual(WorkerJob.objects.get(id=job.id).status, job_queue.FAILED)
+
+    def test_enqueue_wakes_an_idle_worker(self):
+        """
+        A worker waiting for jobs returns as soon as one is queued, not after its timeout
+        """
+        wait_for_jobs(job_queue.AGGREGATION_JOB, 0)
+        woken = []
+        waiter = threading.Thread(
+            target=lambda: woken.append(wait_for_jobs(job_queue.AGGREGATION_JOB, 30))
+        )
+        waiter.start()
+
+        job_queue.enqueue(job_queue.AGGREGATION_JOB, 9)
+        waiter.join(5)
+
+        self.assertEqual(woken, [True])
+        self.assertFalse(wait_for_jobs(job_queue.AGGREGATION_JOB, 0.01))
+
+    @override_settings(JOB_POLL_SECONDS=0.05)
+    def test_idle_wait_is_short_without_listen_notify(self):
+        """
+        Without LISTEN/NOTIFY (SQLite) a worker in another process is never signalled,
+        so the idle wait falls back to polling every JOB_POLL_SECONDS
+        """
+        wait_for_jobs(job_queue.AGGREGATION_JOB, 0)
+        started = time.monotonic()
+
+        self.assertFalse(wait_for_jobs(job_queue.AGGREGATION_JOB, 60))
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class PersonaPipelineTestCase(TestCase):
+    """
+    Unit tests for the bulk persona generation pipeline.
+    """
+    def setUp(self):
+        """
+        Set up a city with two demographic categories
+        """
+        self.city_name = 'BulkCity'
+        self.subcategories = {}
+        for category_name, shares in (('Age Group', {'Young': 60, 'Senior': 40}),
+                                      ('Income', {'Low': 50, 'High': 50})):
+            category = Category.objects.create(name=category_name, city=self.city_name)
+            for name, percentage in shares.items():
+                self.subcategories[name] = SubCategory.objects.create(
+                    name=name, category=category, city=self.city_name, percentage=percentage
+                )
+        self.command = PersonaGenerationCommand(stdout=StringIO())
+
+    @override_settings(PERSONA_BULK_BATCH_SIZE=4)
+    @patch.object(PersonaGenerationCommand, 'generate_personality_description')
+    def test_personas_are_created_first_and_described_later(self, mock_description):
+        """
+        Stage one creates the personas and mappings in bulk without LLM calls; stage two
+        fills in the descriptions and tracks its progress on the task
+        """
+        task = PersonaGenerationTask.objects.create(city_name=self.city_name, population=10)
+
+        self.command.generate_personas_for_demographics(task)
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.description_status), ('completed', 'pending'))
+        self.assertTrue(WorkerJob.objects.filter(kind=job_queue.PERSONA_DESCRIPTION_JOB, object_id=task.id).exists())
+        personas = Persona.objects.filter(city=self.city_name)
+        self.assertEqual(personas.filter(description_pending=True).count(), 10)
+        self.assertEqual(PersonaSubCategoryMapping.objects.filter(persona__city=self.city_name).count(), 20)
+        self.assertEqual(
+            PersonaSubCategoryMapping.objects.filter(subcategory=self.subcategories['Young']).count(), 6
+        )
+        mock_description.assert_not_called()
+
+        failing = personas.order_by('id')[3]
+
+        def describe(name, city, context):
+            if name == failing.name:
+                raise LLMProviderError('overloaded')
+            return f'Described with {context}'
+
+        mock_description.side_effect = describe
+        self.command.fill_pending_descriptions(task)
+
+        # The failed description stays pending and the stage is requeued
+        task.refresh_from_db()
+        self.assertEqual(task.description_status, 'pending')
+        self.assertEqual(
+            self.command.run_description_job(SimpleNamespace(object_id=task.id), None), job_queue.PENDING
+        )
+        with self.settings(PERSONA_DESCRIPTION_MAX_RUNS=3):
+            self.command.fill_pending_descriptions(task)
+        task.refresh_from_db()
+        self.assertEqual((task.description_status, task.description_runs), ('failed', 3))
+        self.assertEqual((task.descriptions_total, task.descriptions_completed, task.descriptions_failed), (10, 9, 1))
+        self.assertEqual(list(personas.filter(description_pending=True)), [failing])
+        self.assertIn('Age Group: ', personas.exclude(id=failing.id).first().personality_description)
+
+        mock_description.side_effect = None
+        mock_description.return_value = 'Calm and curious.'
+        self.command.fill_pending_descriptions(task)
+
+        task.refresh_from_db()
+        self.assertEqual(task.description_status, 'completed')
+        self.assertEqual((task.descriptions_total, task.descriptions_completed), (10, 10))
+        self.assertFalse(personas.filter(description_pending=True).exists())
+
+    @override_settings(PERSONA_BULK_BATCH_SIZE=4)
+    def test_reclaimed_generation_creates_only_the_missing_personas(self):
+        """
+        A generation interrupted after its first batch, then claimed again, ends with
+        exactly the requested population and apportionment
+        """
+        task = PersonaGenerationTask.objects.create(city_name=self.city_name, population=10)
+        # The lease is lost after the first batch
+        lost = MagicMock(is_set=MagicMock(side_effect=[False, True]))
+        with self.assertRaises(job_queue.LeaseLost):
+            self.command.generate_personas_for_demographics(task, lost)
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.personas_created), ('in_progress', 4))
+
+        self.command.generate_personas_for_demographics(task)
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.personas_created), ('completed', 10))
+        self.assertEqual(Persona.objects.filter(city=self.city_name).count(), 10)
+        self.assertEqual(
+            PersonaSubCategoryMapping.objects.filter(subcategory=self.subcategories['Young']).count(), 6
+        )
+
+    def test_population_is_apportioned_exactly(self):
+        """
+        Every category's subcategories get their largest-remainder share of the exact
+        population, without enumerating the combination space
+        """
+        task = PersonaGenerationTask.objects.create(city_name=self.city_name, population=7)
+        self.command.generate_personas_for_demographics(task)
+
+        self.assertEqual(Persona.objects.filter(city=self.city_name).count(), 7)
+        counts = {
+            name: PersonaSubCategoryMapping.objects.filter(subcategory=subcategory).count()
+            for name, subcategory in self.subcategories.items()
+        }
+        self.assertEqual(counts, {'Young': 4, 'Senior': 3, 'Low': 4, 'High': 3})
+
+        self.assertEqual(largest_remainder([1, 1, 1], 10).tolist(), [4, 3, 3])
+        weights = [[10] * 10] * 8
+        combinations = list(iter_apportioned_combinations(weights, 1001, seed=1))
+        self.assertEqual(len(combinations), 1001)
+        self.assertEqual(
+            np.bincount([codes[3] for codes in combinations]).tolist(), [101] + [100] * 9
+        )
+
+    @override_settings(CSV_CHUNK_ROWS=2)
+    @patch.object(PersonaGenerationCommand, 'generate_personality_description', return_value='Calm.')
+    def test_csv_values_do_not_depend_on_chunks(self, mock_description):
+        """
+        A blank cell in a later chunk doesn't turn that chunk's numbers into floats, so
+        each value maps to a single subcategory; the raw rows keep numbers as numbers
+        """
+        rows = 'Name,Age,Score\nAda,35,1.5\nBob,40,n/a\nCid,,2\nDee,35,007\n'
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            task = PersonaGenerationTask.objects.create(
+                city_name='CsvCity', csv_file=SimpleUploadedFile('ages.csv', rows.encode())
+            )
+            self.command.process_csv_for_task(task)
+
+        self.assertEqual(
+            sorted(SubCategory.objects.filter(city='CsvCity', category__name='Age').values_list('name', flat=True)),
+            ['35', '40']
+        )
+        self.assertEqual(
+            PersonaSubCategoryMapping.objects.filter(persona__city='CsvCity', subcategory__name='35').count(), 2
+        )
+        self.assertEqual(
+            [raw.row_data for raw in RawPersonaModel.objects.filter(city='CsvCity').order_by('persona__name')],
+            [
+                {'Name': 'Ada', 'Age': 35, 'Score': 1.5},
+                {'Name': 'Bob', 'Age': 40, 'Score': 'n/a'},
+                {'Name': 'Cid', 'Age': None, 'Score': 2},
+                {'Name': 'Dee', 'Age': 35, 'Score': 7},
+            ]
+        )
+
+    @override_settings(CSV_CHUNK_ROWS=2)
+    @patch.object(PersonaGenerationCommand, 'generate_personality_description')
+    def test_csv_is_imported_in_chunks(self, mock_description):
+        """
+        CSV uploads are streamed and bulk-inserted chunk by chunk; the task counts the
+        rows processed and a resumed task skips those already imported
+        """
+        def describe(name, city, context):
+            if name == 'Eve':
+                raise LLMProviderError('overloaded')
+            return f'Described with {context}'
+
+        mock_description.side_effect = describe
+        rows = 'Name,Age Group,Income\nAda,Young,Low\nBob,Senior,\nCid,Young,High\nDee,Senior,Low\nEve,Young,Low\n'
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            task = PersonaGenerationTask.objects.create(
+                city_name='CsvCity', csv_file=SimpleUploadedFile('people.csv', rows.encode())
+            )
+            self.command.process_csv_for_task(task)
+
+            task.refresh_from_db()
+            self.assertEqual(task.status, 'completed')
+            self.assertEqual((task.rows_processed, task.rows_failed), (5, 1))
+            personas = Persona.objects.filter(city='CsvCity')
+            self.assertEqual(sorted(personas.values_list('name', flat=True)), ['Ada', 'Bob', 'Cid', 'Dee', 'Eve'])
+            self.assertEqual(PersonaSubCategoryMapping.objects.filter(persona__city='CsvCity').count(), 9)
+            self.assertEqual(RawPersonaModel.objects.filter(city='CsvCity').count(), 5)
+            # The row whose description failed is kept for the description stage
+            self.assertEqual(list(personas.filter(description_pending=True).values_list('name', flat=True)), ['Eve'])
+            self.assertEqual(task.description_status, 'pending')
+            self.assertTrue(
+                WorkerJob.objects.filter(kind=job_queue.PERSONA_DESCRIPTION_JOB, object_id=task.id).exists()
+            )
+            self.assertEqual(
+                personas.get(name='Bob').personality_description, 'Described with Age Group: Senior'
+            )
+            # Percentages are recomputed once, from the imported mappings
+            self.assertEqual(
+                {subcategory.name: float(subcategory.percentage) for subcategory in SubCategory.objects.filter(city='CsvCity')},
+                {'Young': 60.0, 'Senior': 40.0, 'Low': 75.0, 'High': 25.0}
+            )
+
+            # A task whose worker died after importing the first chunk resumes after it
+            resumed = PersonaGenerationTask.objects.create(
+                city_name='ResumedCity', status='in_progress', rows_processed=2,
+                csv_file=SimpleUploadedFile('people.csv', rows.encode())
+            )
+            self.command.process_csv_for_task(resumed)
+
+            resumed.refresh_from_db()
+            self.assertEqual((resumed.status, resumed.rows_processed), ('completed', 5))
+            self.assertEqual(
+                sorted(Persona.objects.filter(city='ResumedCity').values_list('name', flat=True)),
+                ['Cid', 'Dee', 'Eve']
+            )
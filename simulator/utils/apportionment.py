@@ -0,0 +1,73 @@
+"""
+Apportionment of a population over demographic subcategories.
+
+Demographics-based generation needs one subcategory per category for each persona, with
+every category's subcategories represented according to their percentages. Enumerating
+the Cartesian product of all categories (10^8 combinations for 8 categories of 10) and
+rounding a weight per combination neither scales nor hits the population exactly.
+Instead:
+
+- `largest_remainder` apportions the population over each category's subcategories
+  exactly: everyone gets the floor of their quota, the remaining seats go to the
+  largest fractional parts;
+- `iter_apportioned_combinations` lays out one column of subcategory codes per category
+  with those counts and shuffles every column independently, so the rows (personas)
+  combine the categories independently, as the product of the percentages assumed.
+
+Every category's counts are exact and the total is exactly the population; memory grows
+with the population times the number of categories, not with the combination space.
+"""
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def largest_remainder(weights, total):
+    """
+    Apportions `total` seats proportionally to `weights` (Hamilton's method).
+
+    Returns:
+        numpy.ndarray: Integer counts summing to total; all-zero weights share the seats evenly
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.size == 0:
+        raise ValueError("Cannot apportion over no subcategories")
+    if (weights < 0).any():
+        raise ValueError("Weights must not be negative")
+    if weights.sum() <= 0:
+        weights = np.ones_like(weights)
+
+    quotas = weights / weights.sum() * total
+    counts = np.floor(quotas).astype(np.int64)
+    remaining = int(total - counts.sum())
+    # Stable sort: equal remainders go to the first subcategories
+    counts[np.argsort(-(quotas - counts), kind='stable')[:remaining]] += 1
+    return counts
+
+
+def iter_apportioned_combinations(category_weights, population, seed=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields one subcategory code per category for each of `population` personas.
+
+    Args:
+        category_weights: For each category, the weights (percentages) of its subcategories
+        population: Number of combinations to yield
+        seed: Seed of the shuffles
+
+    Yields:
+        tuple: The code (index into the category's weights) of each category
+    """
+    rng = np.random.default_rng(seed)
+    columns = []
+    for weights in category_weights:
+        column = np.repeat(
+            np.arange(len(weights), dtype=np.int32), largest_remainder(weights, population)
+        )
+        rng.shuffle(column)
+        columns.append(column)
+    if not columns:
+        return
+
+    rows = np.stack(columns, axis=1)
+    for start in range(0, population, chunk_size):
+        yield from map(tuple, rows[start:start + chunk_size].tolist())
@@ -0,0 +1,117 @@
+"""
+Archetype deduplication for aggregations.
+
+Personas generated from demographics are copies of a subcategory combination, so many
+of them share the exact same demographic tuple. In 'archetype' mode the aggregation
+worker groups personas into archetypes and evaluates only a few members of each:
+
+- `group_archetypes` keys each persona by its sorted subcategory codes (read from the
+  city's DemographicIndex) and, with DESCRIPTION_BITS > 0, by the leading bits of a
+  SimHash of its personality description, so members with dissimilar descriptions
+  fall into different archetypes;
+- the first SAMPLES members of each archetype (in id order, answered ones first) are
+  evaluated by the LLM;
+- `fill_archetype` gives every other member one of the sampled answers, round-robin,
+  so each archetype contributes to the summaries in proportion to its size and its
+  sampled answer distribution.
+
+Filled members get regular EmotionalResponse rows, so the summaries and resumption
+work as for a full run. Their explanation is not the sampled member's (first-person)
+one but INFERRED_EXPLANATION and the member's id, so they are never shown as the
+persona's own reasoning nor used as samples or training labels. Settings come from the
+AGGREGATION_ARCHETYPES dict, merged over DEFAULT_ARCHETYPE_SETTINGS.
+"""
+import hashlib
+import re
+import numpy as np
+from django.conf import settings
+
+DEFAULT_ARCHETYPE_SETTINGS = {
+    # Members evaluated by the LLM per archetype
+    'SAMPLES': 1,
+    # Leading SimHash bits of the description added to the archetype key (0 disables)
+    'DESCRIPTION_BITS': 0,
+}
+
+INFERRED_EXPLANATION = "Inferred from archetype member"
+SIMHASH_BITS = 64
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def get_archetype_settings():
+    """Returns the archetype settings merged over the defaults."""
+    return {**DEFAULT_ARCHETYPE_SETTINGS, **getattr(settings, 'AGGREGATION_ARCHETYPES', {})}
+
+
+def description_signature(description, bits):
+    """
+    Returns the leading `bits` bits of the SimHash of a description's words; similar
+    descriptions are likely to share them.
+    """
+    tokens = TOKEN_PATTERN.findall((description or '').lower())
+    if not tokens or not bits:
+        return 0
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big') for token in tokens],
+        dtype=np.uint64
+    )
+    # Vote per bit position: +1 where a token's hash has the bit set, -1 otherwise
+    positions = np.arange(SIMHASH_BITS - 1, SIMHASH_BITS - 1 - bits, -1, dtype=np.uint64)
+    set_bits = (hashes[:, None] >> positions[None, :]) & np.uint64(1)
+    votes = (2 * set_bits.astype(np.int64) - 1).sum(axis=0)
+    return int(''.join('1' if vote > 0 else '0' for vote in votes), 2)
+
+
+def group_archetypes(personas, demographic_index, description_bits=0):
+    """
+    Groups personas by demographic tuple (and description signature).
+
+    Args:
+        personas: (persona id, personality description) pairs
+        demographic_index: DemographicIndex of their city
+
+    Returns:
+        list: The archetypes, each a list of persona ids in ascending order
+    """
+    personas = sorted(personas)
+    strata = demographic_index.subcategory_sets([persona_id for persona_id, _ in personas])
+    archetypes = {}
+    for (persona_id, description), stratum in zip(personas, strata):
+        key = (stratum, description_signature(description, description_bits))
+        archetypes.setdefault(key, []).append(persona_id)
+    return list(archetypes.values())
+
+
+def inferred_explanation(persona_id):
+    """Explanation of a row filled from the answer of archetype member `persona_id`."""
+    return f"{INFERRED_EXPLANATION} #{persona_id}"
+
+
+def fill_archetype(members, answers, answered_ids=()):
+    """
+    Assigns the sampled answers of an archetype to its unanswered members.
+
+    Args:
+        members: The archetype's persona ids
+        answers: {persona id: (user response id, intensity)} of the members the LLM
+            evaluated
+        answered_ids: Members that already have an answer otherwise, e.g. filled in
+            by an interrupted run
+
+    Returns:
+        list: (persona id, (user response id, intensity, explanation)) for every
+        unanswered member, the explanation naming the sampled member; empty when no
+        member was evaluated
+    """
+    samples = [
+        (*answers[persona_id], inferred_explanation(persona_id))
+        for persona_id in members if persona_id in answers
+    ]
+    if not samples:
+        return []
+    answered_ids = set(answered_ids)
+    unanswered = [
+        persona_id for persona_id in members
+        if persona_id not in answers and persona_id not in answered_ids
+    ]
+    return [(persona_id, samples[i % len(samples)]) for i, persona_id in enumerate(unanswered)]
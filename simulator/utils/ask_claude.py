@@ -1,36 +1,44 @@
-from anthropic import Anthropic
-from django.conf import settings
 from typing import Optional
+from simulator.utils.llm_cache import cached_llm_response
+from simulator.utils.llm_clients import get_client
+from simulator.utils.llm_errors import LLMResponseError
+from simulator.utils.llm_resilience import resilient_llm_call
+from simulator.utils.llm_usage import record_anthropic_usage
+from simulator.utils.prompt_segments import to_anthropic_content
+from simulator.utils.provider_limits import estimate_request_tokens, provider_slot
 
-def ask_claude(prompt: str,model_name: str, max_tokens: Optional[int] = 1000) -> str:
+@cached_llm_response('anthropic')
+@resilient_llm_call('anthropic')
+def ask_claude(prompt: str,model_name: str, max_tokens: Optional[int] = 1000, timeout: Optional[float] = None) -> str:
     """
     Calls the Claude API and returns the response.
+
+    Raises:
+        LLMError: If the call fails after retries, or the response has no text
     """
-    try:
-        client = Anthropic(api_key=settings.CLAUDE_API_KEY)
-        
+    client = get_client('anthropic', model_name)
+    
+    with provider_slot('anthropic', estimate_request_tokens(prompt, max_tokens)):
         message = client.messages.create(
             model=model_name,  # You can change this to your preferred Claude model
             max_tokens=max_tokens,
             messages=[
                 {
                     "role": "user",
-                    "content": prompt
+                    "content": to_anthropic_content(prompt)
                 }
-            ]
+            ],
+            timeout=timeout
         )
-        # Extract and return the response text
-        if message and hasattr(message, 'content'):
-            print(f'message: {message}')
-            # Get the first content block of type 'text'
-            for content in message.content:
-                if content.type == 'text':
-                    return content.text
-            
-            return "No text content found in response."
-            
-        else:
-            return "No response received."
-            
-    except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+    record_anthropic_usage(message)
+    # Extract and return the response text
+    if message and hasattr(message, 'content'):
+        print(f'message: {message}')
+        # Get the first content block of type 'text'
+        for content in message.content:
+            if content.type == 'text':
+                return content.text
+        
+        raise LLMResponseError("No text content found in response.", 'anthropic', model_name)
+        
+    raise LLMResponseError("No response received.", 'anthropic', model_name)
@@ -1,48 +1,53 @@
-from anthropic import Anthropic
-from django.conf import settings
 from typing import Optional
-import json
-import re
+from simulator.utils.llm_cache import cached_llm_response
+from simulator.utils.llm_clients import get_client
+from simulator.utils.llm_errors import LLMResponseError
+from simulator.utils.llm_resilience import resilient_llm_call
+from simulator.utils.llm_usage import record_anthropic_usage
+from simulator.utils.prompt_segments import to_anthropic_content
+from simulator.utils.provider_limits import estimate_request_tokens, provider_slot
 
-def ask_claude_tools(prompt: str, model_name: str, tools: Optional[list] = None, max_tokens: Optional[int] = 1000) -> str:
+@cached_llm_response('anthropic')
+@resilient_llm_call('anthropic')
+def ask_claude_tools(prompt: str, model_name: str, tools: Optional[list] = None, max_tokens: Optional[int] = 1000, timeout: Optional[float] = None) -> dict:
     """
     Calls the Claude API with tools for optimization tasks and returns the response.
     
     Args:
-        prompt: The text prompt to send to Claude
+        prompt: The text prompt to send to Claude, or PromptSegments whose shared
+            prefix is marked for Anthropic prompt caching
         model_name: The Claude model to use
         max_tokens: Maximum number of tokens in the response
         tools: List of tools to use
+        timeout: Seconds to wait for the response (set by the resilience layer)
     Returns:
-        str: JSON formatted string containing the optimization strategies
+        dict: The input of the first tool call in the response
+    Raises:
+        LLMError: If the call fails after retries, or the response has no tool call
     """
-    try:
-        client = Anthropic(api_key=settings.CLAUDE_API_KEY)
-        
+    client = get_client('anthropic', model_name)
+    
+    with provider_slot('anthropic', estimate_request_tokens(prompt, max_tokens)):
         message = client.messages.create(
             model=model_name,
             max_tokens=max_tokens,
             messages=[
                 {
                     "role": "user",
-                    "content": prompt
+                    "content": to_anthropic_content(prompt)
                 }
             ],
             tools=tools,
+            timeout=timeout,
         )
+    record_anthropic_usage(message)
+    
+    # Check for tool calls in the response
+    for content in message.content:
         
-        # Check for tool calls in the response
-       
-        for content in message.content:
-            
-            if content.type == 'tool_use':
-                # Extract the tool call data directly from the ToolUseBlock
-                tool_data = content.input
-                return tool_data
-        
-        return json.dumps({"error": "No valid content found in response"})
-            
-    except Exception as e:
-        error_message = str(e)
-        print(f"Error in ask_claude_optimize: {error_message}")
-        return json.dumps({"error": error_message})  # Return JSON error, don't raise
\ No newline at end of file
+        if content.type == 'tool_use':
+            # Extract the tool call data directly from the ToolUseBlock
+            tool_data = content.input
+            return tool_data
+    
+    raise LLMResponseError("No valid content found in response", 'anthropic', model_name)
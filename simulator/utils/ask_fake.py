@@ -0,0 +1,164 @@
+"""
+Offline stand-in for an LLM provider, selected with provider_name 'fake'.
+
+`ask_fake` answers like the real `ask_*` helpers, without network access, so the
+aggregation and persona generation pipelines can be load-tested and benchmarked:
+
+- answers are deterministic, seeded by a hash of the prompt. Tool calls return input
+  that is valid for the tool's `input_schema`: response ids are picked from the
+  `id = N:` lines of the prompt, and a batch tool gets one entry per `Persona ID: N`.
+  Calls without tools return a short personality-style description;
+- latency follows a log-normal distribution (`LATENCY_MEDIAN`, `LATENCY_SIGMA`);
+- `ERROR_RATE` and `RATE_LIMIT_RATE` inject 500 and 429 failures, which go through the
+  same rate limiter, retry and circuit breaker paths as real provider errors.
+
+Latency and failures are random (reproducible when `SEED` is set); answers are not.
+Responses are deliberately not cached, so repeated benchmark runs do the same work.
+Settings come from `LLM_FAKE_PROVIDER`.
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Optional
+from django.conf import settings
+from simulator.utils.llm_resilience import resilient_llm_call
+from simulator.utils.llm_usage import record_usage
+from simulator.utils.prompt_segments import prompt_text
+from simulator.utils.provider_limits import estimate_request_tokens, estimate_tokens, provider_slot
+
+DEFAULT_FAKE_SETTINGS = {
+    'LATENCY_MEDIAN': 0.5,
+    'LATENCY_SIGMA': 0.5,
+    'ERROR_RATE': 0.0,
+    'RATE_LIMIT_RATE': 0.0,
+    'SEED': None,
+}
+
+TRAITS = (
+    'curious', 'pragmatic', 'cautious', 'optimistic', 'skeptical', 'community-minded',
+    'ambitious', 'easy-going', 'analytical', 'outspoken', 'thrifty', 'adventurous',
+)
+INTERESTS = (
+    'local politics', 'cooking', 'hiking', 'technology', 'gardening', 'music',
+    'sports', 'volunteering', 'reading', 'travel', 'personal finance', 'art',
+)
+
+_rng = None
+_rng_lock = threading.Lock()
+
+
+class FakeProviderError(Exception):
+    """Injected provider failure; carries an HTTP status like the SDK exceptions."""
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_fake_settings():
+    """Returns the fake provider settings merged over the defaults."""
+    return {**DEFAULT_FAKE_SETTINGS, **getattr(settings, 'LLM_FAKE_PROVIDER', {})}
+
+
+def _random(config):
+    """Returns (failure draw, latency factor) from the shared, optionally seeded, generator."""
+    global _rng
+    with _rng_lock:
+        if _rng is None:
+            _rng = random.Random(config['SEED'])
+        return _rng.random(), _rng.lognormvariate(0, config['LATENCY_SIGMA'])
+
+
+def reset_fake_provider():
+    """Reseeds the latency/failure generator from the current settings."""
+    global _rng
+    with _rng_lock:
+        _rng = None
+
+
+def _schema_value(schema, name, rng, context, index=0):
+    """Builds a deterministic value matching a JSON schema fragment."""
+    kind = schema.get('type')
+    if kind == 'object':
+        return {
+            key: _schema_value(child, key, rng, context, index)
+            for key, child in schema.get('properties', {}).items()
+        }
+    if kind == 'array':
+        count = len(context['persona_ids']) or 1
+        return [_schema_value(schema.get('items', {}), name, rng, context, i) for i in range(count)]
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+    if kind == 'integer':
+        if name == 'persona_id' and context['persona_ids']:
+            return context['persona_ids'][index]
+        if name.startswith('selected_response') and context['response_ids']:
+            return rng.choice(context['response_ids'])
+        return rng.randint(1, 10)
+    if kind == 'number':
+        return round(rng.random(), 2)
+    if kind == 'boolean':
+        return rng.random() < 0.5
+    return f"As a {rng.choice(TRAITS)} person I care about {rng.choice(INTERESTS)}, so this matters to me."
+
+
+def fake_tool_input(prompt, tool, rng=None):
+    """
+    Returns schema-valid input for a tool call, seeded by the prompt.
+    """
+    text = prompt_text(prompt)
+    rng = rng or random.Random(hashlib.sha256(text.encode('utf-8')).hexdigest())
+    context = {
+        'response_ids': [int(value) for value in re.findall(r'id = (\d+):', text)],
+        'persona_ids': [int(value) for value in re.findall(r'Persona ID: (\d+)', text)],
+    }
+    return _schema_value(tool.get('input_schema', {'type': 'object'}), tool.get('name', ''), rng, context)
+
+
+def fake_text(prompt, rng=None):
+    """Returns a deterministic short personality description for a prompt."""
+    text = prompt_text(prompt)
+    rng = rng or random.Random(hashlib.sha256(text.encode('utf-8')).hexdigest())
+    traits = rng.sample(TRAITS, 3)
+    interests = rng.sample(INTERESTS, 2)
+    return (
+        f"A {traits[0]}, {traits[1]} and {traits[2]} person who spends free time on "
+        f"{interests[0]} and {interests[1]}."
+    )
+
+
+def _simulate_call(config, timeout):
+    chance, latency_factor = _random(config)
+    latency = config['LATENCY_MEDIAN'] * latency_factor
+    if timeout is not None and latency > timeout:
+        time.sleep(timeout)
+        raise TimeoutError(f"Fake provider did not answer within {timeout:.1f}s")
+    time.sleep(latency)
+
+    if chance < config['RATE_LIMIT_RATE']:
+        raise FakeProviderError(429, "Fake provider rate limit")
+    if chance < config['RATE_LIMIT_RATE'] + config['ERROR_RATE']:
+        raise FakeProviderError(500, "Fake provider error")
+
+
+@resilient_llm_call('fake')
+def ask_fake(prompt, model_name: str, tools: Optional[list] = None, max_tokens: Optional[int] = 1000, timeout: Optional[float] = None):
+    """
+    Answers a prompt like the real ask_* helpers would, offline.
+
+    Returns:
+        dict: Input of the first tool when tools are given
+        str: A generated description otherwise
+    """
+    config = get_fake_settings()
+    with provider_slot('fake', estimate_request_tokens(prompt, max_tokens)):
+        _simulate_call(config, timeout)
+
+    response = fake_tool_input(prompt, tools[0]) if tools else fake_text(prompt)
+    record_usage(
+        requests=1,
+        input_tokens=estimate_tokens(prompt_text(prompt)),
+        output_tokens=estimate_tokens(str(response)),
+    )
+    return response
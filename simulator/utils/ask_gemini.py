@@ -1,22 +1,26 @@
-import google.generativeai as genai
-from django.conf import settings
-from simulator.models import LLMModelAndKey
-
-genai.configure(api_key=settings.GEMINI_API_KEY)
-
-def ask_gemini(prompt,model_name):
-    """Calls the Gemini LLM and returns the response."""
-    try:
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt)
-        print(f"Gemini response :{response}")
-        if response and hasattr(response, 'text'):
-            return response.text  
-        elif response and hasattr(response, 'candidates'):
-            return response.candidates[0].get('output', 'No output found')
-        else:
-            return "No response received."
-    
-    except Exception as e:
-        return f"Error: {e}"
+from typing import Optional
+from simulator.utils.llm_cache import cached_llm_response
+from simulator.utils.llm_clients import get_client
+from simulator.utils.llm_errors import LLMResponseError
+from simulator.utils.llm_resilience import resilient_llm_call
+from simulator.utils.llm_usage import record_gemini_usage
+from simulator.utils.prompt_segments import prompt_text
+from simulator.utils.provider_limits import estimate_request_tokens, provider_slot
 
+@cached_llm_response('google')
+@resilient_llm_call('google')
+def ask_gemini(prompt,model_name, timeout: Optional[float] = None):
+    """Calls the Gemini LLM and returns the response; raises LLMError on failure."""
+    model = get_client('google', model_name)
+    with provider_slot('google', estimate_request_tokens(prompt)):
+        response = model.generate_content(
+            prompt_text(prompt),
+            request_options={'timeout': timeout} if timeout else None
+        )
+    record_gemini_usage(response)
+    print(f"Gemini response :{response}")
+    if response and hasattr(response, 'text'):
+        return response.text  
+    elif response and hasattr(response, 'candidates'):
+        return response.candidates[0].get('output', 'No output found')
+    raise LLMResponseError("No response received.", 'google', model_name)
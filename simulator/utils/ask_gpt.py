@@ -1,26 +1,31 @@
-import time
-import openai
-from django.conf import settings
+from typing import Optional
+from simulator.utils.llm_cache import cached_llm_response
+from simulator.utils.llm_clients import get_client
+from simulator.utils.llm_errors import LLMResponseError
+from simulator.utils.llm_resilience import resilient_llm_call
+from simulator.utils.llm_usage import record_openai_usage
+from simulator.utils.prompt_segments import prompt_text
+from simulator.utils.provider_limits import estimate_request_tokens, provider_slot
 
-openai.api_key = settings.OPENAI_API_KEY
+@cached_llm_response('openai')
+@resilient_llm_call('openai')
+def ask_gpt(prompt, model_name, timeout: Optional[float] = None):
+    """Calls the OpenAI GPT model and returns the response; raises LLMError on failure."""
+    client = get_client('openai', model_name)
 
-def ask_gpt(prompt, model_name):
-    """Calls the OpenAI GPT model and returns the response."""
-    try:
-        response = openai.ChatCompletion.create(
+    with provider_slot('openai', estimate_request_tokens(prompt)):
+        response = client.chat.completions.create(
             model=model_name,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt},
+                {"role": "user", "content": prompt_text(prompt)},
             ],
+            timeout=timeout,
         )
+    record_openai_usage(response)
 
-        print(f"GPT response : {response}")
-        # Extract the response text
-        if response and 'choices' in response and len(response.choices) > 0:
-            return response.choices[0].message['content'].strip()
-        else:
-            return "No response received."
-    
-    except Exception as e:
-        return f"Error: {e}"
+    print(f"GPT response : {response}")
+    # Extract the response text
+    if response and response.choices and response.choices[0].message.content:
+        return response.choices[0].message.content.strip()
+    raise LLMResponseError("No response received.", 'openai', model_name)
@@ -0,0 +1,65 @@
+"""
+Provider-agnostic entry point for sending a prompt to an `LLMModelAndKey`.
+"""
+from typing import Optional
+from simulator.models import LLMModelAndKey
+from simulator.utils.ask_claude import ask_claude
+from simulator.utils.ask_claude_tools import ask_claude_tools
+from simulator.utils.ask_fake import ask_fake
+from simulator.utils.ask_gemini import ask_gemini
+from simulator.utils.ask_gpt import ask_gpt
+from simulator.utils.llm_hedging import get_hedging_settings, hedged_call
+
+
+def _ask_model(active_model, prompt, tools=None, max_tokens=None):
+    provider_name = active_model.provider_name
+    model_name = active_model.model_name
+
+    if provider_name == 'anthropic':
+        if tools:
+            return ask_claude_tools(prompt, model_name, tools, max_tokens or 1000)
+        return ask_claude(prompt, model_name, max_tokens or 1000)
+    if provider_name == 'openai':
+        return ask_gpt(prompt, model_name)
+    if provider_name == 'google':
+        return ask_gemini(prompt, model_name)
+    if provider_name == 'fake':
+        return ask_fake(prompt, model_name, tools, max_tokens or 1000)
+    raise ValueError(f"Unsupported provider: {provider_name}")
+
+
+def get_hedge_model(active_model):
+    """
+    Returns the model hedge requests are sent to: the LLMModelAndKey named by
+    LLM_HEDGING['SECONDARY_MODEL'], or the active model itself.
+    """
+    secondary_name = get_hedging_settings()['SECONDARY_MODEL']
+    if secondary_name and secondary_name != active_model.model_name:
+        secondary = LLMModelAndKey.objects.filter(model_name=secondary_name).first()
+        if secondary is not None:
+            return secondary
+    return active_model
+
+
+def ask_llm(active_model, prompt, tools: Optional[list] = None, max_tokens: Optional[int] = None):
+    """
+    Calls the `ask_*` helper matching the model's provider, hedging slow calls when
+    LLM_HEDGING is enabled (see simulator/utils/llm_hedging.py).
+
+    Args:
+        active_model: LLMModelAndKey to use
+        prompt: The text prompt to send
+        tools: Tool definitions; only used by providers with tool support (Anthropic, fake)
+        max_tokens: Maximum number of tokens in the response, where the provider supports it
+
+    Returns:
+        dict for tool calls, str otherwise
+    """
+    if not get_hedging_settings()['ENABLED']:
+        return _ask_model(active_model, prompt, tools, max_tokens)
+
+    return hedged_call(
+        active_model,
+        get_hedge_model(active_model),
+        lambda model: _ask_model(model, prompt, tools, max_tokens)
+    )
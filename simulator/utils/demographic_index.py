@@ -0,0 +1,107 @@
+"""
+In-memory demographic index of a city's personas.
+
+An aggregation needs every persona's demographics: to render the persona block of its
+prompt and, in the sampling, archetype and surrogate modes, to group personas by their
+subcategories. Fetching them per persona costs several queries each. `DemographicIndex.load` reads every persona -> subcategory
+mapping of the city with one query and keeps them in integer arrays:
+
+- the city's subcategories are numbered 0..n-1 (`subcategory_names`), each with the
+  code of its category in `category_names` (`subcategory_categories`);
+- mappings are stored per persona in CSR layout: the subcategory codes of the persona
+  at position i of the sorted `persona_ids` array are
+  `subcategory_codes[offsets[i]:offsets[i + 1]]`.
+
+Lookups then run without touching the database; answers are counted by the GROUP BY
+queries of summary_engine.
+"""
+import numpy as np
+from simulator.models import PersonaSubCategoryMapping
+
+LOAD_CHUNK_SIZE = 2000
+
+
+class DemographicIndex:
+    """
+    Persona -> (category, subcategory) mappings of one city.
+    """
+    def __init__(self, persona_ids, offsets, subcategory_codes, subcategory_names,
+                 subcategory_categories, category_names):
+        self.persona_ids = persona_ids
+        self.offsets = offsets
+        self.subcategory_codes = subcategory_codes
+        self.subcategory_names = subcategory_names
+        self.subcategory_categories = subcategory_categories
+        self.category_names = category_names
+
+    @classmethod
+    def load(cls, city_name):
+        """
+        Builds the index of a city from a single query.
+        """
+        rows = PersonaSubCategoryMapping.objects.filter(
+            persona__city=city_name, subcategory__city=city_name
+        ).order_by('persona_id', 'id').values_list(
+            'persona_id', 'subcategory_id', 'subcategory__name', 'subcategory__category__name'
+        )
+
+        category_codes, codes_by_subcategory_id = {}, {}
+        category_names, subcategory_names, subcategory_categories = [], [], []
+        persona_column, code_column = [], []
+        for persona_id, subcategory_id, subcategory_name, category_name in rows.iterator(chunk_size=LOAD_CHUNK_SIZE):
+            if subcategory_id not in codes_by_subcategory_id:
+                if category_name not in category_codes:
+                    category_codes[category_name] = len(category_names)
+                    category_names.append(category_name)
+                codes_by_subcategory_id[subcategory_id] = len(subcategory_names)
+                subcategory_names.append(subcategory_name)
+                subcategory_categories.append(category_codes[category_name])
+            persona_column.append(persona_id)
+            code_column.append(codes_by_subcategory_id[subcategory_id])
+
+        # Rows are ordered by persona, so first occurrences delimit each persona's mappings
+        persona_ids, starts = np.unique(np.asarray(persona_column, dtype=np.int64), return_index=True)
+        return cls(
+            persona_ids=persona_ids,
+            offsets=np.append(starts, len(persona_column)).astype(np.int64),
+            subcategory_codes=np.asarray(code_column, dtype=np.int32),
+            subcategory_names=subcategory_names,
+            subcategory_categories=np.asarray(subcategory_categories, dtype=np.int32),
+            category_names=category_names,
+        )
+
+    def __len__(self):
+        return len(self.persona_ids)
+
+    def _positions(self, persona_ids):
+        """Returns (positions in persona_ids, mask of the ids that are indexed)."""
+        persona_ids = np.asarray(persona_ids, dtype=np.int64)
+        if not len(self.persona_ids):
+            return np.zeros(len(persona_ids), dtype=np.int64), np.zeros(len(persona_ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.persona_ids, persona_ids), len(self.persona_ids) - 1)
+        return positions, self.persona_ids[positions] == persona_ids
+
+    def demographics(self, persona_id):
+        """
+        Returns the persona's (subcategory name, category name) pairs.
+        """
+        positions, known = self._positions([persona_id])
+        if not known[0]:
+            return []
+        position = positions[0]
+        codes = self.subcategory_codes[self.offsets[position]:self.offsets[position + 1]]
+        return [
+            (self.subcategory_names[code], self.category_names[self.subcategory_categories[code]])
+            for code in codes
+        ]
+
+    def subcategory_sets(self, persona_ids):
+        """
+        Returns the sorted subcategory codes of each persona, () for unknown personas.
+        """
+        positions, known = self._positions(persona_ids)
+        return [
+            tuple(sorted(self.subcategory_codes[self.offsets[position]:self.offsets[position + 1]].tolist()))
+            if is_known else ()
+            for position, is_known in zip(positions.tolist(), known.tolist())
+        ]
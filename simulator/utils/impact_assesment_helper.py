@@ -1,10 +1,11 @@
 from venv import logger
 from simulator.models import LLMModelAndKey, PossibleUserResponses, PromptModel, AggregateEmotion, OptimizedResponse, NewsItem, Persona, Category, SubCategory
-from simulator.utils.ask_gemini import ask_gemini
-from simulator.utils.ask_gpt import ask_gpt
-from simulator.utils.ask_claude import ask_claude
-from simulator.utils.ask_claude_tools import ask_claude_tools
+from simulator.utils.ask_llm import ask_llm
+from simulator.utils.llm_errors import CircuitOpenError, LLMError
+from simulator.utils.provider_limits import estimate_tokens
+from django.conf import settings
 import json
+import re
 # def generate_emotional_response(persona, news_item):
 #     """
 #     Generates a response for a persona by selecting from possible user responses.
@@ -72,70 +73,112 @@ import json
 
 #     return selected_response, intensity, explanation
 
-def generate_emotional_response(persona, news_item):
+def get_active_model():
     """
-    Generates a response for a persona by selecting from possible user responses.
-    Includes improved error handling and response parsing.
+    Returns the active LLMModelAndKey, raising ValueError if none is configured.
     """
-    # Get the active LLM model
     active_model = LLMModelAndKey.objects.filter(active=True).first()
     if not active_model:
         raise ValueError("No active LLM model found")
+    return active_model
 
+def get_user_response_template():
+    """
+    Returns the PromptModel for the generate_user_response task.
+    """
     try:
-        # Get the prompt template
-        prompt_template = PromptModel.objects.get(task_name='generate_user_response')
+        return PromptModel.objects.get(task_name='generate_user_response')
     except PromptModel.DoesNotExist:
         raise ValueError("No prompt template found for generate_user_response task")
 
-    # Prepare persona details
+def format_persona_details(persona, demographic_index=None):
+    """
+    Renders the persona block inserted into the {persona_details} placeholder.
+
+    Args:
+        demographic_index (DemographicIndex): Preloaded demographics of the persona's
+            city; without it the persona's mappings are queried
+    """
     personality_description = persona.personality_description or "No description provided."
-    subcategories = persona.subcategory_mappings.select_related("subcategory").all()
+    if demographic_index is not None:
+        demographics = demographic_index.demographics(persona.id)
+    else:
+        if 'subcategory_mappings' in getattr(persona, '_prefetched_objects_cache', {}):
+            # Loaded by the caller with prefetch_related, e.g. when rendering many personas
+            subcategories = persona.subcategory_mappings.all()
+        else:
+            subcategories = persona.subcategory_mappings.select_related("subcategory__category")
+        demographics = [
+            (mapping.subcategory.name, mapping.subcategory.category.name)
+            for mapping in subcategories
+        ]
     subcategories_list = [
-        f"{mapping.subcategory.name} ({mapping.subcategory.category.name})"
-        for mapping in subcategories
+        f"{subcategory_name} ({category_name})"
+        for subcategory_name, category_name in demographics
     ]
-    
-    persona_details = (
+
+    return (
         f"Persona: Name {persona.name}, City {persona.city}, "
         f"Demographics: {', '.join(subcategories_list)}.\n"
         f"Personality Description: {personality_description}\n"
     )
-    
-    # Get possible responses
+
+def get_possible_responses(news_item):
+    """
+    Returns the possible user responses of a news item and their prompt listing.
+    """
     possible_responses = PossibleUserResponses.objects.filter(news_item=news_item)
     if not possible_responses:
         raise ValueError(f"No possible responses found for news item: {news_item.id}")
-        
+
     responses_list = "\n".join([
-        f"id = {response.id}: {response.response_text}" 
+        f"id = {response.id}: {response.response_text}"
         for response in possible_responses
     ])
-    print(f"responses_list: {responses_list}")
-    # Format the prompt template with the dynamic values
+    return possible_responses, responses_list
+
+def render_user_response_prompt(prompt_template, persona_details, news_item, responses_list):
+    """
+    Formats the generate_user_response template with the dynamic values.
+
+    Returns:
+        PromptSegments: The news title, responses and instructions shared by every
+        persona of a run form the cacheable prefix; the suffix starts at {persona_details}
+    """
     try:
-        prompt = prompt_template.prompt_template.format(
+        return prompt_template.render_segments(
+            ('persona_details',),
             persona_details=persona_details,
             news_title=news_item.title,
-            responses_list=responses_list,
-            version=prompt_template.version
+            responses_list=responses_list
         )
-        prompt_tools = prompt_template.tools_content
     except KeyError as e:
         raise ValueError(f"Missing required placeholder in prompt template: {str(e)}")
 
-    # Call the appropriate LLM based on the active model
-    try:
-        if active_model.provider_name == 'anthropic':
-            llm_response = ask_claude_tools(prompt, active_model.model_name, prompt_tools)
-        elif active_model.provider_name == 'openai':
-            llm_response = ask_gpt(prompt, active_model.model_name)
-        elif active_model.provider_name == 'google':
-            llm_response = ask_gemini(prompt, active_model.model_name)
-        else:
-            raise ValueError(f"Unsupported provider: {active_model.provider_name}")
-    except Exception as e:
-        raise ValueError(f"LLM API error: {str(e)}")
+def generate_emotional_response(persona, news_item, demographic_index=None):
+    """
+    Generates a response for a persona by selecting from possible user responses.
+    Includes improved error handling and response parsing.
+
+    Args:
+        demographic_index (DemographicIndex): Optional preloaded demographics used to
+            render the persona block
+    """
+    # Get the active LLM model and the prompt template
+    active_model = get_active_model()
+    prompt_template = get_user_response_template()
+
+    # Prepare persona details and possible responses
+    persona_details = format_persona_details(persona, demographic_index)
+    possible_responses, responses_list = get_possible_responses(news_item)
+    print(f"responses_list: {responses_list}")
+
+    # Format the prompt template with the dynamic values
+    prompt = render_user_response_prompt(prompt_template, persona_details, news_item, responses_list)
+    prompt_tools = prompt_template.tools_content
+
+    # Call the appropriate LLM based on the active model; failures raise LLMError
+    llm_response = ask_llm(active_model, prompt, prompt_tools)
     
     # print(f"llm_response: {llm_response}  :: end :: type: {type(llm_response)}")
     # Add strict response validation
@@ -186,6 +229,218 @@ def generate_emotional_response(persona, news_item):
     except (IndexError, ValueError) as e:
         logger.error(f"Error processing persona {persona.id}: {str(e)}\nFull response: {llm_response}")
         raise ValueError(f"Failed to parse LLM response for persona {persona.id}: {str(e)}")
+
+BATCH_RESPONSE_TOOL = {
+    "name": "generate_user_responses",
+    "description": "Record the selected response of every persona in the batch.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "responses": {
+                "type": "array",
+                "description": "One entry per persona, in any order.",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "persona_id": {
+                            "type": "integer",
+                            "description": "The Persona ID given at the start of the persona's block."
+                        },
+                        "selected_response_number": {
+                            "type": "integer",
+                            "description": "The id of the selected possible response."
+                        },
+                        "intensity": {
+                            "type": "number",
+                            "description": "Intensity of the reaction between 0 and 1."
+                        },
+                        "explanation": {
+                            "type": "string",
+                            "description": "Brief explanation from the persona's point of view."
+                        }
+                    },
+                    "required": ["persona_id", "selected_response_number", "intensity", "explanation"]
+                }
+            }
+        },
+        "required": ["responses"]
+    }
+}
+
+BATCH_INSTRUCTIONS = (
+    "The personas below must be evaluated independently of each other. Each block starts "
+    "with its Persona ID. Call the generate_user_responses tool (or, if tools are not "
+    "available, reply with a JSON object of the same shape) with exactly one entry per "
+    "Persona ID.\n\n"
+)
+
+# Output tokens reserved per persona entry (ids, intensity and a short explanation)
+OUTPUT_TOKENS_PER_PERSONA = 150
+
+DEFAULT_CONTEXT_TOKENS = {
+    'anthropic': 200000,
+    'openai': 128000,
+    'google': 1000000,
+}
+
+def resolve_batch_size(news_item, sample_personas, demographic_index=None):
+    """
+    Picks how many personas to pack into one batched request.
+
+    The batch is bounded by the model's context window (shared prompt plus the average
+    persona block), by LLM_MAX_OUTPUT_TOKENS and by EMOTION_BATCH_MAX_SIZE.
+
+    Args:
+        news_item (NewsItem): The news item being evaluated
+        sample_personas (list): Personas used to estimate the size of a persona block
+        demographic_index (DemographicIndex): Optional preloaded demographics
+
+    Returns:
+        int: Batch size of at least 1
+    """
+    active_model = get_active_model()
+    prompt_template = get_user_response_template()
+    _, responses_list = get_possible_responses(news_item)
+
+    context_tokens = getattr(settings, 'LLM_CONTEXT_TOKENS', DEFAULT_CONTEXT_TOKENS).get(
+        active_model.provider_name, 100000
+    )
+    max_output_tokens = getattr(settings, 'LLM_MAX_OUTPUT_TOKENS', 8192)
+    max_batch_size = getattr(settings, 'EMOTION_BATCH_MAX_SIZE', 25)
+
+    prefix_tokens = estimate_tokens(
+        BATCH_INSTRUCTIONS + render_user_response_prompt(prompt_template, "", news_item, responses_list).text
+    )
+    persona_blocks = [
+        format_persona_details(persona, demographic_index) for persona in sample_personas
+    ] or [""]
+    persona_tokens = max(1, sum(estimate_tokens(block) for block in persona_blocks) // len(persona_blocks))
+
+    # Keep a quarter of the window as headroom for tokenizer differences
+    by_context = (int(context_tokens * 0.75) - prefix_tokens) // persona_tokens
+    by_output = max_output_tokens // OUTPUT_TOKENS_PER_PERSONA
+
+    return max(1, min(max_batch_size, by_context, by_output))
+
+def _parse_batch_payload(llm_response):
+    """
+    Extracts the list of persona entries from a tool call or a JSON text reply.
+    """
+    if isinstance(llm_response, str):
+        match = re.search(r"[\[{].*[\]}]", llm_response, re.DOTALL)
+        if not match:
+            return []
+        try:
+            llm_response = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return []
+
+    if isinstance(llm_response, dict):
+        llm_response = llm_response.get("responses", [])
+    return llm_response if isinstance(llm_response, list) else []
+
+def validate_emotional_response(payload, valid_response_ids):
+    """
+    Returns (selected_response, intensity, explanation) from a generate_user_response
+    payload, or None if a field is missing or out of range.
+    """
+    if not isinstance(payload, dict):
+        return None
+    try:
+        selected_response = int(payload["selected_response_number"])
+        intensity = float(payload["intensity"])
+        explanation = str(payload["explanation"]).strip()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if selected_response not in valid_response_ids or not 0 <= intensity <= 1 or not explanation:
+        return None
+    return selected_response, intensity, explanation
+
+def _validate_batch_entry(entry, valid_response_ids):
+    """
+    Returns (persona_id, (selected_response, intensity, explanation)), or None if the entry is invalid.
+    """
+    result = validate_emotional_response(entry, valid_response_ids)
+    if result is None:
+        return None
+    try:
+        return int(entry["persona_id"]), result
+    except (TypeError, ValueError):
+        return None
+
+def generate_emotional_responses_batch(personas, news_item, demographic_index=None):
+    """
+    Generates responses for several personas with a single LLM request.
+
+    The news title, possible responses and template instructions are sent once per
+    batch instead of once per persona. Every returned entry is validated and mapped
+    back to its persona; personas whose entry is missing, duplicated or invalid fall
+    back to generate_emotional_response.
+
+    Args:
+        personas (list): Personas to evaluate
+        news_item (NewsItem): The news item to respond to
+        demographic_index (DemographicIndex): Optional preloaded demographics
+
+    Returns:
+        list: (persona, result) pairs where result is the (selected_response,
+        intensity, explanation) tuple or the exception raised by the fallback call
+    """
+    personas = list(personas)
+    if len(personas) == 1:
+        try:
+            return [(personas[0], generate_emotional_response(personas[0], news_item, demographic_index))]
+        except Exception as e:
+            return [(personas[0], e)]
+
+    active_model = get_active_model()
+    prompt_template = get_user_response_template()
+    possible_responses, responses_list = get_possible_responses(news_item)
+    valid_response_ids = {response.id for response in possible_responses}
+
+    persona_details = "\n".join(
+        f"Persona ID: {persona.id}\n{format_persona_details(persona, demographic_index)}"
+        for persona in personas
+    )
+    prompt = render_user_response_prompt(
+        prompt_template, persona_details, news_item, responses_list
+    ).with_prefix(BATCH_INSTRUCTIONS)
+    max_tokens = OUTPUT_TOKENS_PER_PERSONA * len(personas) + 256
+
+    try:
+        llm_response = ask_llm(active_model, prompt, [BATCH_RESPONSE_TOOL], max_tokens)
+    except CircuitOpenError as e:
+        # The provider is down: falling back to single calls would only fail again
+        return [(persona, e) for persona in personas]
+    except LLMError as e:
+        logger.error(f"Batched LLM call failed for {len(personas)} personas: {e}")
+        llm_response = None
+
+    batch_ids = {persona.id for persona in personas}
+    results = {}
+    duplicates = set()
+    for entry in _parse_batch_payload(llm_response):
+        validated = _validate_batch_entry(entry, valid_response_ids)
+        if validated is None or validated[0] not in batch_ids:
+            continue
+        persona_id, result = validated
+        if persona_id in results:
+            duplicates.add(persona_id)
+        results[persona_id] = result
+
+    outcomes = []
+    for persona in personas:
+        if persona.id in results and persona.id not in duplicates:
+            outcomes.append((persona, results[persona.id]))
+            continue
+
+        logger.warning(f"Batch entry missing or invalid for persona {persona.id}, retrying individually")
+        try:
+            outcomes.append((persona, generate_emotional_response(persona, news_item, demographic_index)))
+        except Exception as e:
+            outcomes.append((persona, e))
+    return outcomes
 # def generate_emotional_response(persona, news_item):
 #     """
 #     Generates a response for a persona by selecting from possible user responses.
@@ -336,14 +591,7 @@ def generate_optimal_response(city_name, news_item, demographic_focus):
         )
         
         # Send the prompt to the LLM
-        if active_model.provider_name == 'anthropic':
-            llm_response = ask_claude_tools(prompt, active_model.model_name, prompt_tools)
-        elif active_model.provider_name == 'openai':
-            llm_response = ask_gpt(prompt, active_model.model_name)
-        elif active_model.provider_name == 'google':
-            llm_response = ask_gemini(prompt, active_model.model_name)
-        else:
-            raise ValueError(f"Unsupported provider: {active_model.provider_name}")
+        llm_response = ask_llm(active_model, prompt, prompt_tools)
         
         recommendations = llm_response["recommendations"]
         combined_response = generate_combined_optimal_response(city_name, news_item, recommendations)
@@ -420,14 +668,7 @@ def generate_combined_optimal_response(city_name, news_item, recommendations):
         )
         
         # Send the prompt to the LLM    
-        if active_model.provider_name == 'anthropic':
-            llm_response = ask_claude_tools(prompt, active_model.model_name, prompt_tools)
-        elif active_model.provider_name == 'openai':
-            llm_response = ask_gpt(prompt, active_model.model_name)
-        elif active_model.provider_name == 'google':
-            llm_response = ask_gemini(prompt, active_model.model_name)
-        else:
-            raise ValueError(f"Unsupported provider: {active_model.provider_name}")
+        llm_response = ask_llm(active_model, prompt, prompt_tools)
         print(f"llm_response: {llm_response}")
         return llm_response
     except Exception as e:
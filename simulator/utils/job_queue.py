@@ -0,0 +1,294 @@
+"""
+Lease-based job queue for the background workers.
+
+Aggregations, persona generation tasks and their description stages are run through
+WorkerJob rows so that any number of worker threads, processes or machines can share
+the work without processing a job twice:
+
+- `enqueue` creates a job (or puts a finished one back in the queue) and
+  `enqueue_missing` adds jobs for rows created without one;
+- `claim` hands a pending job to exactly one worker. On PostgreSQL this is a
+  `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent workers pick different jobs without
+  waiting on each other. Databases without SKIP LOCKED (SQLite) use a conditional UPDATE
+  on the job's lease token instead: of several workers racing for a job only one
+  UPDATE matches, the others move on to the next candidate;
+- a claimed job holds a lease of `JOB_LEASE_SECONDS`, renewed by a heartbeat thread
+  (`keep_lease`) every `JOB_HEARTBEAT_SECONDS`. When a worker dies its lease expires and
+  the job is claimed again, up to `JOB_MAX_ATTEMPTS` times;
+- `complete`, `fail` and `release` only apply while the caller still holds the lease.
+  Handlers get the lease's `lost` event and stop (`check_lease` raises `LeaseLost`)
+  without writing anything once another worker has claimed their job.
+
+`process_next_job` ties these together for the worker loops, which sleep in
+job_signals.wait_for_jobs while the queue is empty.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from simulator.models import WorkerJob
+from simulator.utils.job_signals import notify_workers
+
+logger = logging.getLogger(__name__)
+
+AGGREGATION_JOB = 'aggregation'
+PERSONA_GENERATION_JOB = 'persona_generation'
+PERSONA_DESCRIPTION_JOB = 'persona_descriptions'
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_HEARTBEAT_SECONDS = 30
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Jobs tried per claim when another worker wins the race for the first one
+CLAIM_CANDIDATES = 5
+
+
+class LeaseLost(Exception):
+    """Raised by a handler that stops because another worker claimed its job."""
+
+
+def get_lease_seconds():
+    return getattr(settings, 'JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+
+
+def get_worker_id():
+    """Identifies the calling worker thread across machines."""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue(kind, object_id, delay=0):
+    """
+    Creates the job for an object, or resets its existing job to pending, and wakes
+    the workers waiting for jobs of its kind.
+
+    Returns:
+        WorkerJob: The queued job
+    """
+    job, _ = WorkerJob.objects.update_or_create(
+        kind=kind,
+        object_id=object_id,
+        defaults={
+            'status': PENDING,
+            'available_at': timezone.now() + timedelta(seconds=delay),
+            'lease_owner': '',
+            'lease_token': '',
+            'lease_expires_at': None,
+            'attempts': 0,
+            'last_error': '',
+        }
+    )
+    notify_workers(kind)
+    return job
+
+
+def enqueue_missing(kind, object_ids):
+    """Creates pending jobs for the objects that have none; existing jobs are left alone."""
+    WorkerJob.objects.bulk_create(
+        [WorkerJob(kind=kind, object_id=object_id) for object_id in object_ids],
+        ignore_conflicts=True
+    )
+
+
+def _claimable(kind, now, object_ids=None):
+    jobs = WorkerJob.objects.filter(kind=kind, available_at__lte=now).filter(
+        Q(status=PENDING) | Q(status=RUNNING, lease_expires_at__lt=now)
+    )
+    if object_ids is not None:
+        jobs = jobs.filter(object_id__in=object_ids)
+    return jobs.order_by('available_at', 'id')
+
+
+def _lease(owner, now, lease_seconds):
+    return {
+        'status': RUNNING,
+        'lease_owner': owner,
+        'lease_token': uuid.uuid4().hex,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+        'heartbeat_at': now,
+    }
+
+
+def claim(kind, owner=None, object_ids=None, lease_seconds=None):
+    """
+    Claims the next pending (or abandoned) job of a kind.
+
+    Args:
+        kind: Job kind, e.g. AGGREGATION_JOB
+        owner: Worker id recorded on the lease; defaults to get_worker_id()
+        object_ids: Only consider jobs for these objects
+        lease_seconds: Lease duration; defaults to JOB_LEASE_SECONDS
+
+    Returns:
+        WorkerJob or None: The claimed job, holding the caller's lease
+    """
+    owner = owner or get_worker_id()
+    lease_seconds = lease_seconds or get_lease_seconds()
+    now = timezone.now()
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = _claimable(kind, now, object_ids).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            for field, value in _lease(owner, now, lease_seconds).items():
+                setattr(job, field, value)
+            job.attempts += 1
+            job.save()
+            return job
+
+    for job in _claimable(kind, now, object_ids)[:CLAIM_CANDIDATES]:
+        lease = _lease(owner, now, lease_seconds)
+        claimed = WorkerJob.objects.filter(
+            id=job.id, status=job.status, lease_token=job.lease_token
+        ).update(attempts=F('attempts') + 1, **lease)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _held(job):
+    return WorkerJob.objects.filter(id=job.id, status=RUNNING, lease_token=job.lease_token)
+
+
+def heartbeat(job, lease_seconds=None):
+    """
+    Extends the lease of a running job.
+
+    Returns:
+        bool: False if the lease was lost (it expired and another worker claimed the job)
+    """
+    now = timezone.now()
+    return _held(job).update(
+        lease_expires_at=now + timedelta(seconds=lease_seconds or get_lease_seconds()),
+        heartbeat_at=now
+    ) == 1
+
+
+def complete(job):
+    """Marks a job completed. Returns False if the lease was lost."""
+    return _held(job).update(status=COMPLETED, lease_expires_at=None) == 1
+
+
+def fail(job, error):
+    """Marks a job failed. Returns False if the lease was lost."""
+    return _held(job).update(status=FAILED, lease_expires_at=None, last_error=str(error)) == 1
+
+
+def release(job, delay=0):
+    """
+    Puts a running job back in the queue, e.g. while it waits on an external service.
+    The attempt is not counted against JOB_MAX_ATTEMPTS.
+    """
+    return _held(job).update(
+        status=PENDING,
+        available_at=timezone.now() + timedelta(seconds=delay),
+        lease_expires_at=None,
+        attempts=F('attempts') - 1
+    ) == 1
+
+
+def check_lease(lost):
+    """Raises LeaseLost once `lost` (yielded by keep_lease) is set; None never raises."""
+    if lost is not None and lost.is_set():
+        raise LeaseLost("The job's lease was lost to another worker")
+
+
+@contextmanager
+def keep_lease(job, interval=None):
+    """
+    Renews the job's lease from a background thread while the block runs.
+
+    Yields:
+        threading.Event: Set when the lease was lost
+    """
+    interval = interval or getattr(settings, 'JOB_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS)
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                if not heartbeat(job):
+                    logger.warning("Lost the lease of %s", job)
+                    lost.set()
+                    return
+        except Exception as e:
+            logger.error("Heartbeat of %s failed: %s", job, e)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, daemon=True, name=f"lease-{job.id}")
+    thread.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        thread.join()
+
+
+def process_next_job(kind, handler, object_ids=None, on_give_up=None, requeue_delay=0, on_error=None):
+    """
+    Claims one job and runs it under a kept-alive lease.
+
+    Args:
+        kind: Job kind to claim
+        handler: Function called with the job and the lease's `lost` event; returns
+            COMPLETED, FAILED or PENDING (to be run again after requeue_delay).
+            Exceptions fail the job; LeaseLost leaves it to the worker that claimed it.
+        object_ids: Only consider jobs for these objects
+        on_give_up: Function called with a job that was abandoned JOB_MAX_ATTEMPTS
+            times, e.g. to mark its object as failed
+        on_error: Function called with a job and the exception its handler raised,
+            e.g. to mark its object as failed
+        requeue_delay: Seconds before a job returning PENDING is claimed again
+
+    Returns:
+        WorkerJob or None: The job processed, None if there was nothing to do
+    """
+    job = claim(kind, object_ids=object_ids)
+    if job is None:
+        return None
+
+    max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    if job.attempts > max_attempts:
+        logger.error("Giving up on %s after %d attempts", job, max_attempts)
+        if on_give_up is not None:
+            on_give_up(job)
+        fail(job, f"Abandoned by its worker {max_attempts} times")
+        return job
+
+    try:
+        with keep_lease(job) as lost:
+            outcome = handler(job, lost)
+    except LeaseLost:
+        logger.warning("Stopped %s: another worker claimed it", job)
+        return job
+    except Exception as e:
+        logger.error("Job %s failed: %s", job, e)
+        if fail(job, e) and on_error is not None:
+            try:
+                on_error(job, e)
+            except Exception as error_handler_error:
+                logger.error("Could not record the failure of %s: %s", job, error_handler_error)
+        return job
+
+    if outcome == COMPLETED:
+        complete(job)
+    elif outcome == PENDING:
+        release(job, requeue_delay)
+    else:
+        fail(job, "The job reported a failure")
+    return job
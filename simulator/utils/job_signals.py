@@ -0,0 +1,124 @@
+"""
+Wakes idle workers as soon as a job is queued, instead of having them poll the queue.
+
+`notify_workers(kind)` is called whenever a job is queued (see job_queue.enqueue) and
+`wait_for_jobs(kind, timeout)` blocks an idle worker until then:
+
+- on PostgreSQL the notification is a `NOTIFY` on the `simulator_jobs` channel, sent
+  once the surrounding transaction commits, so workers in other processes and on other
+  machines wake up. Each worker process runs one listener thread holding a dedicated
+  connection that `LISTEN`s on the channel;
+- in-process waiters are woken through a threading.Event per job kind. This is also
+  the fallback for SQLite and development setups, where the views and the workers
+  started by SimulatorConfig.ready share one process.
+
+The timeout keeps a slow safety-net scan for jobs whose notification was missed and
+for requeued jobs that become available later. Without LISTEN/NOTIFY a worker running
+in another process than the view is never signalled, so there the wait is capped at
+JOB_POLL_SECONDS and such workers keep polling the queue.
+"""
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'simulator_jobs'
+# How often the listener checks its connection while no notification arrives
+LISTEN_POLL_SECONDS = 5
+RECONNECT_DELAY_SECONDS = 5
+
+_events = defaultdict(threading.Event)
+_events_lock = threading.Lock()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _event(kind):
+    with _events_lock:
+        return _events[kind]
+
+
+def _wake_all():
+    with _events_lock:
+        events = list(_events.values())
+    for event in events:
+        event.set()
+
+
+def _uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def notify_workers(kind):
+    """
+    Signals that a job of the given kind was queued.
+    """
+    _event(kind).set()
+    if _uses_postgres():
+        def send():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, kind])
+        # Workers must not look for the job before it is committed
+        transaction.on_commit(send)
+
+
+def wait_for_jobs(kind, timeout):
+    """
+    Blocks until a job of the given kind is signalled or the timeout passes. On databases
+    without LISTEN/NOTIFY the timeout is capped at JOB_POLL_SECONDS.
+
+    Returns:
+        bool: True if woken by a signal
+    """
+    if _uses_postgres():
+        _ensure_listener()
+    else:
+        timeout = min(timeout, getattr(settings, 'JOB_POLL_SECONDS', 1))
+    event = _event(kind)
+    signalled = event.wait(timeout)
+    # Whoever was queued before this point is found by the caller's next claim
+    event.clear()
+    return signalled
+
+
+def _ensure_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen, daemon=True, name='job-listener')
+            _listener.start()
+
+
+def _listen():
+    """Relays NOTIFY payloads (job kinds) to the in-process events, reconnecting on errors."""
+    database = connections['default']
+    while True:
+        listen_connection = None
+        try:
+            listen_connection = database.get_new_connection(database.get_connection_params())
+            listen_connection.autocommit = True
+            with listen_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            # Notifications may have been missed while (re)connecting
+            _wake_all()
+
+            while True:
+                if select.select([listen_connection], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                    continue
+                listen_connection.poll()
+                while listen_connection.notifies:
+                    _event(listen_connection.notifies.pop(0).payload).set()
+        except Exception as e:
+            logger.error("Job listener connection failed: %s", e)
+            time.sleep(RECONNECT_DELAY_SECONDS)
+        finally:
+            if listen_connection is not None:
+                try:
+                    listen_connection.close()
+                except Exception:
+                    pass
@@ -0,0 +1,331 @@
+"""
+Provider batch-API support for large offline aggregations.
+
+A batch job is a JSONL file with one request per line, each tagged with a `custom_id`.
+The file is submitted to a `BatchBackend`, polled until the provider has processed it
+and its results are read back as `(custom_id, payload, error)` tuples, where payload is
+the tool call input (or the text reply) of the request.
+
+Backends:
+
+- `AnthropicBatchBackend`: Message Batches API;
+- `OpenAIBatchBackend`: Batch API over /v1/chat/completions;
+- `LocalFileBatchBackend`: a directory-based stand-in service. Submitted files are copied
+  to `<root>/<batch_id>/input.jsonl`; the batch is complete once `output.jsonl` appears
+  next to it, which `LocalFileBatchBackend.complete` writes from a responder function.
+  It needs no network access and is what the tests use;
+- `FakeBatchBackend`: the local service answered by the offline 'fake' provider.
+
+The backend per provider comes from `LLM_BATCH_BACKENDS` (dotted paths) and can be
+replaced there. Providers cap the number of requests and the size of one batch;
+`write_batch_files` splits a job's requests into files that each fit the backend's
+`max_requests` and `max_bytes`, and every file is submitted as its own batch.
+"""
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from django.conf import settings
+from django.utils.module_loading import import_string
+from simulator.utils.ask_fake import fake_text, fake_tool_input
+from simulator.utils.llm_clients import get_client
+from simulator.utils.prompt_segments import prompt_text
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+DEFAULT_BATCH_BACKENDS = {
+    'anthropic': 'simulator.utils.llm_batch.AnthropicBatchBackend',
+    'openai': 'simulator.utils.llm_batch.OpenAIBatchBackend',
+    'fake': 'simulator.utils.llm_batch.FakeBatchBackend',
+}
+
+
+class BatchBackend:
+    """
+    Interface of a batch service. Subclasses implement every method.
+    """
+    # Per-batch limits of the provider; None when it has none
+    max_requests = None
+    max_bytes = None
+
+    def build_request(self, custom_id, model_name, prompt, tools=None, max_tokens=1000):
+        """Returns the JSONL line (as a dict) for one request."""
+        raise NotImplementedError
+
+    def submit(self, input_path, model_name):
+        """Submits a JSONL file and returns the batch id."""
+        raise NotImplementedError
+
+    def poll(self, batch_id, model_name):
+        """Returns IN_PROGRESS, COMPLETED or FAILED."""
+        raise NotImplementedError
+
+    def iter_results(self, batch_id, model_name):
+        """Yields (custom_id, payload, error) for every request of a completed batch."""
+        raise NotImplementedError
+
+
+def _parse_text_payload(text):
+    """Tool-less replies are expected to carry a JSON object; returns it or the raw text."""
+    try:
+        return json.loads(text)
+    except (TypeError, json.JSONDecodeError):
+        return text
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """
+    Anthropic Message Batches API.
+    """
+    max_requests = 100_000
+    max_bytes = 256 * 1024 * 1024
+
+    def build_request(self, custom_id, model_name, prompt, tools=None, max_tokens=1000):
+        params = {
+            "model": model_name,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt_text(prompt)}],
+        }
+        if tools:
+            params["tools"] = tools
+        return {"custom_id": custom_id, "params": params}
+
+    def submit(self, input_path, model_name):
+        with open(input_path, encoding='utf-8') as input_file:
+            requests = [json.loads(line) for line in input_file if line.strip()]
+        batch = get_client('anthropic', model_name).messages.batches.create(requests=requests)
+        return batch.id
+
+    def poll(self, batch_id, model_name):
+        batch = get_client('anthropic', model_name).messages.batches.retrieve(batch_id)
+        return COMPLETED if batch.processing_status == 'ended' else IN_PROGRESS
+
+    def iter_results(self, batch_id, model_name):
+        for entry in get_client('anthropic', model_name).messages.batches.results(batch_id):
+            if entry.result.type != 'succeeded':
+                yield entry.custom_id, None, entry.result.type
+                continue
+
+            payload = None
+            for content in entry.result.message.content:
+                if content.type == 'tool_use':
+                    payload = content.input
+                    break
+                if content.type == 'text' and payload is None:
+                    payload = _parse_text_payload(content.text)
+            yield entry.custom_id, payload, None if payload is not None else 'empty response'
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    OpenAI Batch API over the chat completions endpoint. Anthropic-style tool definitions
+    (name, description, input_schema) are converted to function tools.
+    """
+    endpoint = '/v1/chat/completions'
+    max_requests = 50_000
+    max_bytes = 200 * 1024 * 1024
+
+    def build_request(self, custom_id, model_name, prompt, tools=None, max_tokens=1000):
+        body = {
+            "model": model_name,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt_text(prompt)}],
+        }
+        if tools:
+            body["tools"] = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": tool["name"],
+                        "description": tool.get("description", ""),
+                        "parameters": tool.get("input_schema", {"type": "object"}),
+                    },
+                }
+                for tool in tools
+            ]
+            body["tool_choice"] = "required"
+        return {"custom_id": custom_id, "method": "POST", "url": self.endpoint, "body": body}
+
+    def submit(self, input_path, model_name):
+        client = get_client('openai', model_name)
+        with open(input_path, 'rb') as input_file:
+            uploaded = client.files.create(file=input_file, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=uploaded.id, endpoint=self.endpoint, completion_window='24h'
+        )
+        return batch.id
+
+    def poll(self, batch_id, model_name):
+        status = get_client('openai', model_name).batches.retrieve(batch_id).status
+        if status == 'completed':
+            return COMPLETED
+        if status in ('failed', 'expired', 'cancelled'):
+            return FAILED
+        return IN_PROGRESS
+
+    def iter_results(self, batch_id, model_name):
+        client = get_client('openai', model_name)
+        batch = client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield self._parse_line(json.loads(line))
+
+    def _parse_line(self, line):
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            return line.get("custom_id"), None, str(line.get("error") or response.get("status_code"))
+
+        message = response["body"]["choices"][0]["message"]
+        tool_calls = message.get("tool_calls") or []
+        if tool_calls:
+            return line["custom_id"], _parse_text_payload(tool_calls[0]["function"]["arguments"]), None
+        return line["custom_id"], _parse_text_payload(message.get("content")), None
+
+
+class LocalFileBatchBackend(AnthropicBatchBackend):
+    """
+    File-based stand-in batch service using the Anthropic request format.
+
+    Output lines are `{"custom_id": ..., "result": payload}` or
+    `{"custom_id": ..., "error": message}`.
+    """
+    def __init__(self, root=None):
+        self.root = root or getattr(
+            settings, 'LLM_BATCH_LOCAL_DIR', os.path.join(settings.BASE_DIR, 'batch_jobs')
+        )
+
+    def _path(self, batch_id, name):
+        return os.path.join(self.root, batch_id, name)
+
+    def submit(self, input_path, model_name):
+        batch_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, batch_id), exist_ok=True)
+        shutil.copyfile(input_path, self._path(batch_id, 'input.jsonl'))
+        return batch_id
+
+    def poll(self, batch_id, model_name):
+        if os.path.exists(self._path(batch_id, 'output.jsonl')):
+            return COMPLETED
+        if os.path.exists(self._path(batch_id, 'failed')):
+            return FAILED
+        return IN_PROGRESS
+
+    def iter_results(self, batch_id, model_name):
+        with open(self._path(batch_id, 'output.jsonl'), encoding='utf-8') as output_file:
+            for line in output_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry["custom_id"], entry.get("result"), entry.get("error")
+
+    def complete(self, batch_id, responder):
+        """
+        Processes a submitted batch, playing the provider's part.
+
+        Args:
+            batch_id: Id returned by `submit`
+            responder: Function called with each request's params; returns the payload
+                or raises to mark that request as errored
+        """
+        temporary_path = self._path(batch_id, 'output.jsonl.tmp')
+        with open(self._path(batch_id, 'input.jsonl'), encoding='utf-8') as input_file, \
+                open(temporary_path, 'w', encoding='utf-8') as output_file:
+            for line in input_file:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    entry = {"custom_id": request["custom_id"], "result": responder(request["params"])}
+                except Exception as e:
+                    entry = {"custom_id": request["custom_id"], "error": str(e)}
+                output_file.write(json.dumps(entry) + "\n")
+        # Publish atomically so a concurrent poll never reads a partial file
+        os.replace(temporary_path, self._path(batch_id, 'output.jsonl'))
+
+
+class FakeBatchBackend(LocalFileBatchBackend):
+    """
+    Local batch service that completes on the first poll with the fake provider's answers.
+    """
+    def poll(self, batch_id, model_name):
+        status = super().poll(batch_id, model_name)
+        if status == IN_PROGRESS:
+            self.complete(batch_id, self.respond)
+            status = COMPLETED
+        return status
+
+    @staticmethod
+    def respond(params):
+        prompt = params['messages'][0]['content']
+        tools = params.get('tools')
+        return fake_tool_input(prompt, tools[0]) if tools else fake_text(prompt)
+
+
+def write_batch_files(requests, backend):
+    """
+    Writes requests to temporary JSONL files that each fit the backend's per-batch limits.
+    The caller submits every file and removes it.
+
+    Args:
+        requests: Iterable of request dicts, as returned by `build_request`
+        backend (BatchBackend): Backend whose `max_requests` and `max_bytes` apply
+
+    Returns:
+        list: (path, number of requests) per file
+
+    Raises:
+        ValueError: If a single request is larger than the backend's size limit
+    """
+    files = []
+    batch_file = None
+    request_count = byte_count = 0
+    try:
+        for request in requests:
+            line = (json.dumps(request) + "\n").encode('utf-8')
+            if backend.max_bytes is not None and len(line) > backend.max_bytes:
+                raise ValueError(
+                    f"Batch request {request['custom_id']} is larger than the {backend.max_bytes} bytes limit"
+                )
+            full = batch_file is None or (
+                backend.max_requests is not None and request_count >= backend.max_requests
+            ) or (
+                backend.max_bytes is not None and byte_count + len(line) > backend.max_bytes
+            )
+            if full:
+                if batch_file is not None:
+                    batch_file.close()
+                    files.append((batch_file.name, request_count))
+                batch_file = tempfile.NamedTemporaryFile('wb', suffix='.jsonl', delete=False)
+                request_count = byte_count = 0
+            batch_file.write(line)
+            request_count += 1
+            byte_count += len(line)
+        if batch_file is not None:
+            batch_file.close()
+            files.append((batch_file.name, request_count))
+    except BaseException:
+        if batch_file is not None:
+            batch_file.close()
+            os.remove(batch_file.name)
+        for path, _ in files:
+            os.remove(path)
+        raise
+    return files
+
+
+def get_batch_backend(provider_name):
+    """
+    Returns the batch backend configured for a provider.
+
+    Raises:
+        ValueError: If the provider has no batch backend
+    """
+    backends = {**DEFAULT_BATCH_BACKENDS, **getattr(settings, 'LLM_BATCH_BACKENDS', {})}
+    if provider_name not in backends:
+        raise ValueError(f"No batch backend for provider: {provider_name}")
+    return import_string(backends[provider_name])()
@@ -0,0 +1,251 @@
+"""
+Content-addressed cache for LLM responses.
+
+Responses are keyed by a SHA-256 hash of (provider, model, prompt, tools, max_tokens) and
+kept in two tiers:
+
+- a small in-process LRU dictionary, so repeated prompts inside one worker return in
+  microseconds;
+- the `LLMResponseCache` table, so results survive restarts and are shared between
+  worker processes.
+
+Both tiers honour a TTL, and the database tier is trimmed to `MAX_ENTRIES` rows by
+evicting the least recently used entries. Hit/miss counters are available through
+`get_cache_stats`.
+
+The cache is applied to every `ask_*` helper with the `cached_llm_response` decorator.
+Failed calls raise and are never cached; neither are empty responses.
+
+It is off unless `LLM_RESPONSE_CACHE['ENABLED']` is set: simulations sample the model,
+so running the same one twice is expected to give fresh answers, not replay the first run.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from simulator.models import LLMResponseCache
+from simulator.utils.llm_usage import record_usage
+from simulator.utils.prompt_segments import prompt_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SETTINGS = {
+    'ENABLED': False,
+    'TTL_SECONDS': 7 * 24 * 60 * 60,
+    'MAX_ENTRIES': 50000,
+    'MEMORY_ENTRIES': 1024,
+    'EVICTION_INTERVAL': 100,
+}
+
+def get_cache_settings():
+    """Returns the cache settings merged over the defaults."""
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, 'LLM_RESPONSE_CACHE', {})}
+
+
+def make_cache_key(provider_name, model_name, prompt, tools=None, max_tokens=None):
+    """
+    Builds the content address of an LLM request.
+
+    Returns:
+        str: Hex SHA-256 digest of the canonical JSON encoding of the request
+    """
+    payload = json.dumps(
+        [provider_name, model_name, prompt, tools, max_tokens],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(response):
+    """Returns True if the response is a successful result worth caching."""
+    if isinstance(response, dict):
+        return 'error' not in response
+    if isinstance(response, list):
+        return True
+    if isinstance(response, str):
+        return bool(response.strip())
+    return False
+
+
+class LLMResponseCacheStore:
+    """
+    Two-tier (memory + database) response store with TTL and LRU eviction.
+    """
+    def __init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def get(self, key):
+        """
+        Looks a key up in memory, then in the database.
+
+        Returns:
+            tuple: (found, response)
+        """
+        config = get_cache_settings()
+        now = timezone.now()
+        ttl = timedelta(seconds=config['TTL_SECONDS'])
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, response = entry
+                if now - created_at < ttl:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return True, response
+                del self._memory[key]
+
+        try:
+            row = LLMResponseCache.objects.filter(key=key, created_at__gt=now - ttl).first()
+            if row is not None:
+                LLMResponseCache.objects.filter(id=row.id).update(
+                    hit_count=F('hit_count') + 1,
+                    last_accessed_at=now,
+                )
+        except DatabaseError as e:
+            logger.warning("LLM response cache lookup failed: %s", e)
+            row = None
+
+        if row is None:
+            self._count('misses')
+            return False, None
+
+        self._remember(key, row.created_at, row.response, config)
+        self._count('db_hits')
+        return True, row.response
+
+    def set(self, key, provider_name, model_name, response):
+        """Stores a response in both tiers."""
+        config = get_cache_settings()
+        now = timezone.now()
+        self._remember(key, now, response, config)
+
+        try:
+            LLMResponseCache.objects.update_or_create(
+                key=key,
+                defaults={
+                    'provider_name': provider_name,
+                    'model_name': model_name,
+                    'response': response,
+                    'created_at': now,
+                    'last_accessed_at': now,
+                }
+            )
+        except DatabaseError as e:
+            logger.warning("LLM response cache write failed: %s", e)
+            return
+
+        with self._lock:
+            self.stats['writes'] += 1
+            self._writes += 1
+            run_eviction = self._writes % max(1, config['EVICTION_INTERVAL']) == 0
+
+        if run_eviction:
+            self.evict()
+
+    def _remember(self, key, created_at, response, config):
+        with self._lock:
+            self._memory[key] = (created_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > config['MEMORY_ENTRIES']:
+                self._memory.popitem(last=False)
+
+    def evict(self):
+        """
+        Deletes expired rows and trims the table to MAX_ENTRIES, least recently used first.
+
+        Returns:
+            int: Number of rows deleted
+        """
+        config = get_cache_settings()
+        cutoff = timezone.now() - timedelta(seconds=config['TTL_SECONDS'])
+        try:
+            deleted, _ = LLMResponseCache.objects.filter(created_at__lte=cutoff).delete()
+            stale_ids = list(
+                LLMResponseCache.objects.order_by('-last_accessed_at')
+                .values_list('id', flat=True)[config['MAX_ENTRIES']:]
+            )
+            if stale_ids:
+                trimmed, _ = LLMResponseCache.objects.filter(id__in=stale_ids).delete()
+                deleted += trimmed
+        except DatabaseError as e:
+            logger.warning("LLM response cache eviction failed: %s", e)
+            return 0
+
+        self._count('evictions', deleted)
+        return deleted
+
+    def clear_memory(self):
+        """Drops the in-process tier and resets the counters."""
+        with self._lock:
+            self._memory.clear()
+            self._writes = 0
+            for name in self.stats:
+                self.stats[name] = 0
+
+
+response_cache = LLMResponseCacheStore()
+
+
+def get_cache_stats():
+    """Returns a copy of the hit/miss counters, including the overall hit rate."""
+    stats = dict(response_cache.stats)
+    lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def cached_llm_response(provider_name):
+    """
+    Decorator that puts the response cache in front of an `ask_*` helper.
+
+    The wrapped function must accept `prompt` and `model_name` and may accept `tools`
+    and `max_tokens`; those arguments (with their defaults applied) form the cache key.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not get_cache_settings()['ENABLED']:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            key = make_cache_key(
+                provider_name,
+                arguments['model_name'],
+                prompt_text(arguments['prompt']),
+                arguments.get('tools'),
+                arguments.get('max_tokens'),
+            )
+
+            found, response = response_cache.get(key)
+            if found:
+                record_usage(response_cache_hits=1)
+                return response
+
+            response = func(*args, **kwargs)
+            if is_cacheable(response):
+                response_cache.set(key, provider_name, arguments['model_name'], response)
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,98 @@
+"""
+Registry of shared, long-lived LLM provider clients.
+
+Building an SDK client per call means a fresh HTTP connection pool (and TLS handshake)
+for every persona. The `ask_*` helpers instead fetch their client from this registry,
+which keeps one thread-safe client per (provider, model) for the lifetime of the process.
+Anthropic and OpenAI clients share keep-alive connections through an httpx pool sized
+by the `LLM_HTTP_POOL_SIZE` setting. SDK-level retries are disabled; retries happen in
+`simulator/utils/llm_resilience.py`, where the rate limiter and circuit breaker see them.
+"""
+import threading
+import anthropic
+import openai
+import google.generativeai as genai
+from django.conf import settings
+
+DEFAULT_HTTP_POOL_SIZE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60
+
+_clients = {}
+_clients_lock = threading.Lock()
+_gemini_configured = False
+
+
+def _build_http_client(sdk):
+    """
+    Creates a keep-alive httpx client of the configured pool size for an SDK module.
+
+    The pool limits are built with the SDK's own `Limits` class so the client always
+    matches the httpx version the SDK was built against.
+    """
+    pool_size = getattr(settings, 'LLM_HTTP_POOL_SIZE', DEFAULT_HTTP_POOL_SIZE)
+    keepalive_expiry = getattr(settings, 'LLM_HTTP_KEEPALIVE_EXPIRY', DEFAULT_KEEPALIVE_EXPIRY)
+    limits_class = type(sdk.DEFAULT_CONNECTION_LIMITS)
+    return sdk.DefaultHttpxClient(
+        limits=limits_class(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+    )
+
+
+def _build_client(provider_name, model_name):
+    global _gemini_configured
+
+    if provider_name == 'anthropic':
+        return anthropic.Anthropic(
+            api_key=settings.CLAUDE_API_KEY,
+            http_client=_build_http_client(anthropic),
+            max_retries=0
+        )
+    if provider_name == 'openai':
+        return openai.OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=_build_http_client(openai),
+            max_retries=0
+        )
+    if provider_name == 'google':
+        if not _gemini_configured:
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            _gemini_configured = True
+        return genai.GenerativeModel(model_name)
+    raise ValueError(f"Unsupported provider: {provider_name}")
+
+
+def get_client(provider_name, model_name):
+    """
+    Returns the shared client for a provider and model, creating it on first use.
+
+    Args:
+        provider_name: One of the LLMModelAndKey provider names
+        model_name: The model the client will be used with
+
+    Returns:
+        Anthropic, openai.OpenAI or genai.GenerativeModel instance
+    """
+    key = (provider_name, model_name)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _build_client(provider_name, model_name)
+            _clients[key] = client
+        return client
+
+
+def reset_clients():
+    """Closes and forgets every cached client, e.g. after API keys change."""
+    with _clients_lock:
+        for client in _clients.values():
+            close = getattr(client, 'close', None)
+            if close:
+                close()
+        _clients.clear()
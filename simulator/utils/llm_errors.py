@@ -0,0 +1,52 @@
+"""
+Exceptions raised by the `ask_*` helpers.
+
+Provider SDK errors are translated into this hierarchy by the resilience layer
+(`simulator/utils/llm_resilience.py`), so callers can tell transient failures, which
+were already retried, from requests that can never succeed.
+"""
+
+
+class LLMError(Exception):
+    """
+    Base class for failed LLM calls.
+
+    Attributes:
+        provider_name: Provider of the model that was called
+        model_name: Model that was called
+        retry_after: Seconds the provider asked us to wait, if it said so
+    """
+    retryable = False
+
+    def __init__(self, message, provider_name=None, model_name=None, retry_after=None):
+        super().__init__(message)
+        self.provider_name = provider_name
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+class LLMTimeoutError(LLMError):
+    """The call exceeded its per-request timeout or the overall deadline."""
+    retryable = True
+
+
+class LLMRateLimitError(LLMError):
+    """The provider rejected the call because a rate limit or quota was reached (429)."""
+    retryable = True
+
+
+class LLMProviderError(LLMError):
+    """The provider failed or could not be reached (5xx, overload, connection errors)."""
+    retryable = True
+
+
+class LLMRequestError(LLMError):
+    """The provider rejected the request itself (authentication, invalid parameters)."""
+
+
+class LLMResponseError(LLMError):
+    """The provider answered, but without usable content."""
+
+
+class CircuitOpenError(LLMError):
+    """The model's circuit breaker is open; the call was not attempted."""
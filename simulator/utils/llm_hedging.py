@@ -0,0 +1,186 @@
+"""
+Hedged LLM requests.
+
+A handful of slow calls dominate the end of an aggregation run. When hedging is enabled
+(`LLM_HEDGING['ENABLED']`), `ask_llm` runs each call through `hedged_call`: if the call
+has not returned after the `PERCENTILE`-th percentile of the model's recent latencies, a
+duplicate request is sent (to `SECONDARY_MODEL` if configured, otherwise to the same
+model) and whichever answer arrives first is used. The slower request is left to finish
+in the background and its answer is discarded.
+
+Hedges are only sent once `MIN_SAMPLES` latencies are known, never earlier than
+`MIN_DELAY_SECONDS`, and only while fewer than `MAX_HEDGE_RATE` of calls were hedged, so
+a provider that is slow across the board does not get twice the load. Hedge rate and
+wins per model are reported by `get_hedging_stats`.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEDGING_SETTINGS = {
+    'ENABLED': False,
+    'PERCENTILE': 95,
+    'MIN_SAMPLES': 20,
+    'WINDOW': 200,
+    'MIN_DELAY_SECONDS': 1.0,
+    'MAX_HEDGE_RATE': 0.1,
+    'SECONDARY_MODEL': None,
+    'MAX_WORKERS': 32,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_hedging_settings():
+    """Returns the hedging settings merged over the defaults."""
+    return {**DEFAULT_HEDGING_SETTINGS, **getattr(settings, 'LLM_HEDGING', {})}
+
+
+class LatencyTracker:
+    """
+    Recent successful latencies and hedging counters for one model.
+    """
+    def __init__(self, window):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile, min_samples):
+        """Returns the given percentile of recent latencies, or None with too few samples."""
+        with self._lock:
+            if len(self._latencies) < max(1, min_samples):
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def hedge_rate(self):
+        with self._lock:
+            return self.stats['hedged'] / self.stats['calls'] if self.stats['calls'] else 0.0
+
+    def snapshot(self, config):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['hedge_rate'] = round(stats['hedged'] / stats['calls'], 4) if stats['calls'] else 0.0
+        stats['hedge_win_rate'] = round(stats['hedge_wins'] / stats['hedged'], 4) if stats['hedged'] else 0.0
+        stats['hedge_delay'] = self.percentile(config['PERCENTILE'], config['MIN_SAMPLES'])
+        return stats
+
+
+def get_tracker(model_key):
+    """Returns the latency tracker for a (provider, model) key."""
+    with _trackers_lock:
+        tracker = _trackers.get(model_key)
+        if tracker is None:
+            tracker = LatencyTracker(get_hedging_settings()['WINDOW'])
+            _trackers[model_key] = tracker
+        return tracker
+
+
+def get_hedging_stats():
+    """Returns the hedging counters per 'provider/model'."""
+    config = get_hedging_settings()
+    with _trackers_lock:
+        trackers = dict(_trackers)
+    return {f"{provider}/{model}": tracker.snapshot(config) for (provider, model), tracker in trackers.items()}
+
+
+def reset_hedging():
+    """Forgets all latency samples and counters."""
+    with _trackers_lock:
+        _trackers.clear()
+
+
+def _get_executor(config):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config['MAX_WORKERS'], thread_name_prefix='llm-hedge')
+        return _executor
+
+
+def _timed(call, model):
+    started = time.monotonic()
+    try:
+        return call(model), time.monotonic() - started
+    finally:
+        # Pool threads get their own DB connections (e.g. for the response cache)
+        connections.close_all()
+
+
+def hedged_call(primary, secondary, call):
+    """
+    Runs `call(primary)` and hedges it with `call(secondary)` if it is slow.
+
+    Args:
+        primary: LLMModelAndKey to call first
+        secondary: LLMModelAndKey for the hedge request (may be the primary)
+        call: Function taking a model and performing the request
+
+    Returns:
+        The first successful answer
+
+    Raises:
+        The primary's exception if every request sent failed
+    """
+    config = get_hedging_settings()
+    tracker = get_tracker((primary.provider_name, primary.model_name))
+    tracker.count('calls')
+
+    delay = tracker.percentile(config['PERCENTILE'], config['MIN_SAMPLES'])
+    if delay is None or tracker.hedge_rate() >= config['MAX_HEDGE_RATE']:
+        # No hedge possible: call inline
+        started = time.monotonic()
+        result = call(primary)
+        tracker.record(time.monotonic() - started)
+        return result
+
+    # Run in a copy of this context so job-level state (e.g. the usage meter) is kept
+    executor = _get_executor(config)
+    primary_future = executor.submit(copy_context().run, _timed, call, primary)
+    delay = max(delay, config['MIN_DELAY_SECONDS'])
+    done, _ = wait([primary_future], timeout=delay)
+    if done:
+        result, latency = primary_future.result()
+        tracker.record(latency)
+        return result
+
+    tracker.count('hedged')
+    hedge_future = executor.submit(copy_context().run, _timed, call, secondary)
+    # Keep the slow primary's latency in the window even if the hedge wins
+    primary_future.add_done_callback(
+        lambda future: future.exception() is None and tracker.record(future.result()[1])
+    )
+    logger.info(
+        "Hedging %s/%s call after %.1fs", primary.provider_name, primary.model_name, delay
+    )
+
+    pending = {primary_future, hedge_future}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in (primary_future, hedge_future):
+            if future not in done or future.exception() is not None:
+                continue
+            if future is hedge_future:
+                tracker.count('hedge_wins')
+            return future.result()[0]
+
+    raise primary_future.exception()
@@ -0,0 +1,227 @@
+"""
+Timeouts, retries and circuit breaking for LLM calls.
+
+`resilient_llm_call` wraps each `ask_*` helper (inside the response cache, so cache hits
+never touch it):
+
+- every attempt gets a `timeout` of at most `REQUEST_TIMEOUT` seconds, and all attempts
+  together must finish within `DEADLINE` seconds, waits for the provider's rate limiter
+  included (a call the limiter does not admit in time fails with `LLMTimeoutError`);
+- retryable failures (timeouts, 429s, 5xx and connection errors) are retried up to
+  `MAX_ATTEMPTS` times with full-jitter exponential backoff, honouring `retry-after`;
+- a circuit breaker per provider/model opens after `BREAKER_FAILURE_THRESHOLD`
+  consecutive timeouts or provider errors and fails calls fast with `CircuitOpenError`
+  for `BREAKER_RESET_SECONDS`, after which a single trial call decides whether it closes.
+
+Failures are raised as the typed exceptions from `simulator/utils/llm_errors.py`.
+Settings come from `LLM_RESILIENCE`.
+"""
+import inspect
+import logging
+import random
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from simulator.utils.llm_errors import (
+    CircuitOpenError,
+    LLMError,
+    LLMProviderError,
+    LLMRateLimitError,
+    LLMRequestError,
+    LLMTimeoutError,
+)
+from simulator.utils.provider_limits import ProviderWaitTimeout, call_deadline, get_retry_after
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESILIENCE_SETTINGS = {
+    'REQUEST_TIMEOUT': 60,
+    'DEADLINE': 180,
+    'MAX_ATTEMPTS': 4,
+    'BACKOFF_BASE': 1.0,
+    'BACKOFF_MAX': 20.0,
+    'BREAKER_FAILURE_THRESHOLD': 5,
+    'BREAKER_RESET_SECONDS': 30,
+}
+
+TIMEOUT_ERROR_NAMES = ('APITimeoutError', 'Timeout', 'ReadTimeout', 'DeadlineExceeded')
+CONNECTION_ERROR_NAMES = ('APIConnectionError', 'ConnectError', 'ServiceUnavailable', 'InternalServerError')
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_resilience_settings():
+    """Returns the resilience settings merged over the defaults."""
+    return {**DEFAULT_RESILIENCE_SETTINGS, **getattr(settings, 'LLM_RESILIENCE', {})}
+
+
+def classify_error(error, provider_name, model_name):
+    """
+    Translates an exception raised by a provider SDK into an LLMError.
+
+    Returns:
+        LLMError: The matching typed error (the error itself if it already is one)
+    """
+    if isinstance(error, LLMError):
+        return error
+
+    name = type(error).__name__
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    details = dict(provider_name=provider_name, model_name=model_name, retry_after=get_retry_after(error))
+    message = f"{provider_name}/{model_name}: {error}"
+
+    if isinstance(error, TimeoutError) or name in TIMEOUT_ERROR_NAMES:
+        return LLMTimeoutError(message, **details)
+    if status == 429 or name in ('RateLimitError', 'ResourceExhausted'):
+        return LLMRateLimitError(message, **details)
+    if (status is not None and status >= 500) or name in CONNECTION_ERROR_NAMES or isinstance(error, ConnectionError):
+        return LLMProviderError(message, **details)
+    if status is not None:
+        return LLMRequestError(message, **details)
+    return LLMError(message, **details)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one provider/model.
+
+    Only timeouts and provider errors count as failures; any other answer from the
+    provider (including 429s and rejected requests) shows it is reachable.
+    """
+    def __init__(self, name, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self._clock() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError unless the call may go ahead. While half-open only one
+        trial call is let through.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        raise CircuitOpenError(f"Circuit open for {self.name}; not calling the provider")
+
+    def cancel(self):
+        """Forgets a call let through by `before_call` that never reached the provider."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, error=None):
+        """Records the outcome of a call let through by `before_call`."""
+        with self._lock:
+            self._trial_in_flight = False
+            if not isinstance(error, (LLMTimeoutError, LLMProviderError)):
+                self.failures = 0
+                self.opened_at = None
+                return
+
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error("Opening circuit for %s after %d consecutive failures", self.name, self.failures)
+                self.opened_at = self._clock()
+
+
+def get_breaker(provider_name, model_name):
+    """Returns the process-wide circuit breaker for a provider/model."""
+    key = (provider_name, model_name)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            config = get_resilience_settings()
+            breaker = CircuitBreaker(
+                f"{provider_name}/{model_name}",
+                config['BREAKER_FAILURE_THRESHOLD'],
+                config['BREAKER_RESET_SECONDS'],
+            )
+            _breakers[key] = breaker
+        return breaker
+
+
+def reset_breakers():
+    """Forgets all circuit breakers."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def backoff_delay(attempt, config, retry_after=None):
+    """Full-jitter exponential backoff for the given (0-based) retry, at least retry_after."""
+    ceiling = min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * (2 ** attempt))
+    return max(random.uniform(0, ceiling), retry_after or 0)
+
+
+def resilient_llm_call(provider_name):
+    """
+    Decorator adding timeouts, retries and circuit breaking to an `ask_*` helper.
+
+    The wrapped function must accept `model_name` and a `timeout` keyword argument, and
+    let provider exceptions propagate.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            config = get_resilience_settings()
+            model_name = signature.bind(*args, **kwargs).arguments['model_name']
+            breaker = get_breaker(provider_name, model_name)
+            deadline = time.monotonic() + config['DEADLINE']
+            attempts = max(1, config['MAX_ATTEMPTS'])
+
+            for attempt in range(attempts):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMTimeoutError(
+                        f"{provider_name}/{model_name}: deadline of {config['DEADLINE']}s exceeded",
+                        provider_name=provider_name, model_name=model_name
+                    )
+
+                breaker.before_call()
+                try:
+                    with call_deadline(deadline):
+                        result = func(*args, **{**kwargs, 'timeout': min(config['REQUEST_TIMEOUT'], remaining)})
+                except ProviderWaitTimeout as e:
+                    # Throttled locally until the deadline: says nothing about the provider's health
+                    breaker.cancel()
+                    raise classify_error(e, provider_name, model_name) from e
+                except Exception as e:
+                    error = classify_error(e, provider_name, model_name)
+                    breaker.record(error)
+                    delay = backoff_delay(attempt, config, error.retry_after)
+                    if (not error.retryable or attempt == attempts - 1
+                            or time.monotonic() + delay >= deadline):
+                        raise error from e
+                    logger.warning(
+                        "%s (attempt %d/%d), retrying in %.1fs", error, attempt + 1, attempts, delay
+                    )
+                    time.sleep(delay)
+                    continue
+
+                breaker.record()
+                return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,111 @@
+"""
+Per-job accounting of LLM token usage.
+
+A job (e.g. one aggregation run) opens a `UsageMeter` with `metered(...)`; every `ask_*`
+helper called while it is active reports the provider's usage numbers through
+`record_usage`. The active meter lives in a context variable, so worker pools must run
+their tasks in a copy of the submitting context (`contextvars.copy_context().run`).
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+
+USAGE_FIELDS = (
+    'requests',
+    'input_tokens',
+    'output_tokens',
+    'cache_read_input_tokens',
+    'cache_creation_input_tokens',
+    'response_cache_hits',
+)
+
+_current_meter = contextvars.ContextVar('llm_usage_meter', default=None)
+
+
+class UsageMeter:
+    """
+    Thread-safe token usage counters for one job.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(USAGE_FIELDS, 0)
+
+    def add(self, **counts):
+        """Adds the given counts; unknown or empty values are ignored."""
+        with self._lock:
+            for name, value in counts.items():
+                if name in self._counts and value:
+                    self._counts[name] += int(value)
+
+    def snapshot(self):
+        """Returns the counters plus the share of input tokens read from the provider cache."""
+        with self._lock:
+            counts = dict(self._counts)
+        total_input = (
+            counts['input_tokens'] + counts['cache_read_input_tokens'] + counts['cache_creation_input_tokens']
+        )
+        counts['cache_read_ratio'] = (
+            round(counts['cache_read_input_tokens'] / total_input, 4) if total_input else 0.0
+        )
+        return counts
+
+
+@contextmanager
+def metered(meter=None):
+    """Makes a UsageMeter the active meter for the duration of the `with` block."""
+    meter = meter or UsageMeter()
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def record_usage(**counts):
+    """Adds usage counts to the active meter, if any."""
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(**counts)
+
+
+def record_anthropic_usage(message):
+    """Records the usage block of an Anthropic message."""
+    usage = getattr(message, 'usage', None)
+    if usage is None:
+        return
+    record_usage(
+        requests=1,
+        input_tokens=getattr(usage, 'input_tokens', 0),
+        output_tokens=getattr(usage, 'output_tokens', 0),
+        cache_read_input_tokens=getattr(usage, 'cache_read_input_tokens', 0),
+        cache_creation_input_tokens=getattr(usage, 'cache_creation_input_tokens', 0),
+    )
+
+
+def record_openai_usage(response):
+    """Records the usage block of an OpenAI chat completion."""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+    record_usage(
+        requests=1,
+        input_tokens=(getattr(usage, 'prompt_tokens', 0) or 0) - cached_tokens,
+        output_tokens=getattr(usage, 'completion_tokens', 0),
+        cache_read_input_tokens=cached_tokens,
+    )
+
+
+def record_gemini_usage(response):
+    """Records the usage metadata of a Gemini response."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    cached_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+    record_usage(
+        requests=1,
+        input_tokens=(getattr(usage, 'prompt_token_count', 0) or 0) - cached_tokens,
+        output_tokens=getattr(usage, 'candidates_token_count', 0),
+        cache_read_input_tokens=cached_tokens,
+    )
@@ -0,0 +1,99 @@
+"""
+Splitting of rendered prompts into a shared, cacheable prefix and a per-request suffix.
+
+Within one aggregation run every persona prompt renders the same template instructions,
+news title and possible responses; only the persona block changes. `render_segments`
+renders a template in two parts, cutting at the first per-request placeholder, so
+providers with prompt caching can reuse the prefix:
+
+- Anthropic: the prefix is sent as its own content block carrying a `cache_control`
+  marker (see `to_anthropic_content`).
+- OpenAI and Gemini cache identical prompt prefixes automatically; they receive the
+  joined text, which keeps the shared part first.
+
+Templates get the most out of this when `{persona_details}` is their last placeholder.
+"""
+from collections import namedtuple
+from string import Formatter
+
+_formatter = Formatter()
+
+
+class PromptSegments(namedtuple('PromptSegments', ['prefix', 'suffix'])):
+    """
+    A rendered prompt made of a stable prefix and a per-request suffix.
+    """
+    __slots__ = ()
+
+    @property
+    def text(self):
+        """The full prompt text."""
+        return self.prefix + self.suffix
+
+    def __str__(self):
+        return self.text
+
+    def with_prefix(self, text):
+        """Returns a copy with text prepended to the shared prefix."""
+        return PromptSegments(text + self.prefix, self.suffix)
+
+
+def prompt_text(prompt):
+    """Returns the plain text of a prompt given as a string or PromptSegments."""
+    return prompt.text if isinstance(prompt, PromptSegments) else prompt
+
+
+def render_segments(template, dynamic_fields, **values):
+    """
+    Renders a str.format template, splitting the output before the first dynamic field.
+
+    Args:
+        template: Template text with {placeholders}
+        dynamic_fields: Names of the placeholders that change between requests
+        **values: Values for every placeholder
+
+    Returns:
+        PromptSegments: Everything before the first dynamic placeholder as the prefix,
+        the rest as the suffix
+
+    Raises:
+        KeyError: If a placeholder has no value, like str.format
+    """
+    prefix_parts, suffix_parts = [], []
+    parts = prefix_parts
+
+    for literal, field_name, format_spec, conversion in _formatter.parse(template):
+        parts.append(literal)
+        if field_name is None:
+            continue
+
+        if field_name.split('.')[0].split('[')[0] in dynamic_fields:
+            parts = suffix_parts
+
+        value, _ = _formatter.get_field(field_name, (), values)
+        value = _formatter.convert_field(value, conversion)
+        parts.append(_formatter.format_field(value, format_spec or ''))
+
+    return PromptSegments(''.join(prefix_parts), ''.join(suffix_parts))
+
+
+def to_anthropic_content(prompt):
+    """
+    Builds the user message content for the Anthropic messages API.
+
+    A PromptSegments prompt with a non-empty prefix becomes two text blocks, the first
+    marked with an ephemeral cache breakpoint; plain strings are passed through.
+    """
+    if not isinstance(prompt, PromptSegments):
+        return prompt
+    if not prompt.prefix:
+        return prompt.suffix
+
+    content = [{
+        "type": "text",
+        "text": prompt.prefix,
+        "cache_control": {"type": "ephemeral"},
+    }]
+    if prompt.suffix:
+        content.append({"type": "text", "text": prompt.suffix})
+    return content
@@ -0,0 +1,330 @@
+"""
+Adaptive per-provider rate limiting for outbound LLM calls.
+
+Every `ask_*` helper wraps its network call in `provider_slot`, so the aggregation
+worker, the persona generation worker and the optimization views all share one
+in-process limiter per provider. Each limiter combines:
+
+- token buckets for requests per minute and tokens per minute
+  (`LLM_PROVIDER_RATE_LIMITS`, 0 disables a bucket);
+- an AIMD concurrency limit: it starts at half of `LLM_PROVIDER_CONCURRENCY`, grows by
+  one slot per window of successful calls and is halved when the provider answers with
+  a rate-limit or overload error (429/503/529). A `retry-after` hint from the provider
+  pauses new calls for that long.
+
+Calls made under `call_deadline` (as `resilient_llm_call` does) wait for the limiter at
+most until that deadline, then fail with `ProviderWaitTimeout`.
+
+`get_limiter_stats` reports the current limit and throttling counters per provider.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from simulator.utils.prompt_segments import prompt_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDER_CONCURRENCY = 8
+# Minimum time between two multiplicative decreases, so one burst of 429s from the
+# calls already in flight only halves the limit once
+DECREASE_INTERVAL_SECONDS = 1.0
+OVERLOAD_STATUS_CODES = (429, 503, 529)
+OVERLOAD_ERROR_NAMES = ('RateLimitError', 'OverloadedError', 'ResourceExhausted', 'ServiceUnavailable')
+# Rough characters-per-token ratio used to estimate request sizes without a tokenizer
+CHARS_PER_TOKEN = 4
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+# time.monotonic() by which the current call must have started, or None
+_call_deadline = contextvars.ContextVar('llm_call_deadline', default=None)
+
+
+class ProviderWaitTimeout(TimeoutError):
+    """The limiter did not admit the call before its deadline; the provider was not called."""
+
+
+def get_provider_concurrency(provider_name):
+    """Returns the configured maximum number of in-flight calls for a provider."""
+    limits = getattr(settings, 'LLM_PROVIDER_CONCURRENCY', {}) or {}
+    return max(1, int(limits.get(provider_name, DEFAULT_PROVIDER_CONCURRENCY)))
+
+
+def get_provider_rate_limits(provider_name):
+    """Returns the (requests per minute, tokens per minute) limits of a provider; 0 means unlimited."""
+    limits = (getattr(settings, 'LLM_PROVIDER_RATE_LIMITS', {}) or {}).get(provider_name, {})
+    return int(limits.get('REQUESTS_PER_MINUTE', 0)), int(limits.get('TOKENS_PER_MINUTE', 0))
+
+
+def estimate_tokens(text):
+    """
+    Approximates the token count of a text.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_request_tokens(prompt, max_tokens=None):
+    """Approximates the tokens a request counts against a tokens-per-minute limit."""
+    return estimate_tokens(prompt_text(prompt)) + (max_tokens or 0)
+
+
+def is_overload_error(error):
+    """Returns True if an SDK exception means the provider is rate limiting or overloaded."""
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    return status in OVERLOAD_STATUS_CODES or type(error).__name__ in OVERLOAD_ERROR_NAMES
+
+
+def get_retry_after(error):
+    """Returns the provider's retry-after hint in seconds, or None."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute.
+
+    `reserve` always takes the tokens, letting the bucket go into debt, and returns how
+    long the caller has to wait before its share is actually available. Callers are
+    therefore served in the order they reserved.
+    """
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.fill_rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        Takes `amount` tokens (capped at the bucket size).
+
+        Returns:
+            float: Seconds to wait before proceeding
+        """
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.fill_rate)
+            self._updated_at = now
+            self.tokens -= min(float(amount), self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.fill_rate
+
+    def refund(self, amount):
+        """Gives back tokens taken by `reserve` for a call that was not made."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(float(amount), self.capacity))
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Concurrency limit adjusted by additive increase / multiplicative decrease.
+    """
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, decrease_factor=0.5, clock=time.monotonic):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(initial_limit or max_limit)
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._clock = clock
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Blocks until fewer than `limit` calls are in flight, or for at most `timeout` seconds.
+
+        Returns:
+            bool: False if the timeout passed without a free slot
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - self._clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, success=False, overloaded=False):
+        """
+        Frees a slot and adjusts the limit: +1 per `limit` successes, halved on overload.
+        Other failures leave the limit unchanged.
+
+        Returns:
+            bool: True if the limit was decreased
+        """
+        decreased = False
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                now = self._clock()
+                if self._last_decrease is None or now - self._last_decrease >= DECREASE_INTERVAL_SECONDS:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    decreased = True
+            elif success:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+        return decreased
+
+
+class ProviderLimiter:
+    """
+    Request/token buckets plus adaptive concurrency for one provider.
+    """
+    def __init__(self, provider_name, max_concurrency, requests_per_minute=0, tokens_per_minute=0):
+        self.provider_name = provider_name
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            max_concurrency, initial_limit=max(1, (max_concurrency + 1) // 2)
+        )
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'overloads': 0, 'decreases': 0, 'wait_seconds': 0.0, 'timeouts': 0}
+
+    def acquire(self, tokens=0, deadline=None):
+        """
+        Blocks until the call may start: concurrency slot first, then bucket capacity.
+
+        Args:
+            tokens: Estimated tokens of the request
+            deadline: time.monotonic() by which the call must start; None waits as long
+                as needed
+
+        Raises:
+            ProviderWaitTimeout: If the call could not start before the deadline. Nothing
+                is held or consumed then.
+        """
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not self.concurrency.acquire(timeout):
+            self._wait_timed_out()
+
+        wait_seconds = max(0.0, self._paused_until - time.monotonic())
+        if self.request_bucket is not None:
+            wait_seconds = max(wait_seconds, self.request_bucket.reserve(1))
+        if self.token_bucket is not None and tokens:
+            wait_seconds = max(wait_seconds, self.token_bucket.reserve(tokens))
+
+        if deadline is not None and time.monotonic() + wait_seconds > deadline:
+            if self.request_bucket is not None:
+                self.request_bucket.refund(1)
+            if self.token_bucket is not None and tokens:
+                self.token_bucket.refund(tokens)
+            self.concurrency.release()
+            self._wait_timed_out()
+
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['wait_seconds'] += wait_seconds
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    def _wait_timed_out(self):
+        with self._lock:
+            self.stats['timeouts'] += 1
+        raise ProviderWaitTimeout(f"{self.provider_name}: rate limiter did not admit the call before its deadline")
+
+    def release(self, error=None):
+        """Frees the concurrency slot and feeds the call's outcome back into the limit."""
+        overloaded = error is not None and is_overload_error(error)
+        decreased = self.concurrency.release(success=error is None, overloaded=overloaded)
+        if not overloaded:
+            return
+
+        retry_after = get_retry_after(error)
+        with self._lock:
+            self.stats['overloads'] += 1
+            self.stats['decreases'] += int(decreased)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        if decreased:
+            logger.warning(
+                "%s is throttling requests; concurrency limit lowered to %d",
+                self.provider_name, int(self.concurrency.limit)
+            )
+
+    def snapshot(self):
+        """Returns the current limit and counters."""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['concurrency_limit'] = int(self.concurrency.limit)
+        stats['in_flight'] = self.concurrency.in_flight
+        return stats
+
+
+def get_limiter(provider_name):
+    """Returns the process-wide limiter for a provider, creating it from settings on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider_name)
+        if limiter is None:
+            requests_per_minute, tokens_per_minute = get_provider_rate_limits(provider_name)
+            limiter = ProviderLimiter(
+                provider_name,
+                get_provider_concurrency(provider_name),
+                requests_per_minute,
+                tokens_per_minute,
+            )
+            _limiters[provider_name] = limiter
+        return limiter
+
+
+def get_limiter_stats():
+    """Returns a snapshot of every provider limiter created so far."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
+
+
+def reset_limiters():
+    """Drops all limiters so they are rebuilt from the current settings."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+@contextmanager
+def call_deadline(deadline):
+    """
+    Bounds the limiter waits of the calls made inside the `with` block.
+
+    Args:
+        deadline: time.monotonic() by which those calls must have started
+    """
+    token = _call_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _call_deadline.reset(token)
+
+
+@contextmanager
+def provider_slot(provider_name, tokens=0):
+    """
+    Blocks until the provider's limiter admits a call and holds the slot for the duration
+    of the `with` block. Exceptions raised inside the block are reported to the limiter
+    and re-raised.
+
+    Args:
+        provider_name: Provider of the model being called
+        tokens: Estimated tokens of the request (see `estimate_request_tokens`)
+
+    Raises:
+        ProviderWaitTimeout: If the enclosing `call_deadline` passes before the call is admitted
+    """
+    limiter = get_limiter(provider_name)
+    limiter.acquire(tokens, _call_deadline.get())
+    try:
+        yield
+    except Exception as e:
+        limiter.release(e)
+        raise
+    limiter.release()
@@ -0,0 +1,114 @@
+"""
+Buffered write path for the results of an aggregation run.
+
+Writing every persona's EmotionalResponse on its own, then bumping and re-reading the
+AggregateEmotion progress counter, costs three round-trips per persona and makes every
+worker contend for the same row. `EmotionalResponseWriter` buffers the rows and writes
+them with one `bulk_create` plus one counter update whenever `flush_rows` rows are
+pending or `flush_seconds` have passed since the last flush.
+
+Pending rows are flushed when the writer is closed, when its `with` block exits (also
+on errors) and, for writers still open at interpreter shutdown, from an atexit hook.
+An `on_flush` callback runs after every flush, e.g. to publish partial summaries.
+Once the `lease_lost` event of the run's job is set, pending rows are dropped instead:
+another worker has claimed the aggregation and writes its own.
+"""
+import atexit
+import logging
+import threading
+import time
+import weakref
+from django.conf import settings
+from django.db.models import F
+from simulator.models import AggregateEmotion, EmotionalResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_ROWS = 200
+DEFAULT_FLUSH_SECONDS = 2.0
+
+_open_writers = weakref.WeakSet()
+
+
+class EmotionalResponseWriter:
+    """
+    Buffers EmotionalResponse rows of one aggregation and writes them in bulk.
+    """
+    def __init__(self, aggregate_emotion_id, flush_rows=None, flush_seconds=None, on_flush=None,
+                 clock=time.monotonic, lease_lost=None):
+        self.aggregate_emotion_id = aggregate_emotion_id
+        self.on_flush = on_flush
+        self.lease_lost = lease_lost
+        self.flush_rows = flush_rows or getattr(settings, 'AGGREGATION_FLUSH_ROWS', DEFAULT_FLUSH_ROWS)
+        self.flush_seconds = (
+            flush_seconds if flush_seconds is not None
+            else getattr(settings, 'AGGREGATION_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+        )
+        self.written = 0
+        self._buffer = []
+        self._clock = clock
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+        _open_writers.add(self)
+
+    def add(self, response):
+        """Queues an unsaved EmotionalResponse, flushing if the size or time limit is reached."""
+        with self._lock:
+            self._buffer.append(response)
+            if (len(self._buffer) >= self.flush_rows
+                    or self._clock() - self._last_flush >= self.flush_seconds):
+                self._flush()
+
+    def flush(self):
+        """Writes all pending rows and advances the progress counter."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = self._clock()
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        if self.lease_lost is not None and self.lease_lost.is_set():
+            logger.warning("Dropped %d responses of aggregation %s: its job was claimed by another worker",
+                           len(rows), self.aggregate_emotion_id)
+            return
+        EmotionalResponse.objects.bulk_create(rows)
+        AggregateEmotion.objects.filter(id=self.aggregate_emotion_id).update(
+            processed_responses=F('processed_responses') + len(rows)
+        )
+        self.written += len(rows)
+        if self.on_flush is not None:
+            try:
+                self.on_flush(self.written)
+            except Exception as e:
+                # Progress reporting must not lose the rows or stop the run
+                logger.error("Flush callback of aggregation %s failed: %s", self.aggregate_emotion_id, e)
+
+    def close(self):
+        """Flushes the pending rows; the writer is not used afterwards."""
+        _open_writers.discard(self)
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.close()
+        except Exception as flush_error:
+            if exc is None:
+                raise
+            # Don't hide the error that ended the run
+            logger.error("Could not flush pending responses: %s", flush_error)
+        return False
+
+
+@atexit.register
+def flush_open_writers():
+    """Flushes writers still open when the process exits."""
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception as e:
+            logger.error("Could not flush responses of aggregation %s: %s", writer.aggregate_emotion_id, e)
@@ -0,0 +1,168 @@
+"""
+Stratified sampling for aggregations of large populations.
+
+The response distribution of a city is usually known to within a few points long
+before every persona has answered. In 'sample' mode the aggregation worker evaluates
+personas in the order of a `StratifiedSample` and stops once the confidence intervals
+are narrow enough or its budget is spent:
+
+- strata are the subcategory combinations of the personas (read from the city's
+  DemographicIndex). Personas are ordered so that every prefix of the order holds each
+  stratum in proportion to its size, i.e. any number of rounds yields a proportionally
+  allocated stratified random sample;
+- intervals are Wilson score intervals with the finite population correction. Under
+  proportional allocation the simple random sampling variance bounds the stratified
+  one, so the intervals are conservative;
+- estimated counts are the sampled proportions scaled to the population (overall) or
+  to the subcategory's size (demographics).
+
+Settings come from the AGGREGATION_SAMPLING dict, merged over DEFAULT_SAMPLING_SETTINGS.
+"""
+from statistics import NormalDist
+import numpy as np
+from django.conf import settings
+
+DEFAULT_SAMPLING_SETTINGS = {
+    # Confidence level of the reported intervals
+    'CONFIDENCE': 0.95,
+    # Stop once every overall interval is at most this wide on each side (a proportion)
+    'MARGIN': 0.02,
+    # Maximum number of personas evaluated
+    'BUDGET': 5000,
+    # Personas evaluated between two interval checks
+    'ROUND_SIZE': 200,
+}
+
+STOPPED_MARGIN = 'margin'
+STOPPED_BUDGET = 'budget'
+STOPPED_POPULATION = 'population'
+
+
+def get_sampling_settings():
+    """Returns the sampling settings merged over the defaults."""
+    return {**DEFAULT_SAMPLING_SETTINGS, **getattr(settings, 'AGGREGATION_SAMPLING', {})}
+
+
+def wilson_interval(counts, sample_size, population, confidence):
+    """
+    Wilson score intervals of the proportions counts / sample_size, with the finite
+    population correction.
+
+    Returns:
+        tuple: (low, high) arrays of proportions
+    """
+    proportions = np.asarray(counts, dtype=np.float64) / sample_size
+    if sample_size >= population:
+        # Everyone answered: the proportions are exact
+        return proportions, proportions
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    effective_size = sample_size * (population - 1) / (population - sample_size)
+    denominator = 1 + z ** 2 / effective_size
+    centre = (proportions + z ** 2 / (2 * effective_size)) / denominator
+    half_width = z * np.sqrt(
+        proportions * (1 - proportions) / effective_size + z ** 2 / (4 * effective_size ** 2)
+    ) / denominator
+    return np.clip(centre - half_width, 0, 1), np.clip(centre + half_width, 0, 1)
+
+
+def annotate_estimates(responses, population, confidence):
+    """
+    Adds "estimated_count", "ci_low" and "ci_high" (percentages) to the entries of one
+    summary group ({response id: {"count", ...}}).
+
+    Returns:
+        float: The largest half-width of the group's intervals, 1.0 without answers
+    """
+    entries = list(responses.values())
+    counts = [entry['count'] for entry in entries]
+    sample_size = sum(counts)
+    if not sample_size:
+        return 1.0
+
+    low, high = wilson_interval(counts, sample_size, max(population, sample_size), confidence)
+    for entry, count, entry_low, entry_high in zip(entries, counts, low.tolist(), high.tolist()):
+        entry['estimated_count'] = int(round(count / sample_size * population))
+        entry['ci_low'] = round(entry_low * 100, 2)
+        entry['ci_high'] = round(entry_high * 100, 2)
+    return float(np.max(high - low) / 2)
+
+
+class StratifiedSample:
+    """
+    Evaluation order of a population, stratified by subcategory combination.
+
+    Args:
+        persona_ids: The personas of the population
+        demographic_index: DemographicIndex of their city
+        seed: Seed of the random order; the same seed gives the same order, so a
+            resumed aggregation continues the same sample
+    """
+    def __init__(self, persona_ids, demographic_index, seed=None):
+        persona_ids = np.asarray(sorted(persona_ids), dtype=np.int64)
+        self.population = len(persona_ids)
+        self.drawn = 0
+
+        strata = demographic_index.subcategory_sets(persona_ids)
+
+        # Rank i of a stratum of size n gets (i + u) / n: sorting by rank interleaves
+        # the strata proportionally to their sizes
+        rng = np.random.default_rng(seed)
+        members = {}
+        for persona_id, stratum in zip(persona_ids.tolist(), strata):
+            members.setdefault(stratum, []).append(persona_id)
+        ids, ranks = [], []
+        for stratum_ids in members.values():
+            size = len(stratum_ids)
+            ids.extend(rng.permutation(stratum_ids).tolist())
+            ranks.append((np.arange(size) + rng.random()) / size)
+        ranks = np.concatenate(ranks) if ranks else np.zeros(0)
+        self.order = np.asarray(ids, dtype=np.int64)[np.argsort(ranks, kind='stable')]
+
+        # Sizes of the subcategories, keyed like the demographic summary
+        self.subcategory_populations = {}
+        for stratum, stratum_ids in members.items():
+            for code in stratum:
+                key = (
+                    demographic_index.category_names[demographic_index.subcategory_categories[code]],
+                    demographic_index.subcategory_names[code].lower()
+                )
+                self.subcategory_populations[key] = self.subcategory_populations.get(key, 0) + len(stratum_ids)
+
+    @property
+    def exhausted(self):
+        return self.drawn >= self.population
+
+    def next_round(self, size, answered_ids=()):
+        """
+        Draws the next personas of the order, skipping those that already answered
+        (in an earlier, interrupted run). Skipped personas count as drawn.
+
+        Returns:
+            list: Up to `size` persona ids to evaluate
+        """
+        answered_ids = set(answered_ids)
+        selected = []
+        while self.drawn < self.population and len(selected) < size:
+            persona_id = int(self.order[self.drawn])
+            self.drawn += 1
+            if persona_id not in answered_ids:
+                selected.append(persona_id)
+        return selected
+
+    def estimate(self, response_summary, demographic_summary, confidence):
+        """
+        Annotates both summaries with estimated counts and confidence intervals.
+
+        Returns:
+            float: The largest half-width of the overall intervals
+        """
+        margin = annotate_estimates(response_summary, self.population, confidence)
+        for category_name, subcategories in demographic_summary.items():
+            for subcategory_name, responses in subcategories.items():
+                annotate_estimates(
+                    responses,
+                    self.subcategory_populations.get((category_name, subcategory_name), 0),
+                    confidence
+                )
+        return margin
@@ -0,0 +1,115 @@
+"""
+In-memory category/subcategory resolution for CSV imports.
+
+Every cell of a CSV upload names a subcategory (the value) of a category (the column).
+Resolving them with get_or_create costs two queries per cell, and recomputing a
+category's percentages whenever one of its subcategories is created makes an import
+quadratic in its number of values (and racy across import threads). Instead:
+
+- `SubCategoryResolver` loads the city's categories and subcategories once per task into
+  a dictionary keyed by (category name, subcategory name); `add_missing` bulk-creates the
+  ones a chunk introduces, ignoring conflicts with a concurrent import of the same city;
+- `recompute_subcategory_percentages` sets the percentages of the imported categories
+  from a single GROUP BY over the mappings, once at the end of the task.
+"""
+from django.db.models import Count
+from simulator.models import Category, PersonaSubCategoryMapping, SubCategory
+
+BULK_UPDATE_BATCH_SIZE = 500
+
+
+class SubCategoryResolver:
+    """
+    (category name, subcategory name) -> SubCategory of one city.
+    """
+    def __init__(self, city_name):
+        self.city_name = city_name
+        self.categories = {
+            category.name: category for category in Category.objects.filter(city=city_name)
+        }
+        self.subcategories = {}
+        self._remember(SubCategory.objects.filter(city=city_name))
+
+    def _remember(self, subcategories):
+        for subcategory in subcategories.select_related('category'):
+            self.subcategories[(subcategory.category.name, subcategory.name)] = subcategory
+
+    def __getitem__(self, key):
+        return self.subcategories[key]
+
+    def add_missing(self, keys):
+        """
+        Creates the categories and subcategories of `keys` that do not exist yet, with
+        one bulk insert each.
+        """
+        missing = {key for key in keys if key not in self.subcategories}
+        if not missing:
+            return
+
+        new_categories = {category_name for category_name, _ in missing} - self.categories.keys()
+        if new_categories:
+            Category.objects.bulk_create([
+                Category(
+                    name=category_name,
+                    city=self.city_name,
+                    description=f'Demographic category for {category_name}'
+                )
+                for category_name in sorted(new_categories)
+            ], ignore_conflicts=True)
+            # Conflicting rows are not returned with their ids: read them back
+            self.categories.update({
+                category.name: category
+                for category in Category.objects.filter(city=self.city_name, name__in=new_categories)
+            })
+
+        SubCategory.objects.bulk_create([
+            SubCategory(
+                category=self.categories[category_name],
+                name=subcategory_name,
+                city=self.city_name,
+                percentage=0.0,
+                description=f'Subcategory {subcategory_name} under {category_name}'
+            )
+            for category_name, subcategory_name in sorted(missing)
+        ], ignore_conflicts=True)
+        self._remember(SubCategory.objects.filter(
+            city=self.city_name,
+            category__in=[self.categories[category_name] for category_name, _ in missing],
+            name__in={subcategory_name for _, subcategory_name in missing}
+        ))
+
+
+def recompute_subcategory_percentages(city_name, category_names):
+    """
+    Sets each subcategory's percentage to its share of the personas mapped to its
+    category. Categories without mappings keep their percentages.
+
+    Returns:
+        int: The number of subcategories updated
+    """
+    subcategories = list(SubCategory.objects.filter(
+        city=city_name, category__name__in=category_names, category__city=city_name
+    ))
+    counts = dict(
+        PersonaSubCategoryMapping.objects.filter(
+            subcategory__city=city_name,
+            subcategory__category__name__in=category_names,
+            subcategory__category__city=city_name
+        )
+        .values('subcategory_id')
+        .annotate(personas=Count('id'))
+        .values_list('subcategory_id', 'personas')
+    )
+
+    totals = {}
+    for subcategory in subcategories:
+        totals[subcategory.category_id] = totals.get(subcategory.category_id, 0) + counts.get(subcategory.id, 0)
+
+    updated = []
+    for subcategory in subcategories:
+        total = totals[subcategory.category_id]
+        if total:
+            subcategory.percentage = round(counts.get(subcategory.id, 0) / total * 100, 2)
+            updated.append(subcategory)
+    SubCategory.objects.bulk_update(updated, ['percentage'], batch_size=BULK_UPDATE_BATCH_SIZE)
+    return len(updated)
@@ -0,0 +1,196 @@
+"""
+Response and demographic summaries of an aggregation.
+
+The summaries stored on AggregateEmotion have the shape built by `build_summaries`:
+
+- `response_summary`: {response id: {"response_text", "count", "percentage"}};
+- `demographic_summary`: {category name: {lowercase subcategory name: {response id: ...}}}.
+
+`compute_summaries` rebuilds both for a (news item, city) straight from the stored
+EmotionalResponse rows, with one GROUP BY query per summary, so they are exact after
+a partial or crashed run and do not depend on what a worker held in memory.
+`recompute_aggregate_emotion` stores the result on an AggregateEmotion; the
+`recompute_summaries` management command runs it from the shell.
+
+While a run is in progress, `PartialSummaryPublisher` stores the summaries of the
+responses written so far under `summary['partial']`, at most every
+`AGGREGATION_PARTIAL_SUMMARY_SECONDS`; fetch_summary_api returns them flagged as partial.
+
+Percentages are computed for all groups at once by `calculate_percentages`.
+"""
+import time
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Prefetch
+from django.utils import timezone
+from simulator.models import AggregateEmotion, Category, EmotionalResponse, PossibleUserResponses, SubCategory
+
+DEFAULT_PARTIAL_SUMMARY_SECONDS = 10
+
+
+def build_summaries(city_name, possible_responses):
+    """
+    Returns empty (response_summary, demographic_summary) structures with a zero count
+    for every possible response, overall and per category/subcategory.
+    """
+    categories = Category.objects.filter(city=city_name).prefetch_related(
+        Prefetch('subcategories', queryset=SubCategory.objects.filter(city=city_name))
+    )
+
+    # Initialize demographic summary structure
+    demographic_summary = {}
+    for category in categories:
+        demographic_summary[category.name] = {}
+        for subcategory in category.subcategories.all():
+            # Use lowercase for consistency
+            demographic_summary[category.name][subcategory.name.lower()] = {
+                response.id: {
+                    "response_text": response.response_text,
+                    "count": 0,
+                    "percentage": 0.0
+                }
+                for response in possible_responses
+            }
+
+    # Initialize response summary
+    response_summary = {
+        response.id: {
+            "response_text": response.response_text,
+            "count": 0,
+            "percentage": 0.0
+        }
+        for response in possible_responses
+    }
+    return response_summary, demographic_summary
+
+
+def calculate_percentages(response_summary, demographic_summary, total_responses):
+    """
+    Fills in the percentages of the summaries from their counts.
+
+    Overall percentages are relative to total_responses, demographic ones to the
+    subcategory's own total; groups without answers keep their percentages.
+    """
+    groups = [response_summary] + [
+        responses
+        for subcategories in demographic_summary.values()
+        for responses in subcategories.values()
+    ]
+    response_ids = list(response_summary)
+    if not response_ids:
+        return
+
+    counts = np.array(
+        [[group[response_id]['count'] for response_id in response_ids] for group in groups],
+        dtype=np.float64
+    )
+    totals = counts.sum(axis=1)
+    totals[0] = total_responses
+    answered = totals > 0
+    percentages = np.zeros_like(counts)
+    percentages[answered] = np.round(counts[answered] / totals[answered, None] * 100, 2)
+
+    for group, row, has_answers in zip(groups, percentages.tolist(), answered):
+        if not has_answers:
+            continue
+        for response_id, percentage in zip(response_ids, row):
+            group[response_id]['percentage'] = percentage
+
+
+def compute_summaries(news_item, city_name):
+    """
+    Builds both summaries of a news item in a city from the stored EmotionalResponse rows.
+
+    Returns:
+        tuple: (response_summary, demographic_summary, total_responses)
+    """
+    possible_responses = PossibleUserResponses.objects.filter(news_item=news_item)
+    response_summary, demographic_summary = build_summaries(city_name, possible_responses)
+
+    answers = EmotionalResponse.objects.filter(
+        news_item=news_item, persona__city=city_name, user_response__isnull=False
+    )
+
+    total_responses = 0
+    for row in answers.values('user_response_id').annotate(count=Count('id')).order_by():
+        if row['user_response_id'] in response_summary:
+            response_summary[row['user_response_id']]['count'] = row['count']
+            total_responses += row['count']
+
+    demographic_counts = answers.filter(
+        persona__subcategory_mappings__subcategory__city=city_name
+    ).values(
+        'persona__subcategory_mappings__subcategory__category__name',
+        'persona__subcategory_mappings__subcategory__name',
+        'user_response_id',
+    ).annotate(count=Count('id')).order_by()
+    for row in demographic_counts:
+        subcategories = demographic_summary.get(row['persona__subcategory_mappings__subcategory__category__name'], {})
+        responses = subcategories.get(row['persona__subcategory_mappings__subcategory__name'].lower())
+        if responses is not None and row['user_response_id'] in responses:
+            # Subcategory names only differing in case share one lowercase key
+            responses[row['user_response_id']]['count'] += row['count']
+
+    calculate_percentages(response_summary, demographic_summary, total_responses)
+    return response_summary, demographic_summary, total_responses
+
+
+def recompute_aggregate_emotion(aggregate_emotion):
+    """
+    Replaces the summaries of an AggregateEmotion with ones computed from its stored
+    responses. Other summary keys, such as the status, are kept.
+
+    Returns:
+        int: The number of responses counted
+    """
+    response_summary, demographic_summary, total_responses = compute_summaries(
+        aggregate_emotion.news_item, aggregate_emotion.city
+    )
+    aggregate_emotion.summary = {
+        **(aggregate_emotion.summary or {}),
+        "total_responses": total_responses,
+        "response_summary": response_summary,
+    }
+    aggregate_emotion.demographic_summary = demographic_summary
+    aggregate_emotion.save(update_fields=['summary', 'demographic_summary', 'updated_at'])
+    return total_responses
+
+
+class PartialSummaryPublisher:
+    """
+    Publishes the summaries of a running aggregation under summary['partial'].
+
+    Called with the number of rows written (e.g. as an EmotionalResponseWriter
+    on_flush callback); publishes at most once per interval.
+    """
+    def __init__(self, aggregate_emotion, interval=None, clock=time.monotonic):
+        self.aggregate_emotion = aggregate_emotion
+        self.interval = interval if interval is not None else getattr(
+            settings, 'AGGREGATION_PARTIAL_SUMMARY_SECONDS', DEFAULT_PARTIAL_SUMMARY_SECONDS
+        )
+        self._clock = clock
+        self._last_published = clock()
+
+    def __call__(self, written):
+        if self._clock() - self._last_published >= self.interval:
+            self.publish()
+
+    def publish(self):
+        """Computes and stores the partial summaries now."""
+        self._last_published = self._clock()
+        response_summary, demographic_summary, total_responses = compute_summaries(
+            self.aggregate_emotion.news_item, self.aggregate_emotion.city
+        )
+        self.aggregate_emotion.summary = {
+            **self.aggregate_emotion.summary,
+            "partial": {
+                "total_responses": total_responses,
+                "response_summary": response_summary,
+                "demographic_summary": demographic_summary,
+                "updated_at": timezone.now().isoformat(),
+            }
+        }
+        # Only the summary: processed_responses is advanced concurrently by the writer
+        AggregateEmotion.objects.filter(id=self.aggregate_emotion.id).update(
+            summary=self.aggregate_emotion.summary
+        )
@@ -0,0 +1,160 @@
+"""
+Surrogate classifier predicting persona answers from a labeled subset.
+
+Answers are largely driven by demographics. In 'surrogate' mode the aggregation worker
+asks the LLM for a stratified subset of the personas only and predicts the others with
+a local model, in NumPy:
+
+- features are the persona's subcategories (one-hot) plus a TF-IDF vector of its
+  personality description, hashed into HASH_FEATURES buckets (`build_features`);
+- `SoftmaxRegression` (multinomial logistic regression, L2-regularized) predicts the
+  selected response and ridge regression (`fit_ridge`) the intensity;
+- before the final fit, HOLDOUT of the labeled personas is held out to report the
+  accuracy, log loss and expected calibration error (`holdout_metrics`);
+- personas whose predicted response has a probability below THRESHOLD are escalated
+  to the LLM (at most MAX_ESCALATIONS, least confident first).
+
+Predicted rows are stored as regular EmotionalResponse rows whose explanation starts
+with PREDICTED_EXPLANATION, so they are never used as training labels. Settings come
+from the AGGREGATION_SURROGATE dict, merged over DEFAULT_SURROGATE_SETTINGS.
+"""
+import hashlib
+import numpy as np
+from django.conf import settings
+from simulator.utils.archetypes import TOKEN_PATTERN
+
+DEFAULT_SURROGATE_SETTINGS = {
+    # Personas labeled by the LLM before training
+    'LABELED': 500,
+    # Share of the labeled personas held out to measure accuracy and calibration
+    'HOLDOUT': 0.2,
+    # Predictions less probable than this are escalated to the LLM
+    'THRESHOLD': 0.6,
+    'MAX_ESCALATIONS': 1000,
+    'HASH_FEATURES': 256,
+    'L2': 1e-3,
+}
+
+PREDICTED_EXPLANATION = "Predicted by the surrogate model"
+CALIBRATION_BINS = 10
+
+
+def get_surrogate_settings():
+    """Returns the surrogate settings merged over the defaults."""
+    return {**DEFAULT_SURROGATE_SETTINGS, **getattr(settings, 'AGGREGATION_SURROGATE', {})}
+
+
+def build_features(persona_ids, descriptions, demographic_index, hash_features):
+    """
+    Returns the feature matrix of the personas: one column per subcategory of the city,
+    then `hash_features` L2-normalized TF-IDF columns of the descriptions.
+    """
+    n_personas = len(persona_ids)
+    n_subcategories = len(demographic_index.subcategory_names)
+    features = np.zeros((n_personas, n_subcategories + hash_features), dtype=np.float32)
+
+    for row, codes in enumerate(demographic_index.subcategory_sets(persona_ids)):
+        features[row, list(codes)] = 1.0
+
+    if hash_features:
+        buckets = {}
+        term_counts = np.zeros((n_personas, hash_features), dtype=np.float32)
+        for row, description in enumerate(descriptions):
+            for token in TOKEN_PATTERN.findall((description or '').lower()):
+                bucket = buckets.get(token)
+                if bucket is None:
+                    digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+                    bucket = buckets[token] = int.from_bytes(digest, 'big') % hash_features
+                term_counts[row, bucket] += 1
+        document_frequency = (term_counts > 0).sum(axis=0)
+        idf = np.log((1 + n_personas) / (1 + document_frequency)) + 1
+        tfidf = np.log1p(term_counts) * idf
+        norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+        features[:, n_subcategories:] = tfidf / np.where(norms > 0, norms, 1)
+    return features
+
+
+def _with_bias(features):
+    return np.hstack([features, np.ones((len(features), 1), dtype=features.dtype)])
+
+
+class SoftmaxRegression:
+    """
+    Multinomial logistic regression fitted by full-batch gradient descent.
+    """
+    def __init__(self, n_classes, l2=1e-3, learning_rate=0.5, iterations=500):
+        self.n_classes = n_classes
+        self.l2 = l2
+        self.learning_rate = learning_rate
+        self.iterations = iterations
+        self.weights = None
+
+    def fit(self, features, labels):
+        """Fits the model to class indices `labels`."""
+        inputs = _with_bias(features).astype(np.float64)
+        targets = np.eye(self.n_classes)[labels]
+        self.weights = np.zeros((inputs.shape[1], self.n_classes))
+        for _ in range(self.iterations):
+            gradient = inputs.T @ (self._softmax(inputs @ self.weights) - targets) / len(inputs)
+            gradient[:-1] += self.l2 * self.weights[:-1]
+            self.weights -= self.learning_rate * gradient
+        return self
+
+    def predict_proba(self, features):
+        return self._softmax(_with_bias(features).astype(np.float64) @ self.weights)
+
+    @staticmethod
+    def _softmax(scores):
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exponentials = np.exp(scores)
+        return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+
+def fit_ridge(features, targets, l2=1e-3):
+    """Returns the ridge regression weights (bias last) predicting `targets`."""
+    inputs = _with_bias(features).astype(np.float64)
+    regularization = l2 * np.eye(inputs.shape[1])
+    regularization[-1, -1] = 0
+    return np.linalg.solve(inputs.T @ inputs + regularization, inputs.T @ targets)
+
+
+def predict_ridge(weights, features):
+    return _with_bias(features).astype(np.float64) @ weights
+
+
+def calibration_error(probabilities, labels, bins=CALIBRATION_BINS):
+    """
+    Expected calibration error: the gap between confidence and accuracy, averaged over
+    confidence bins weighted by their size.
+    """
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    bin_ids = np.minimum((confidence * bins).astype(int), bins - 1)
+    error = 0.0
+    for bin_id in np.unique(bin_ids):
+        in_bin = bin_ids == bin_id
+        error += in_bin.mean() * abs(correct[in_bin].mean() - confidence[in_bin].mean())
+    return float(error)
+
+
+def holdout_metrics(features, labels, n_classes, holdout, l2, seed=None):
+    """
+    Trains on the labeled personas minus a random holdout share and evaluates on it.
+
+    Returns:
+        dict: holdout size, accuracy, log loss and calibration error; None when there
+        are too few labeled personas to hold any out
+    """
+    n_holdout = int(len(labels) * holdout)
+    if n_holdout < 1 or n_holdout >= len(labels):
+        return None
+    order = np.random.default_rng(seed).permutation(len(labels))
+    test, train = order[:n_holdout], order[n_holdout:]
+    model = SoftmaxRegression(n_classes, l2=l2).fit(features[train], labels[train])
+    probabilities = model.predict_proba(features[test])
+    return {
+        "holdout_size": n_holdout,
+        "accuracy": round(float((probabilities.argmax(axis=1) == labels[test]).mean()), 4),
+        "log_loss": round(float(-np.log(np.maximum(probabilities[np.arange(n_holdout), labels[test]], 1e-12)).mean()), 4),
+        "calibration_error": round(calibration_error(probabilities, labels[test]), 4),
+    }
@@ -36,6 +36,7 @@ import json
 from django.shortcuts import render, redirect
 from django.http import JsonResponse
 from django.contrib import messages
+from django.db import transaction
 from simulator.models import (
     Persona,Category, PersonaGenerationTask, PossibleUserResponses,
     SubCategory,
@@ -47,6 +48,7 @@ from simulator.models import (
 )
 from simulator.utils.results_visualization_helper import create_demographic_charts
 from simulator.utils.impact_assesment_helper import generate_optimal_response
+from simulator.utils.job_queue import AGGREGATION_JOB, PERSONA_GENERATION_JOB, enqueue
 from simulator.auth_views import login_required
 import time
 from django.urls import reverse
@@ -230,6 +232,7 @@ def persona_input(request):
                     status='pending',
                     csv_file=csv_file
                 )
+                enqueue(PERSONA_GENERATION_JOB, task.id)
                 
                 messages.success(
                     request,
@@ -325,12 +328,13 @@ def demographics_input(request):
             messages.error(request, "Population is required. Please start from the beginning.")
             return redirect("persona_input")
 
-        # Create a persona generation task
-        PersonaGenerationTask.objects.create(
+        # Create a persona generation task and queue it for the workers
+        task = PersonaGenerationTask.objects.create(
             city_name=city_name,
             population=population,
             status='pending'
         )
+        enqueue(PERSONA_GENERATION_JOB, task.id)
         
         time.sleep(2)
 
@@ -440,16 +444,25 @@ def aggregate_emotion(request):
             # Otherwise, use the count of all personas
             total_persona_count = original_task.population if original_task and original_task.population else all_personas.count()
 
-            # Create or update the AggregateEmotion object with the initial values
-            aggregate_emotion_obj, _ = AggregateEmotion.objects.update_or_create(
-                news_item=news_item,
-                city=city_name,
-                defaults={
-                    "summary": initial_summary,
-                    "demographic_summary": initial_demographic_summary,
-                    "total_responses": total_persona_count,
-                },
-            )
+            with transaction.atomic():
+                # A new aggregation starts over. Workers skip personas that already
+                # answered only to resume this run after a crash, so the answers of an
+                # earlier run must not be taken for this one's
+                EmotionalResponse.objects.filter(news_item=news_item, persona__city=city_name).delete()
+
+                # Create or update the AggregateEmotion object with the initial values
+                aggregate_emotion_obj, _ = AggregateEmotion.objects.update_or_create(
+                    news_item=news_item,
+                    city=city_name,
+                    defaults={
+                        "summary": initial_summary,
+                        "demographic_summary": initial_demographic_summary,
+                        "total_responses": total_persona_count,
+                        "processed_responses": 0,
+                    },
+                )
+            # Queue (or re-queue, for a repeated aggregation) the job for the workers
+            enqueue(AGGREGATION_JOB, aggregate_emotion_obj.id)
 
             request.session["city_name"] = city_name
             request.session["news_item"] = news_item_title
@@ -470,6 +483,9 @@ def fetch_summary_api(request):
     """
     Fetches the emotional summary and demographic breakdown for a specific city and news item.
     Returns JSON response with the status, summary, and demographic details.
+
+    While the aggregation is processing, the latest partial summaries (if any were
+    published yet) are returned along with the progress, flagged with `partial: true`.
     """
     logger.info("Fetch summary API request received")
     city = request.GET.get('city')
@@ -481,7 +497,8 @@ def fetch_summary_api(request):
             news_item__title__icontains=news_item.strip()
         )
         
-        if aggregate_emotion.summary.get('total_responses', 0) > 0:
+        summary = aggregate_emotion.summary
+        if summary.get('status') != 'Processing' and summary.get('total_responses', 0) > 0:
             return JsonResponse({
                 "status": "completed",
                 "summary": aggregate_emotion.summary,
@@ -497,6 +514,19 @@ def fetch_summary_api(request):
             "total_responses": total_responses,
             "processed_responses": processed_responses
         }
+        partial = summary.get('partial')
+        if partial:
+            context.update({
+                "partial": True,
+                "summary": {
+                    "total_responses": partial['total_responses'],
+                    "response_summary": partial['response_summary'],
+                },
+                "demographic_summary": partial['demographic_summary'],
+                "updated_at": partial['updated_at'],
+                "city": city,
+                "news_item": news_item
+            })
         return JsonResponse(context)
 
     # except AggregateEmotion.DoesNotExist: